@@ -0,0 +1,124 @@
+# Асинхронный CRUD для asyncio-сервисов (например, интеграции с кассами)
+# AsyncCRUDOperations повторяет методы CRUDOperations (продажи, сток, каталог, отчеты), но они - корутины:
+#   crud = AsyncCRUDOperations(dbname='bookstore', user='postgres', password='...')
+#   sale = await crud.create_sale(stock_id, price=450)
+#   rows = await crud.read_sales(shop_id=3, flat=True)
+#   await engine_registry.dispose_async_all()   # при остановке сервиса
+# Логика не дублируется: синхронный метод CRUDOperations выполняется через AsyncSession.run_sync
+# в greenlet на асинхронном соединении - ожидание БД не занимает поток, одновременных запросов
+# может быть сколько угодно, в БД они идут через пул движка (pool_size + max_overflow)
+# Нужны драйвер asyncpg и пакет greenlet
+
+import asyncio
+import functools
+from inspect import isfunction
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.util import await_only
+
+import engine_registry
+from config_handler import ConfigHandler
+from db_handler import CRUDOperations, Sale
+import sales_export
+
+
+# Методы CRUDOperations, которых нет в асинхронном варианте:
+# with_session - своя сессия задается иначе, iter_sales - отдельная асинхронная версия,
+# export_sales - запись файла блокировала бы цикл событий
+ASYNC_EXCLUDED_METHODS = {'with_session', 'iter_sales', 'export_sales'}
+
+# Состояние БД, которое CRUDOperations определяет при первом обращении (индексы поиска, витрина, журнал стока)
+CRUD_STATE_ATTRS = ('_search_indexes', '_sales_daily', '_stock_ledger')
+
+
+def _async_sleep(delay):
+    """Пауза перед повтором транзакции внутри run_sync: ждет asyncio.sleep, не блокируя цикл событий"""
+    await_only(asyncio.sleep(delay))
+
+
+class AsyncCRUDOperations:
+    """
+    Асинхронный вариант CRUDOperations на create_async_engine / AsyncSession
+    Каждый вызов - своя короткая сессия (как у синхронного CRUD), объекты читаются и после ее закрытия
+    """
+
+    def __init__(self, dbname="postgres", host="127.0.0.1", user="postgres", password="****", port=5432,
+                 driver="asyncpg", **engine_options):
+        self.engine = engine_registry.get_async_engine(
+            f"postgresql+{driver}://{user}:{password}@{host}:{port}/{dbname}", **engine_options)
+        self.Session = async_sessionmaker(self.engine, expire_on_commit=False)
+
+        # Синхронный CRUD без своей сессии: каждый вызов получает копию with_session
+        self._crud = CRUDOperations(None)
+        self._crud._sleep = _async_sleep
+        self.ref_cache = self._crud.ref_cache
+
+    async def _call(self, name, args, kwargs):
+        """Выполняет метод CRUDOperations в новой AsyncSession"""
+        def run(sync_session):
+            crud = self._crud.with_session(sync_session)
+            try:
+                return getattr(crud, name)(*args, **kwargs)
+            finally:
+                # Найденное копией состояние БД сохраняем для следующих вызовов
+                for attr in CRUD_STATE_ATTRS:
+                    setattr(self._crud, attr, getattr(crud, attr))
+
+        async with self.Session() as session:
+            return await session.run_sync(run)
+
+    async def iter_sales(self, batch_size=sales_export.EXPORT_BATCH_SIZE, **filters):
+        """
+        Потоковое чтение продаж (async for), фильтры - как у read_sales
+        Строки читаются серверным курсором пачками по batch_size
+        """
+        def build(sync_session):
+            crud = self._crud.with_session(sync_session)
+            return crud._filter_sales(crud._sales_rows_query(), **filters).order_by(Sale.id).statement
+
+        async with self.Session() as session:
+            statement = await session.run_sync(build)
+            result = await session.stream(statement, execution_options={'yield_per': batch_size})
+            async for row in result:
+                yield row
+
+
+def _async_method(name, method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        return await self._call(name, args, kwargs)
+    return wrapper
+
+
+# Корутины с теми же именами и параметрами, что у публичных методов CRUDOperations
+for _name, _method in list(vars(CRUDOperations).items()):
+    if not _name.startswith('_') and _name not in ASYNC_EXCLUDED_METHODS and isfunction(_method):
+        setattr(AsyncCRUDOperations, _name, _async_method(_name, _method))
+
+
+async def _smoke(config_file='config.ini'):
+    """
+    Проверка на БД из config.ini: чтение, запись (продажа и ее отмена - остаток не меняется) и iter_sales
+    Запуск: python async_db_handler.py
+    """
+    crud = AsyncCRUDOperations(**ConfigHandler(config_file).get_db_config())
+    try:
+        shops = await crud.read_shops(flat=True)
+        print(f"Магазинов: {len(shops)}")
+        stocks = await crud.read_stock_by_shop(shops[0].id, flat=True) if shops else []
+        in_stock = next((stock for stock in stocks if stock.count > 0), None)
+        if in_stock:
+            sale = await crud.create_sale(in_stock.id, price=1)
+            print(f"Продажа {sale.id} создана, отменена: {await crud.delete_sale(sale.id)}")
+        else:
+            print("Нет стока с остатком - запись не проверена")
+        count = 0
+        async for _ in crud.iter_sales(batch_size=100):
+            count += 1
+        print(f"Продаж прочитано потоком: {count}")
+    finally:
+        await engine_registry.dispose_async_all()
+
+
+if __name__ == '__main__':
+    asyncio.run(_smoke())
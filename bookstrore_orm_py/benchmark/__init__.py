@@ -0,0 +1,5 @@
+# Нагрузочный бенчмарк магазина книг на локальном PostgreSQL
+# Запуск из каталога bookstrore_orm_py:
+#   python -m benchmark --publishers 200 --books 20000 --shops 50 --sales 1000000 -o bench.json
+# Набор загружается только в пустую БД; повторный запуск - с --truncate (данные БД удаляются) или --skip-generate
+# datagen - синтетические данные через COPY, runner - замеры горячих CRUD-методов
@@ -0,0 +1,125 @@
+# Запуск бенчмарка: python -m benchmark [параметры] (из каталога bookstrore_orm_py)
+# Отчет JSON содержит коммит, параметры набора, версию сервера и замеры - файлы разных коммитов
+# можно сравнивать между собой
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import query_stats
+from config_handler import ConfigHandler
+from db_handler import DBSession
+from benchmark.datagen import DEFAULT_SCALE, DataGenerator
+from benchmark.runner import BenchmarkRunner
+
+
+def git_revision():
+    """Текущий коммит и признак незафиксированных изменений (None вне git)"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout
+        dirty = subprocess.run(['git', 'status', '--porcelain'], capture_output=True, text=True, check=True).stdout
+        return {'commit': commit.strip(), 'dirty': bool(dirty.strip())}
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    db_config = ConfigHandler().get_db_config()
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description="Нагрузочный бенчмарк БД книжных магазинов")
+    parser.add_argument('--host', default=db_config['host'])
+    parser.add_argument('--port', type=int, default=db_config['port'])
+    parser.add_argument('--user', default=db_config['user'])
+    parser.add_argument('--password', default=db_config['password'])
+    parser.add_argument('--dbname', default='bookstore_bench', help="БД бенчмарка (создается при отсутствии)")
+
+    parser.add_argument('--skip-generate', action='store_true', help="Использовать уже загруженный набор")
+    parser.add_argument('--truncate', action='store_true',
+                        help="Пересоздать таблицы, даже если в БД уже есть данные (они будут удалены)")
+    parser.add_argument('--partitioned', action='store_true', help="Таблица sales секционирована по месяцам")
+    parser.add_argument('--stock-ledger', action='store_true', help="Остатки через журнал движения стока")
+    parser.add_argument('--sales-cache', action='store_true', help="Аналитика по колоночному кэшу продаж в памяти")
+    parser.add_argument('--seed', type=int, default=42)
+    for name, default in DEFAULT_SCALE.items():
+        parser.add_argument('--' + name.replace('_', '-'), dest=name, type=type(default), default=default)
+
+    parser.add_argument('--repeat', type=int, default=10, help="Повторов каждого сценария чтения")
+    parser.add_argument('--workers', type=int, default=8, help="Потоков в сценарии конкурентных продаж")
+    parser.add_argument('--sales-per-worker', type=int, default=200)
+    parser.add_argument('--hot-stocks', type=int, default=50, help="Число стоков, за которые конкурируют продажи")
+    parser.add_argument('-o', '--output', default='benchmark_report.json', help="Файл отчета JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = dict(host=args.host, port=args.port, user=args.user, password=args.password)
+
+    db = DBSession(dbname='postgres', **server)
+    if not db.is_connected():
+        print("Нет подключения к PostgreSQL")
+        return 1
+    if not db.db_exists(args.dbname):
+        db.create_db(args.dbname)
+        args.skip_generate = False  # Пустую БД нужно заполнить
+    db = DBSession(dbname=args.dbname, **server)
+
+    scale = {name: getattr(args, name) for name in DEFAULT_SCALE}
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git': git_revision(),
+        'python': platform.python_version(),
+        'dataset': {'seed': args.seed, **scale},
+    }
+    with db.engine.connect() as conn:
+        report['server_version'] = conn.execute(text("SHOW server_version")).scalar()
+
+    if not args.skip_generate:
+        generator = DataGenerator(db, seed=args.seed, **scale)
+        filled = generator.non_empty_tables()
+        if filled and not args.truncate:
+            # Чужую БД не очищаем: данные удаляются только по явному --truncate
+            print(f"В БД {args.dbname} уже есть данные ({', '.join(filled)}): укажите --truncate, чтобы удалить их, "
+                  f"или --skip-generate, чтобы использовать загруженный набор")
+            return 1
+        # Таблицы пересоздаются, чтобы набор и вид таблицы sales зависели только от параметров
+        db.drop_tables()
+        db.create_tables(partition_sales=args.partitioned, stock_ledger=args.stock_ledger)
+        if args.partitioned:
+            db.ensure_sales_partitions(start=datetime.now() - timedelta(days=args.days))
+        report['dataset']['rows'] = generator.generate(truncate=args.truncate)
+        db.rebuild_sales_daily()  # Продажи загружены мимо CRUD - витрину считаем целиком
+    report['dataset']['partitioned'] = db.is_sales_partitioned()
+    report['dataset']['stock_ledger'] = db.is_stock_ledger()
+
+    runner = BenchmarkRunner(db, repeat=args.repeat, seed=args.seed)
+    if args.sales_cache:
+        from sales_column_cache import SalesColumnCache
+        runner.crud.sales_cache = SalesColumnCache(runner.crud)
+        started = time.perf_counter()
+        report['dataset']['sales_cache_rows'] = runner.crud.sales_cache.refresh()
+        report['dataset']['sales_cache_load_s'] = round(time.perf_counter() - started, 3)
+
+    # Статистика запросов - только по сценариям, без загрузки данных
+    query_stats.STATS.reset()
+    report['reads'] = runner.run_reads()
+    report['concurrent_create_sale'] = runner.run_concurrent_sales(
+        workers=args.workers,
+        sales_per_worker=args.sales_per_worker,
+        hot_stocks=args.hot_stocks
+    )
+    report['query_stats'] = query_stats.STATS.to_dict()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Отчет сохранен: {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# Генератор синтетического набора данных: издатели, книги, магазины, матрица стока
+# и история продаж с распределением Ципфа (немногие книги дают большую часть продаж)
+# Все таблицы заполняются через COPY FROM STDIN, строки формируются по мере чтения
+
+import csv
+import io
+import random
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+
+# Параметры набора по умолчанию
+DEFAULT_SCALE = {
+    'publishers': 100,
+    'books': 10000,
+    'shops': 20,
+    'stock_density': 0.3,  # Доля книг каталога в каждом магазине
+    'sales': 200000,
+    'days': 365,           # Глубина истории продаж
+    'zipf_s': 1.1,         # Показатель распределения Ципфа
+}
+
+# Остаток в стоке берется с запасом, чтобы продажи бенчмарка не упирались в ноль
+STOCK_COUNT_RANGE = (1000, 100000)
+PRICE_RANGE = (100, 3000)
+
+TABLES = ('sales', 'stocks', 'books', 'shops', 'publishers')
+
+
+class _CsvStream:
+    """Файлоподобный поток CSV для copy_expert из итератора кортежей"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+        self._pending = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer.seek(0)
+            self._buffer.truncate()
+            self._writer.writerow(row)
+            self._pending += self._buffer.getvalue()
+            self.count += 1
+        if size < 0:
+            chunk, self._pending = self._pending, ''
+        else:
+            chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+
+def zipf_cum_weights(n, s):
+    """Накопленные веса Ципфа для рангов 1..n (для random.choices)"""
+    return list(accumulate(1.0 / rank ** s for rank in range(1, n + 1)))
+
+
+class DataGenerator:
+    """
+    Заполняет таблицы модели синтетическими данными; таблицы с данными очищаются только при truncate=True
+    Генерация детерминирована: одинаковые seed и параметры дают одинаковый набор
+    """
+
+    def __init__(self, db_session, seed=42, progress=print, **scale):
+        unknown = set(scale) - set(DEFAULT_SCALE)
+        if unknown:
+            raise ValueError(f"Неизвестные параметры набора: {', '.join(sorted(unknown))}")
+        self.engine = db_session.engine
+        self.scale = {**DEFAULT_SCALE, **scale}
+        self.seed = seed
+        self.progress = progress
+
+    def non_empty_tables(self):
+        """Таблицы набора, в которых уже есть строки"""
+        conn = self.engine.raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                return self._non_empty_tables(cursor)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _non_empty_tables(cursor):
+        filled = []
+        for table in TABLES:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+            if not cursor.fetchone()[0]:
+                continue
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+            if cursor.fetchone()[0]:
+                filled.append(table)
+        return filled
+
+    def generate(self, truncate=False):
+        """
+        Загружает новый набор одной транзакцией, возвращает число строк по таблицам
+        Если в таблицах уже есть данные - ValueError, с truncate=True они удаляются (TRUNCATE ... CASCADE)
+        """
+        rnd = random.Random(self.seed)
+        scale = self.scale
+        counts = {}
+
+        conn = self.engine.raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                filled = self._non_empty_tables(cursor)
+                if filled and not truncate:
+                    raise ValueError(f"В таблицах уже есть данные: {', '.join(filled)}")
+                if filled:
+                    cursor.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+
+                counts['publishers'] = self._copy(cursor, 'publishers', ('id', 'name'), (
+                    (i, f"Издатель {i}") for i in range(1, scale['publishers'] + 1)))
+
+                counts['books'] = self._copy(cursor, 'books', ('id', 'title', 'id_publisher'), (
+                    (i, f"Книга {i}", rnd.randint(1, scale['publishers'])) for i in range(1, scale['books'] + 1)))
+
+                counts['shops'] = self._copy(cursor, 'shops', ('id', 'name'), (
+                    (i, f"Магазин {i}") for i in range(1, scale['shops'] + 1)))
+
+                stock_books = self._stock_matrix(rnd)
+                counts['stocks'] = self._copy(cursor, 'stocks', ('id', 'id_shop', 'id_book', 'count'), (
+                    (stock_id, shop_id, book_id, rnd.randint(*STOCK_COUNT_RANGE))
+                    for stock_id, (shop_id, book_id) in enumerate(stock_books, start=1)))
+
+                counts['sales'] = self._copy(cursor, 'sales', ('id', 'id_stock', 'price', 'quantity', 'sale_date'),
+                                             self._sales_rows(rnd, stock_books))
+
+                # Последовательности id после явной вставки ключей
+                for table in TABLES:
+                    cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                   f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)")
+            conn.commit()
+
+            # Статистика планировщика для свежих данных
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                for table in TABLES:
+                    cursor.execute(f"VACUUM ANALYZE {table}")
+            return counts
+
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _copy(self, cursor, table, columns, rows):
+        stream = _CsvStream(rows)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", stream)
+        self.progress(f"{table}: {stream.count}")
+        return stream.count
+
+    def _stock_matrix(self, rnd):
+        """Пары (магазин, книга): в каждом магазине случайная доля каталога"""
+        per_shop = max(1, int(self.scale['books'] * self.scale['stock_density']))
+        books = range(1, self.scale['books'] + 1)
+        return [(shop_id, book_id)
+                for shop_id in range(1, self.scale['shops'] + 1)
+                for book_id in sorted(rnd.sample(books, per_shop))]
+
+    def _sales_rows(self, rnd, stock_books):
+        """
+        Продажи по возрастанию даты (как при реальной записи)
+        Популярность книги - ранг Ципфа в случайной перестановке книг, которые есть в стоке,
+        магазин выбирается равномерно среди магазинов, где книга есть
+        """
+        scale = self.scale
+        stocks_of_book = {}
+        for stock_id, (shop_id, book_id) in enumerate(stock_books, start=1):
+            stocks_of_book.setdefault(book_id, []).append(stock_id)
+
+        ranked_books = sorted(stocks_of_book)
+        rnd.shuffle(ranked_books)
+        cum_weights = zipf_cum_weights(len(ranked_books), scale['zipf_s'])
+        prices = {book_id: rnd.randint(*PRICE_RANGE) for book_id in ranked_books}
+
+        end = datetime.now(timezone.utc).replace(microsecond=0)
+        span = timedelta(days=scale['days']).total_seconds()
+        offsets = sorted(rnd.random() * span for _ in range(scale['sales']))
+
+        for sale_id, offset in enumerate(offsets, start=1):
+            book_id = rnd.choices(ranked_books, cum_weights=cum_weights)[0]
+            sale_date = end - timedelta(seconds=span - offset)
+            quantity = 1 if rnd.random() < 0.8 else rnd.randint(2, 5)
+            yield sale_id, rnd.choice(stocks_of_book[book_id]), prices[book_id], quantity, sale_date.isoformat()
@@ -0,0 +1,127 @@
+# Замеры горячих путей CRUDOperations на сгенерированном наборе
+# Каждый сценарий выполняется repeat раз (после разогрева), в отчет идут min/медиана/p95/max, мс
+
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from db_handler import CRUDOperations
+
+
+def summarize(samples_ms):
+    """Сводка по замерам, мс"""
+    ordered = sorted(samples_ms)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        'runs': len(ordered),
+        'min_ms': round(ordered[0], 3),
+        'median_ms': round(statistics.median(ordered), 3),
+        'p95_ms': round(ordered[p95_index], 3),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+
+class BenchmarkRunner:
+    """Набор сценариев чтения и конкурентной записи продаж"""
+
+    def __init__(self, db_session, repeat=10, warmup=2, seed=42):
+        self.db = db_session
+        self.crud = CRUDOperations(db_session)
+        self.repeat = repeat
+        self.warmup = warmup
+        self.rnd = random.Random(seed)
+
+    def _time(self, fn):
+        """Замеры одного сценария (каждый вызов CRUD - в новой сессии, identity map не накапливается)"""
+        for _ in range(self.warmup):
+            fn()
+        samples = []
+        rows = 0
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            result = fn()
+            samples.append((time.perf_counter() - started) * 1000)
+            rows = len(result) if hasattr(result, '__len__') else rows
+        return {**summarize(samples), 'rows': rows}
+
+    def _ids(self, table):
+        with self.db.engine.connect() as conn:
+            return [row[0] for row in conn.exec_driver_sql(f"SELECT id FROM {table} ORDER BY id")]
+
+    def run_reads(self):
+        """Сценарии чтения: отчеты по продажам и сток магазина"""
+        shop_ids = self._ids('shops')
+        publisher_ids = self._ids('publishers')
+        shop_id = self.rnd.choice(shop_ids)
+        publisher_id = self.rnd.choice(publisher_ids)
+        month_ago = datetime.now() - timedelta(days=30)
+
+        return {
+            'read_sales_shop_month': self._time(
+                lambda: self.crud.read_sales(shop_id=shop_id, start_date=month_ago, flat=True)),
+            'read_sales_publisher': self._time(
+                lambda: self.crud.read_sales(publisher_id=publisher_id, flat=True)),
+            'read_sales_page': self._time(
+                lambda: self.crud.read_sales_page()),
+            'get_top_selling_books': self._time(
+                lambda: self.crud.get_top_selling_books(limit=10)),
+            'get_top_selling_books_shop_month': self._time(
+                lambda: self.crud.get_top_selling_books(limit=10, shop_id=shop_id, start_date=month_ago)),
+            'read_stock_by_shop': self._time(
+                lambda: self.crud.read_stock_by_shop(shop_id)),
+            'read_stock_by_shop_flat': self._time(
+                lambda: self.crud.read_stock_by_shop(shop_id, flat=True)),
+            'read_books': self._time(
+                lambda: self.crud.read_books(publisher_id=publisher_id)),
+            'read_books_flat': self._time(
+                lambda: self.crud.read_books(publisher_id=publisher_id, flat=True)),
+            'read_stock_page': self._time(
+                lambda: self.crud.read_stock_page(shop_id)),
+        }
+
+    def run_concurrent_sales(self, workers=8, sales_per_worker=200, hot_stocks=50):
+        """
+        Конкурентные продажи: workers потоков, каждая продажа - в своей сессии потока
+        Продажи идут по hot_stocks самым первым стокам - проверка конкуренции за одни строки
+        """
+        stock_ids = self._ids('stocks')[:hot_stocks]
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker(seed):
+            rnd = random.Random(seed)
+            local, failed = [], []
+            for _ in range(sales_per_worker):
+                started = time.perf_counter()
+                try:
+                    self.crud.create_sale(rnd.choice(stock_ids), price=rnd.randint(100, 3000))
+                    local.append((time.perf_counter() - started) * 1000)
+                except Exception as e:
+                    failed.append(type(e).__name__)
+            with lock:
+                latencies.extend(local)
+                errors.extend(failed)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(worker, self.rnd.random()) for _ in range(workers)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        result = {
+            'workers': workers,
+            'sales_per_worker': sales_per_worker,
+            'hot_stocks': len(stock_ids),
+            'elapsed_s': round(elapsed, 3),
+            'committed': len(latencies),
+            'failed': len(errors),
+            'failures_by_type': {name: errors.count(name) for name in sorted(set(errors))},
+            'throughput_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        }
+        if latencies:
+            result.update(summarize(latencies))
+        return result
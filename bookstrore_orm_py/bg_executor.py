@@ -0,0 +1,92 @@
+# Фоновое выполнение CRUD-запросов для окон Tkinter
+# Запрос выполняется в пуле потоков (CRUD-методы открывают сессию в своем потоке), результат передается
+# в поток Tk через очередь, которую окно опрашивает через after()
+
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundExecutor:
+    """
+    Пул потоков для CRUD-вызовов окна
+    submit(key, fn, on_done) - fn(crud) выполняется в фоне, on_done(result) - в потоке Tk
+    Новый запрос с тем же key вытесняет предыдущий: его результат отбрасывается
+    """
+    POLL_MS = 50  # Период опроса очереди результатов
+
+    def __init__(self, widget, crud, max_workers=2, on_busy=None):
+        self.widget = widget
+        self.crud = crud
+        self.on_busy = on_busy  # on_busy(True/False) - показать/скрыть индикатор загрузки
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crud")
+        self._results = queue.Queue()
+        self._generations = {}  # key -> номер последнего запроса
+        self._futures = {}      # key -> future последнего запроса
+        self._closed = False
+
+        self.widget.bind("<Destroy>", self._on_destroy, add="+")
+        self.widget.after(self.POLL_MS, self._poll)
+
+    def submit(self, key, fn, on_done, on_error=None):
+        """Ставит fn(crud) в очередь; предыдущий запрос с тем же key отменяется"""
+        if self._closed:
+            return
+        generation = self._generations.get(key, 0) + 1
+        self._generations[key] = generation
+
+        previous = self._futures.get(key)
+        if previous is not None:
+            previous.cancel()  # Еще не начатый запрос просто не выполнится
+
+        self._futures[key] = self._pool.submit(self._run, key, generation, fn, on_done, on_error)
+        self._update_busy()
+
+    def cancel(self, key):
+        """Отменяет запрос: результат последнего запроса с этим key будет отброшен"""
+        self._generations[key] = self._generations.get(key, 0) + 1
+        future = self._futures.pop(key, None)
+        if future is not None:
+            future.cancel()
+        self._update_busy()
+
+    def _run(self, key, generation, fn, on_done, on_error):
+        """Выполняется в рабочем потоке: каждый вызов CRUD - в своей короткой сессии этого потока"""
+        try:
+            result = fn(self.crud)
+            self._results.put((key, generation, on_done, result))
+        except Exception as e:
+            self._results.put((key, generation, on_error, e))
+
+    def _poll(self):
+        """Выполняется в потоке Tk: раздает готовые результаты актуальным запросам"""
+        if self._closed:
+            return
+        while True:
+            try:
+                key, generation, callback, value = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if self._generations.get(key) != generation:
+                continue  # Запрос вытеснен более новым
+            self._futures.pop(key, None)
+            self._update_busy()
+            if callback is not None:
+                callback(value)
+            elif isinstance(value, Exception):
+                print(f"Ошибка фонового запроса: {value}")
+        self.widget.after(self.POLL_MS, self._poll)
+
+    def _update_busy(self):
+        """Показывает индикатор, пока есть незавершенные запросы"""
+        if self.on_busy is not None:
+            self.on_busy(bool(self._futures))
+
+    def _on_destroy(self, event):
+        if event.widget is self.widget:
+            self.shutdown()
+
+    def shutdown(self):
+        """Останавливает опрос и пул; запущенные запросы дорабатывают, результаты отбрасываются"""
+        self._closed = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
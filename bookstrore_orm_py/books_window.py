@@ -1,6 +1,8 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from db_handler import CRUDOperations  # Импорт CRUD
+from db_handler import CRUDOperations, PAGE_SIZE  # Импорт CRUD
+from paged_tree import TreePager
+from bg_executor import BackgroundExecutor
 
 
 class BooksWindow:
@@ -13,6 +15,11 @@ class BooksWindow:
         self.window.title("Справочник книг")
         self.window.geometry("800x600")
 
+        # Запросы к БД выполняются в фоне, пока идут - показываем индикатор загрузки
+        self.loading_label = tk.Label(self.window, text="", fg="gray")
+        self.loading_label.pack(side="bottom", anchor="w", padx=10)
+        self.executor = BackgroundExecutor(self.window, crud, on_busy=self._show_loading)
+
         # Переменные для поиска
         self.search_id_var = tk.StringVar()
         self.search_name_var = tk.StringVar()
@@ -24,6 +31,10 @@ class BooksWindow:
         # Загружаем издателей при открытии
         self.search_books()
 
+    def _show_loading(self, busy):
+        """Индикатор фоновой загрузки"""
+        self.loading_label.config(text="Загрузка..." if busy else "")
+
     def _create_search_frame(self):
         """Создает область поиска"""
         search_frame = tk.LabelFrame(self.window, text="Поиск", padx=5, pady=5)
@@ -67,6 +78,14 @@ class BooksWindow:
         self.tree.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
 
+        # Книги подгружаются страницами при прокрутке
+        self.pager = TreePager(
+            self.tree, scrollbar, self.executor,
+            row_values=lambda book: (book.id, book.title, book.publisher or "Не указан"),
+            cursor_of=lambda book: book.id,
+            page_size=PAGE_SIZE
+        )
+
         # Обработчик двойного клика для редактирования
         self.tree.bind("<Double-1>", self._edit_selected_book)
 
@@ -95,11 +114,7 @@ class BooksWindow:
         ).pack(side="left", padx=5)
 
     def search_books(self):
-        """Выполняет поиск издателей по критериям"""
-        # Очищаем предыдущие результаты
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
+        """Выполняет поиск книг по критериям"""
         # Получаем параметры поиска
         search_id = self.search_id_var.get().strip()
         search_name = self.search_name_var.get().strip()
@@ -116,13 +131,10 @@ class BooksWindow:
         if search_name:
             filters["title"] = search_name
 
-        # Получаем через CRUD
-        books = self.crud.read_books(**filters)
-
-        # Заполняем таблицу
-        for book in books:
-            publisher_name = book.publisher.name if book.publisher else "Не указан"
-            self.tree.insert("", "end", values=(book.id, book.title, publisher_name))
+        # Первая страница через CRUD, остальные - при прокрутке
+        self.pager.reset(
+            lambda crud, after_id: crud.read_books_page(after_id=after_id, **filters)
+        )
 
 
     def _add_book(self):
@@ -140,7 +152,7 @@ class BooksWindow:
         publisher_combobox.grid(row=2, column=1, padx=5, pady=5)
 
         # Заполняем комбобокс издателями
-        publishers = self.crud.read_publishers()
+        publishers = self.crud.read_publisher_refs()
         publisher_names = [p.name for p in publishers]
         publisher_combobox['values'] = publisher_names
         if publisher_names:
@@ -187,7 +199,7 @@ class BooksWindow:
         #book_id = book_data[0]
 
         # Получаем полные данные о книге
-        book = self.crud.get_book_by_id(book_id)
+        book = self.crud.get_book_ref(book_id)
         if not book:
             messagebox.showerror("Ошибка", "Книга не найдена")
             return
@@ -206,13 +218,13 @@ class BooksWindow:
         publisher_combobox.grid(row=2, column=1, padx=5, pady=5)
 
         # Заполняем комбобокс издателями
-        publishers = self.crud.read_publishers()
+        publishers = self.crud.read_publisher_refs()
         publisher_names = [p.name for p in publishers]
         publisher_combobox['values'] = publisher_names
 
         # Устанавливаем текущего издателя
         if book.publisher:
-            publisher_combobox.set(book.publisher.name)
+            publisher_combobox.set(book.publisher)
         elif publisher_names:
             publisher_combobox.current(0)
 
@@ -0,0 +1,259 @@
+# Массовая загрузка каталога (издатели, книги, магазины, сток)
+# Входные данные CSV (с заголовком) или JSONL, поля строки каталога:
+#   publisher - издатель (обязательно)
+#   title     - название книги
+#   shop      - магазин
+#   count     - остаток книги в магазине (нужны title и shop)
+# Строки идут через COPY FROM STDIN во временную staging-таблицу,
+# дальше издатели/книги/магазины/сток обновляются несколькими set-based запросами
+
+import csv
+import io
+import json
+import os
+
+
+# Максимальная длина строк - как в models.py (String(100))
+MAX_NAME_LENGTH = 100
+# Как часто сообщать о прогрессе загрузки (в строках)
+PROGRESS_EVERY = 10000
+
+STAGING_DDL = """
+    CREATE TEMP TABLE import_catalog (
+        line_no   bigint,
+        publisher text NOT NULL,
+        title     text,
+        shop      text,
+        count     integer
+    ) ON COMMIT DROP
+"""
+
+COPY_SQL = "COPY import_catalog (line_no, publisher, title, shop, count) FROM STDIN WITH (FORMAT csv)"
+
+# Издатели, книги и магазины по имени не уникальны - берем запись с наименьшим id
+RESOLVE_SQL = [
+    ('publishers', """
+        INSERT INTO publishers (name)
+        SELECT DISTINCT s.publisher FROM import_catalog s
+        WHERE NOT EXISTS (SELECT 1 FROM publishers p WHERE p.name = s.publisher)
+    """),
+    ('_publisher_ids', """
+        CREATE TEMP TABLE import_publisher_ids ON COMMIT DROP AS
+        SELECT p.name, min(p.id) AS id FROM publishers p
+        WHERE p.name IN (SELECT publisher FROM import_catalog)
+        GROUP BY p.name
+    """),
+    ('books', """
+        INSERT INTO books (title, id_publisher)
+        SELECT DISTINCT s.title, pi.id
+        FROM import_catalog s JOIN import_publisher_ids pi ON pi.name = s.publisher
+        WHERE s.title IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM books b WHERE b.title = s.title AND b.id_publisher = pi.id)
+    """),
+    ('shops', """
+        INSERT INTO shops (name)
+        SELECT DISTINCT s.shop FROM import_catalog s
+        WHERE s.shop IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM shops sh WHERE sh.name = s.shop)
+    """),
+    ('_stock_rows', """
+        CREATE TEMP TABLE import_stock ON COMMIT DROP AS
+        SELECT b.id AS id_book, sh.id AS id_shop, sum(s.count) AS count
+        FROM import_catalog s
+        JOIN import_publisher_ids pi ON pi.name = s.publisher
+        JOIN (SELECT title, id_publisher, min(id) AS id FROM books GROUP BY title, id_publisher) b
+          ON b.title = s.title AND b.id_publisher = pi.id
+        JOIN (SELECT name, min(id) AS id FROM shops GROUP BY name) sh ON sh.name = s.shop
+        WHERE s.count IS NOT NULL
+        GROUP BY b.id, sh.id
+    """),
+    ('stocks_updated', """
+        UPDATE stocks st SET count = i.count
+        FROM import_stock i
+        WHERE st.id_book = i.id_book AND st.id_shop = i.id_shop
+    """),
+    ('stocks_inserted', """
+        INSERT INTO stocks (id_book, id_shop, count)
+        SELECT i.id_book, i.id_shop, i.count FROM import_stock i
+        WHERE NOT EXISTS (SELECT 1 FROM stocks st WHERE st.id_book = i.id_book AND st.id_shop = i.id_shop)
+    """),
+]
+
+# Журнал движения стока включен: импортированный остаток становится снимком стока,
+# движения до него поглощаются (запись движений на время импорта ждет)
+LEDGER_SQL = [
+    ('_lock_movements', "LOCK TABLE stock_movements IN SHARE MODE"),
+    ('stock_snapshots', """
+        INSERT INTO stock_snapshots (id_stock, count, last_movement_id, taken_at)
+        SELECT st.id, i.count,
+               coalesce((SELECT max(m.id) FROM stock_movements m WHERE m.id_stock = st.id), 0), now()
+        FROM import_stock i
+        JOIN stocks st ON st.id_book = i.id_book AND st.id_shop = i.id_shop
+        ON CONFLICT (id_stock) DO UPDATE
+        SET count = excluded.count, last_movement_id = excluded.last_movement_id, taken_at = excluded.taken_at
+    """),
+]
+
+
+def read_records(path, fmt=None):
+    """
+    Читает записи каталога из CSV или JSONL (формат - по расширению файла, если не задан)
+    Возвращает пары (номер строки файла, запись); строка JSONL отдается как есть и разбирается
+    при проверке записи, чтобы битая строка попала в ошибки, а не прервала импорт
+    """
+    fmt = fmt or ('jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'csv')
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                # line_num учитывает заголовок и многострочные поля в кавычках
+                yield reader.line_num, record
+        elif fmt == 'jsonl':
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_no, line
+        else:
+            raise ValueError(f"Неизвестный формат импорта: {fmt}")
+
+
+def validate_record(record):
+    """
+    Проверяет и нормализует запись каталога (словарь или строка JSON)
+    Возвращает (publisher, title, shop, count) или бросает ValueError
+    """
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError as e:
+            raise ValueError(f"некорректный JSON: {e}")
+        if not isinstance(record, dict):
+            raise ValueError("запись JSON должна быть объектом")
+
+    def clean(key):
+        value = record.get(key)
+        value = str(value).strip() if value is not None else ''
+        if len(value) > MAX_NAME_LENGTH:
+            raise ValueError(f"{key}: длиннее {MAX_NAME_LENGTH} символов")
+        return value or None
+
+    publisher, title, shop = clean('publisher'), clean('title'), clean('shop')
+    if not publisher:
+        raise ValueError("publisher: не указан издатель")
+
+    count = record.get('count')
+    if count in (None, ''):
+        count = None
+    else:
+        try:
+            count = int(count)
+        except (TypeError, ValueError):
+            raise ValueError(f"count: не число ({count!r})")
+        if count < 0:
+            raise ValueError("count: отрицательный остаток")
+        if not (title and shop):
+            raise ValueError("count: для остатка нужны title и shop")
+
+    return publisher, title, shop, count
+
+
+class _CopyStream:
+    """Файлоподобный поток CSV для COPY FROM STDIN: строки формируются по мере чтения"""
+
+    def __init__(self, records, report, progress):
+        self._records = iter(records)  # Пары (номер строки, запись)
+        self._report = report
+        self._progress = progress
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+        self._pending = ''
+
+    def _next_row(self):
+        """Валидирует следующую запись и возвращает ее строкой CSV ('' - записи кончились)"""
+        for line_no, record in self._records:
+            try:
+                row = validate_record(record)
+            except (ValueError, AttributeError) as e:
+                self._report['errors'].append((line_no, str(e)))
+                continue
+
+            self._report['rows'] += 1
+            if self._report['rows'] % PROGRESS_EVERY == 0:
+                self._progress('copy', self._report['rows'])
+
+            self._buffer.seek(0)
+            self._buffer.truncate()
+            self._writer.writerow((line_no,) + row)
+            return self._buffer.getvalue()
+        return ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            row = self._next_row()
+            if not row:
+                break
+            self._pending += row
+        if size < 0:
+            chunk, self._pending = self._pending, ''
+        else:
+            chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+
+def print_progress(stage, rows):
+    """Прогресс по умолчанию - в консоль"""
+    print(f"Импорт [{stage}]: {rows}")
+
+
+class BulkImporter:
+    """Массовый импорт каталога через COPY и set-based SQL"""
+
+    def __init__(self, db_session, progress=print_progress):
+        self.engine = db_session.engine
+        self.progress = progress
+
+    def import_records(self, records, dry_run=False):
+        """
+        Загружает записи каталога одной транзакцией
+        dry_run=True - проверка и подсчет изменений без фиксации (транзакция откатывается)
+        Возвращает отчет: строки, ошибки валидации (номер записи с 1, текст), число добавленных/обновленных записей
+        """
+        return self._import(enumerate(records, start=1), dry_run)
+
+    def _import(self, numbered_records, dry_run):
+        """import_records по парам (номер строки, запись)"""
+        report = {'rows': 0, 'errors': [], 'dry_run': dry_run}
+        conn = self.engine.raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(STAGING_DDL)
+                cursor.copy_expert(COPY_SQL, _CopyStream(numbered_records, report, self.progress))
+                self.progress('copy', report['rows'])
+                cursor.execute("ANALYZE import_catalog")
+
+                steps = RESOLVE_SQL
+                cursor.execute("SELECT to_regclass('stock_snapshots') IS NOT NULL")
+                if cursor.fetchone()[0]:
+                    steps = RESOLVE_SQL + LEDGER_SQL
+
+                for step, statement in steps:
+                    cursor.execute(statement)
+                    if not step.startswith('_'):
+                        report[step] = cursor.rowcount
+                        self.progress(step, cursor.rowcount)
+
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+            return report
+
+        except Exception as e:
+            conn.rollback()
+            print(f"Ошибка импорта: {e}")
+            raise
+        finally:
+            conn.close()
+
+    def import_file(self, path, fmt=None, dry_run=False):
+        """Импорт каталога из файла CSV/JSONL (ошибки в отчете - с номерами строк файла)"""
+        return self._import(read_records(path, fmt), dry_run)
@@ -0,0 +1,192 @@
+# Командная строка для фоновых задач (cron) без интерфейса Tk
+# Запуск из каталога bookstrore_orm_py:
+#   python -m cli import catalog.csv [--dry-run]
+#   python -m cli export sales.csv [--start-date 2025-01-01 --end-date 2025-02-01 ...]
+#   python -m cli indexes [--missing]
+#   python -m cli rollup
+#   python -m cli partitions [--archive-before 2024-01 [--export-dir DIR] [--drop]]
+#   python -m cli ledger [--enable | --disable] [--prune-days 90]
+#   python -m cli restock [--window-days 28 --lead-time-days 7 --review-days 7 ...]
+# tkinter не импортируется, db_handler (SQLAlchemy, psycopg2), bulk_import и restock_analytics (NumPy) -
+# только при выполнении команды
+
+import argparse
+import sys
+from datetime import datetime
+
+from config_handler import ConfigHandler
+import sales_export
+
+
+def connect(args):
+    """Подключение по config.ini (имя БД можно переопределить --dbname); None - нет подключения"""
+    import engine_registry
+    from db_handler import DBSession
+
+    config = ConfigHandler(args.config)
+    engine_registry.configure(**config.get_pool_config())
+    db_config = config.get_db_config()
+    if args.dbname:
+        db_config['dbname'] = args.dbname
+    db = DBSession(**db_config)
+    if not db.is_connected():
+        print(f"Нет подключения к БД {db_config['dbname']}")
+        return None
+    return db
+
+
+def cmd_import(args):
+    """Массовая загрузка каталога из CSV/JSONL"""
+    from bulk_import import BulkImporter
+
+    db = connect(args)
+    if db is None:
+        return 1
+    report = BulkImporter(db).import_file(args.path, fmt=args.format, dry_run=args.dry_run)
+    for line_no, error in report['errors']:
+        print(f"Строка {line_no}: {error}")
+    print(f"Импорт{' (проверка)' if args.dry_run else ''}: строк {report['rows']}, ошибок {len(report['errors'])}")
+    return 1 if report['errors'] else 0
+
+
+def cmd_export(args):
+    """Выгрузка продаж"""
+    from db_handler import CRUDOperations
+
+    db = connect(args)
+    if db is None:
+        return 1
+    sales_export.export_from_args(CRUDOperations(db), args)
+    return 0
+
+
+def cmd_indexes(args):
+    """Индексы поиска по названию; --missing - недостающие индексы и ограничения моделей (CONCURRENTLY)"""
+    db = connect(args)
+    if db is None:
+        return 1
+    if args.missing:
+        db.create_missing_indexes()
+    else:
+        db.create_search_indexes()
+    return 0
+
+
+def cmd_rollup(args):
+    """Пересчет витрины продаж по дням"""
+    db = connect(args)
+    if db is None:
+        return 1
+    return 0 if db.rebuild_sales_daily() else 1
+
+
+def cmd_partitions(args):
+    """Секции продаж: создание на будущие месяцы и архивация старых"""
+    from db_handler import SALES_PARTITION_MONTHS_AHEAD
+
+    db = connect(args)
+    if db is None:
+        return 1
+    if not db.is_sales_partitioned():
+        print("Таблица sales не секционирована")
+        return 1
+    db.ensure_sales_partitions(months_ahead=args.months_ahead or SALES_PARTITION_MONTHS_AHEAD)
+    if args.archive_before:
+        db.archive_sales_partitions(args.archive_before, export_dir=args.export_dir, drop=args.drop)
+    return 0
+
+
+def cmd_ledger(args):
+    """Журнал движения стока: включение/выключение и сжатие движений в снимки"""
+    db = connect(args)
+    if db is None:
+        return 1
+    if args.enable:
+        db.enable_stock_ledger()
+    elif args.disable:
+        return 0 if db.disable_stock_ledger() else 1
+    if not db.is_stock_ledger():
+        print("Журнал движения стока не включен")
+        return 1
+    return 0 if db.compact_stock_ledger(prune_days=args.prune_days) is not None else 1
+
+
+def cmd_restock(args):
+    """Пересчет рекомендаций по закупке (точка заказа, оборачиваемость, запас в днях)"""
+    from restock_analytics import RestockAnalytics
+
+    db = connect(args)
+    if db is None:
+        return 1
+    params = {name: getattr(args, name) for name in
+              ('window_days', 'ewma_alpha', 'lead_time_days', 'review_days', 'service_z')
+              if getattr(args, name) is not None}
+    RestockAnalytics(db, **params).run()
+    return 0
+
+
+def _parse_month(value):
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description="Фоновые операции БД книжных магазинов")
+    parser.add_argument('--config', default='config.ini', help="Файл настроек (как у программы)")
+    parser.add_argument('--dbname', help="Имя БД вместо указанного в настройках")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help="Загрузка каталога (издатели, книги, магазины, сток)")
+    import_parser.add_argument('path', help="Файл CSV или JSONL")
+    import_parser.add_argument('--format', choices=('csv', 'jsonl'))
+    import_parser.add_argument('--dry-run', action='store_true', help="Проверка без сохранения")
+    import_parser.set_defaults(handler=cmd_import)
+
+    export_parser = commands.add_parser('export', help="Выгрузка продаж в CSV/JSONL/Parquet")
+    sales_export.add_export_arguments(export_parser)
+    export_parser.set_defaults(handler=cmd_export)
+
+    indexes_parser = commands.add_parser('indexes', help="Построение индексов")
+    indexes_parser.add_argument('--missing', action='store_true',
+                                help="Достроить индексы и ограничения моделей, которых нет в БД "
+                                     "(без блокировки записи)")
+    indexes_parser.set_defaults(handler=cmd_indexes)
+
+    rollup_parser = commands.add_parser('rollup', help="Пересчет витрины продаж по дням")
+    rollup_parser.set_defaults(handler=cmd_rollup)
+
+    partitions_parser = commands.add_parser('partitions', help="Обслуживание секций продаж")
+    partitions_parser.add_argument('--months-ahead', type=int, help="Секции на месяцы вперед (по умолчанию 3)")
+    partitions_parser.add_argument('--archive-before', type=_parse_month, metavar='YYYY-MM',
+                                   help="Архивировать месяцы раньше указанного")
+    partitions_parser.add_argument('--export-dir', help="Выгрузить архивируемые секции в CSV в каталог")
+    partitions_parser.add_argument('--drop', action='store_true', help="Удалить архивируемые секции")
+    partitions_parser.set_defaults(handler=cmd_partitions)
+
+    ledger_parser = commands.add_parser('ledger', help="Сжатие журнала движения стока")
+    mode = ledger_parser.add_mutually_exclusive_group()
+    mode.add_argument('--enable', action='store_true', help="Включить журнал (остатки - движениями вместо счетчика)")
+    mode.add_argument('--disable', action='store_true', help="Свернуть журнал в счетчики и выключить")
+    ledger_parser.add_argument('--prune-days', type=int, help="Удалить свернутые движения старше N дней")
+    ledger_parser.set_defaults(handler=cmd_ledger)
+
+    restock_parser = commands.add_parser('restock', help="Пересчет рекомендаций по закупке")
+    restock_parser.add_argument('--window-days', type=int, help="Окно истории продаж, дней (по умолчанию 28)")
+    restock_parser.add_argument('--ewma-alpha', type=float, help="Вес последнего дня в прогнозе (0.3)")
+    restock_parser.add_argument('--lead-time-days', type=int, help="Срок поставки, дней (7)")
+    restock_parser.add_argument('--review-days', type=int, help="Период между заказами, дней (7)")
+    restock_parser.add_argument('--service-z', type=float, help="Коэффициент страхового запаса (1.65)")
+    restock_parser.set_defaults(handler=cmd_restock)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
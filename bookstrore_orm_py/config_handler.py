@@ -50,6 +50,43 @@ class ConfigHandler:
         with open(self.config_file, 'w') as configfile:
             self.config.write(configfile)
 
+    def get_pool_config(self):
+        """Возвращает параметры пула соединений (секция Pool, необязательная)"""
+        return {
+            'pool_size': self.config.getint('Pool', 'pool_size', fallback=5),
+            'max_overflow': self.config.getint('Pool', 'max_overflow', fallback=10),
+            'pool_timeout': self.config.getint('Pool', 'pool_timeout', fallback=30),
+            'pool_pre_ping': self.config.getboolean('Pool', 'pool_pre_ping', fallback=True),
+            'pool_recycle': self.config.getint('Pool', 'pool_recycle', fallback=3600),
+        }
+
+    def get_stats_config(self):
+        """Возвращает настройки статистики запросов (секция Stats, необязательная)"""
+        return {
+            'enabled': self.config.getboolean('Stats', 'enabled', fallback=True),
+            'slow_ms': self.config.getfloat('Stats', 'slow_query_ms', fallback=200),
+            'explain': self.config.getboolean('Stats', 'explain', fallback=True),
+        }
+
+    def get_partition_config(self):
+        """Возвращает настройки секционирования продаж (секция Partitioning, необязательная)"""
+        return {
+            'partition_sales': self.config.getboolean('Partitioning', 'partition_sales', fallback=False),
+        }
+
+    def get_stock_config(self):
+        """Возвращает настройки учета стока (секция Stock, необязательная)"""
+        return {
+            'stock_ledger': self.config.getboolean('Stock', 'ledger', fallback=False),
+        }
+
+    def get_analytics_config(self):
+        """Возвращает настройки колоночного кэша продаж для аналитики (секция Analytics, необязательная)"""
+        return {
+            'sales_cache': self.config.getboolean('Analytics', 'sales_cache', fallback=False),
+            'refresh_interval': self.config.getfloat('Analytics', 'refresh_interval', fallback=5.0),
+        }
+
     def get_language(self):
         """Возвращает текущий язык из конфига"""
         return self.config.get('General', 'language', fallback='ru')
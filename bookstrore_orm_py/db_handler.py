@@ -1,14 +1,176 @@
-from datetime import datetime, timezone
+import copy
+import functools
+import threading
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime, time, timezone
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from sqlalchemy import create_engine, text, func
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import OperationalError, ProgrammingError
-from sqlalchemy import inspect
+from sqlalchemy import text, func, cast, Date, Integer, tuple_, update, insert, values, column
+from sqlalchemy import select, delete, literal, union_all, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import sessionmaker, contains_eager, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.exc import OperationalError, ProgrammingError, DBAPIError
+from sqlalchemy import inspect, UniqueConstraint, CheckConstraint
+from sqlalchemy.schema import CreateIndex, AddConstraint
+from inspect import isfunction, isgeneratorfunction, unwrap
+import os
+import re
 import sys
-from models import Base, Publisher, Book, Shop, Stock, Sale
-
+from time import sleep
+from models import Base, Publisher, Book, Shop, Stock, Sale, SalesDaily, SalesDailyPending, StockMovement, StockSnapshot
+import engine_registry
+import query_stats
+from ref_cache import TTLCache, ShopRef, PublisherRef, BookRef
+import sales_export
+
+# Допустимые группировки для CRUDOperations.get_sales_summary
+SALES_GROUP_BY = (None, 'shop', 'publisher', 'day')
+
+# Размер страницы для постраничного (keyset) чтения списков
+PAGE_SIZE = 200
+
+# Коды ошибок PostgreSQL, после которых транзакцию можно повторить:
+# serialization_failure, deadlock_detected
+RETRYABLE_PGCODES = {'40001', '40P01'}
+TX_RETRY_ATTEMPTS = 3
+TX_RETRY_DELAY = 0.05  # секунды, удваивается с каждой попыткой
+
+# Кэш справочников (магазины, книги, издатели): размер и время жизни записей, секунды
+REF_CACHE_SIZE = 1024
+REF_CACHE_TTL = 300
+
+# Текстовые колонки с индексами для поиска по названию: (таблица, колонка)
+SEARCH_INDEX_COLUMNS = [('books', 'title'), ('publishers', 'name'), ('shops', 'name')]
+
+# Строка матрицы остатков книга x магазин: counts - {id магазина: остаток}, total - сумма по магазинам
+StockMatrixRow = namedtuple('StockMatrixRow', 'id title publisher counts total')
+
+# Легкие строки результатов чтения (flat=True): неизменяемые, без ORM-состояния и связи с сессией,
+# собираются из выборки только нужных колонок
+PublisherRow = namedtuple('PublisherRow', 'id name')
+ShopRow = namedtuple('ShopRow', 'id name')
+BookRow = namedtuple('BookRow', 'id title id_publisher publisher')
+StockRow = namedtuple('StockRow', 'id id_book id_shop title count')
+SaleRow = namedtuple('SaleRow', sales_export.SALES_EXPORT_COLUMNS)
+
+# Журнал движения стока (DBSession.enable_stock_ledger): таблицы создаются только при включении режима
+STOCK_LEDGER_TABLES = ('stock_movements', 'stock_snapshots', 'sales_daily_pending')
+
+# Перенос итогов продаж режима журнала в витрину; строки, уже зафиксированные к началу запроса,
+# удаляются и суммируются, добавленные незакрытыми транзакциями останутся до следующего сжатия
+SALES_DAILY_PENDING_FOLD_SQL = """
+    WITH moved AS (
+        DELETE FROM sales_daily_pending RETURNING day, id_shop, id_book, quantity, revenue, sales_count
+    )
+    INSERT INTO sales_daily (day, id_shop, id_book, quantity, revenue, sales_count)
+    SELECT day, id_shop, id_book, sum(quantity), sum(revenue), sum(sales_count)
+    FROM moved
+    GROUP BY day, id_shop, id_book
+    ON CONFLICT (day, id_shop, id_book) DO UPDATE
+    SET quantity = sales_daily.quantity + excluded.quantity,
+        revenue = sales_daily.revenue + excluded.revenue,
+        sales_count = sales_daily.sales_count + excluded.sales_count
+    RETURNING day, id_shop, id_book, sales_count
+"""
+
+# Сжатие журнала: движения после снимка сворачиваются в новый снимок
+STOCK_LEDGER_COMPACT_SQL = """
+    WITH moved AS (
+        SELECT m.id_stock, sum(m.delta) AS delta, max(m.id) AS last_id
+        FROM stock_movements m
+        LEFT JOIN stock_snapshots s ON s.id_stock = m.id_stock
+        WHERE m.id > coalesce(s.last_movement_id, 0)
+        GROUP BY m.id_stock
+    )
+    INSERT INTO stock_snapshots (id_stock, count, last_movement_id, taken_at)
+    SELECT moved.id_stock, coalesce(s.count, st.count) + moved.delta, moved.last_id, now()
+    FROM moved
+    JOIN stocks st ON st.id = moved.id_stock
+    LEFT JOIN stock_snapshots s ON s.id_stock = moved.id_stock
+    ON CONFLICT (id_stock) DO UPDATE
+    SET count = excluded.count, last_movement_id = excluded.last_movement_id, taken_at = excluded.taken_at
+"""
+
+# Колонки витрины sales_daily: ключ и накапливаемые итоги
+SALES_DAILY_KEY = ('day', 'id_shop', 'id_book')
+SALES_DAILY_TOTALS = ('quantity', 'revenue', 'sales_count')
+
+# Секционирование продаж по месяцам (DBSession.create_tables(partition_sales=True))
+SALES_PARTITION_MONTHS_AHEAD = 3        # На сколько месяцев вперед держать готовые секции
+SALES_ARCHIVE_SCHEMA = 'sales_archive'  # Схема для отсоединенных секций старых месяцев
+
+# Ключ секционирования входит в первичный ключ, поэтому sale_date обязательна
+SALES_PARTITIONED_DDL = """
+    CREATE TABLE sales (
+        id        serial,
+        id_stock  integer NOT NULL REFERENCES stocks (id),
+        price     double precision NOT NULL,
+        quantity  integer NOT NULL,
+        sale_date timestamp without time zone NOT NULL,
+        PRIMARY KEY (id, sale_date)
+    ) PARTITION BY RANGE (sale_date)
+"""
+
+
+def month_start(value):
+    """Первое число месяца для даты"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    """Первое число месяца, отстоящего от month на count месяцев"""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def sales_daily_rows(sign=1):
+    """
+    SELECT итогов продаж в разрезе (day, id_shop, id_book) - строки для витрины sales_daily
+    sign=-1 - итоги с обратным знаком (для вычитания из витрины)
+    Продажи без даты в витрину не попадают
+    """
+    day = cast(Sale.sale_date, Date)
+    return (select(day,
+                   Stock.id_shop,
+                   Stock.id_book,
+                   func.sum(Sale.quantity) * sign,
+                   func.sum(Sale.price * Sale.quantity) * sign,
+                   func.count(Sale.id) * sign)
+            .join(Stock, Stock.id == Sale.id_stock)
+            .where(Sale.sale_date.isnot(None))
+            .group_by(day, Stock.id_shop, Stock.id_book))
+
+
+def stock_level():
+    """
+    Остаток стока в режиме журнала (выражение, коррелированное с Stock):
+    последний снимок (без снимка - Stock.count) + движения после снимка
+    """
+    snapshot = select(StockSnapshot.count).where(StockSnapshot.id_stock == Stock.id).scalar_subquery()
+    watermark = (select(StockSnapshot.last_movement_id)
+                 .where(StockSnapshot.id_stock == Stock.id)
+                 .correlate(Stock)
+                 .scalar_subquery())
+    deltas = (select(func.coalesce(func.sum(StockMovement.delta), 0))
+              .where(StockMovement.id_stock == Stock.id,
+                     StockMovement.id > func.coalesce(watermark, 0))
+              .scalar_subquery())
+    return func.coalesce(snapshot, Stock.count) + deltas
+
+
+def make_rows(row_type, query):
+    """Строки выборки колонок -> список записей row_type"""
+    return list(map(row_type._make, query))
+
+
+def _day_aligned(value):
+    """Граница периода приходится на начало суток (date или datetime 00:00 без часового пояса)"""
+    if value is None or type(value) is date:
+        return True
+    return isinstance(value, datetime) and value.tzinfo is None and value.time() == time.min
 
 
 class DBSession:
@@ -23,31 +185,37 @@ class DBSession:
         self._password = password
         self._port = port
         self.engine = None
-        self.session = None
+        self.Session = None  # Фабрика коротких сессий (CRUDOperations открывает сессию на каждую операцию)
         self._is_connected = False  # Флаг успешного подключения
 
-        self.system_db_url = f"postgresql://{user}:{password}@{host}:{port}/postgres"
-        self.db_url = f"postgresql://{self._user}:{self._password}@{self._host}/{self._dbname}"
+        self.system_db_url = self._db_url("postgres")
+        self.db_url = self._db_url(self._dbname)
         if not self._connect():
             print("Нет подключения при инициализации")
             #sys.exit(1)  # Завершаем программу
 
 
+    def _db_url(self, dbname):
+        """URL подключения к базе dbname с текущими параметрами сервера"""
+        return f"postgresql://{self._user}:{self._password}@{self._host}:{self._port}/{dbname}"
+
     def _connect(self):
-        """Устанавливает соединение с базой данных"""
+        """Устанавливает соединение с базой данных (движок и пул берутся из общего реестра)"""
         try:
-            db_url = f"postgresql://{self._user}:{self._password}@{self._host}/{self._dbname}"
-            self.engine = create_engine(db_url)
-            # Проверка подключения через тестовый запрос
+            self.db_url = self._db_url(self._dbname)
+            self.engine = engine_registry.get_engine(self.db_url)
+            # Проверка подключения через тестовый запрос (соединение берется из пула)
             with self.engine.connect() as test_conn:
                 test_conn.execute(text("SELECT 1"))
 
             # Если дошли сюда - подключение успешно
             self._is_connected = True
             #Base.metadata.create_all(self.engine) #авто с
-            Session = sessionmaker(bind=self.engine)
-            self.session = Session()
+            # Объекты остаются читаемыми после commit и закрытия сессии операции
+            self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
             print(f"Успешное подключение к базе {self._dbname}")
+            # Секции продаж на ближайшие месяцы (если sales секционирована)
+            self.ensure_sales_partitions()
             return True
 
         except OperationalError as e:
@@ -73,13 +241,12 @@ class DBSession:
             return False
 
 
-    def __del__(self):
-        """Закрывает соединение при удалении объекта"""
-        if hasattr(self, 'session') and self.session:
-            self.close()
-
     def close(self):
-        self.session.close()
+        """
+        Долгоживущей сессии нет - сессии CRUDOperations закрываются в конце каждой операции,
+        соединения пула закрывает engine_registry.dispose_all()
+        """
+        self._is_connected = False
 
 
     def create_db(self, db_name):
@@ -124,6 +291,8 @@ class DBSession:
                 #autocommit=True
             )
             conn.autocommit = True
+            # Закрываем свой пул к удаляемой БД
+            engine_registry.dispose(self._db_url(db_name))
             with conn.cursor() as cursor:
                 # Завершаем все соединения с БД
                 cursor.execute("""
@@ -145,24 +314,38 @@ class DBSession:
 
     def db_exists(self, db_name):
         """Проверяет существование БД"""
-        engine = create_engine(self.system_db_url)
+        engine = engine_registry.get_engine(self.system_db_url)
         with engine.connect() as conn:
             result = conn.execute(text("""
                 SELECT 1 FROM pg_database WHERE datname = :db_name
             """), {'db_name': db_name})
             return bool(result.scalar())
 
-    def create_tables(self):
+    def create_tables(self, search_indexes=True, partition_sales=False, stock_ledger=False):
         """
         Создает все таблицы в базе данных на основе ORM-моделей
         из модуля models.py (Publisher, Book, Shop, Stock)
+        search_indexes - дополнительно создать индексы для поиска по названию
+        partition_sales - создать sales секционированной по месяцам sale_date
+        (только для новой таблицы, существующая sales не преобразуется)
+        stock_ledger - включить журнал движения стока (таблицы журнала создаются только в этом случае)
         """
         if not self.is_connected():
             print("Ошибка: Нет подключения к БД!")
             return False
         try:
-            # Создаем все таблицы, определенные в Base.metadata
-            Base.metadata.create_all(self.engine)
+            inspector = inspect(self.engine)
+            had_sales_daily = inspector.has_table('sales_daily')
+            tables = [t for t in Base.metadata.sorted_tables
+                      if stock_ledger or t.name not in STOCK_LEDGER_TABLES]
+            if partition_sales and not inspector.has_table('sales'):
+                # Сначала таблицы, на которые ссылается sales, затем сама sales и остальные
+                Base.metadata.create_all(self.engine, tables=[t for t in tables if t.name != 'sales'])
+                self.create_partitioned_sales()
+            elif partition_sales:
+                print("Таблица sales уже существует - секционирование не применяется")
+            # Создаем все таблицы, определенные в Base.metadata (кроме журнала стока, если он не включается)
+            Base.metadata.create_all(self.engine, tables=tables)
             # Проверяем, что таблицы действительно созданы
             inspector = inspect(self.engine)
             required_tables = {'publishers', 'books', 'shops', 'stocks'}
@@ -174,6 +357,11 @@ class DBSession:
                 return False
 
             print("Все таблицы успешно созданы")
+            if not had_sales_daily:
+                # Витрина добавлена в существующую БД - наполняем ее по уже записанным продажам
+                self.rebuild_sales_daily()
+            if search_indexes:
+                self.create_search_indexes()
             return True
 
         except Exception as e:
@@ -189,6 +377,369 @@ class DBSession:
             #        print(f"Предупреждение: Таблица {table} не создана")
 
 
+    def create_partitioned_sales(self):
+        """
+        Создает sales секционированной по диапазонам sale_date: секция на каждый месяц
+        и секция по умолчанию для дат вне созданных месяцев, индексы - как в модели Sale
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text(SALES_PARTITIONED_DDL))
+            conn.execute(text("CREATE TABLE sales_default PARTITION OF sales DEFAULT"))
+            for index in Sale.__table__.indexes:
+                conn.execute(CreateIndex(index))
+        print("Таблица sales создана секционированной по месяцам")
+        self.ensure_sales_partitions()
+
+    def is_sales_partitioned(self):
+        """Проверяет, что sales - секционированная таблица"""
+        with self.engine.connect() as conn:
+            return bool(conn.execute(text(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('sales')"
+            )).scalar())
+
+    def ensure_sales_partitions(self, start=None, months_ahead=SALES_PARTITION_MONTHS_AHEAD):
+        """
+        Создает недостающие месячные секции sales от start (по умолчанию - текущий месяц)
+        до months_ahead месяцев вперед; строки этих месяцев из секции по умолчанию переносятся
+        Ничего не делает, если sales не секционирована. Возвращает имена созданных секций
+        """
+        created = []
+        try:
+            if not self.is_sales_partitioned():
+                return created
+            first = month_start(start or datetime.now())
+            last = add_months(month_start(datetime.now()), months_ahead)
+            with self.engine.begin() as conn:
+                # Параллельные копии программы не создают одну секцию дважды
+                conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('sales_partitions'))"))
+                month = first
+                while month <= last:
+                    if self._create_sales_partition(conn, month):
+                        created.append(f"sales_p{month:%Y%m}")
+                    month = add_months(month, 1)
+            if created:
+                print(f"Созданы секции продаж: {created}")
+        except Exception as e:
+            print(f"Ошибка при создании секций продаж: {e}")
+        return created
+
+    @staticmethod
+    def _create_sales_partition(conn, month):
+        """
+        Создает секцию sales_pYYYYMM за месяц, если ее нет
+        Секция создается отдельной таблицей, в нее переносятся строки месяца из sales_default,
+        затем она присоединяется к sales (иначе ATTACH не пройдет проверку секции по умолчанию)
+        """
+        name = f"sales_p{month:%Y%m}"
+        if conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': name}).scalar():
+            return False
+        bounds = {'start': month, 'end': add_months(month, 1)}
+        conn.execute(text(f"CREATE TABLE {name} (LIKE sales INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        conn.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM sales_default WHERE sale_date >= :start AND sale_date < :end RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """), bounds)
+        conn.execute(text(
+            f"ALTER TABLE sales ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"
+        ))
+        return True
+
+    def archive_sales_partitions(self, before, export_dir=None, drop=False):
+        """
+        Отсоединяет от sales месячные секции, целиком лежащие до before (вместо большого DELETE)
+        export_dir - выгрузить каждую секцию в CSV <export_dir>/<секция>.csv
+        drop=True - удалить отсоединенные секции, иначе они переносятся в схему SALES_ARCHIVE_SCHEMA
+        Итоги этих месяцев удаляются и из витрины sales_daily
+        Возвращает имена архивированных секций
+        """
+        cutoff = month_start(before)
+        with self.engine.connect() as conn:
+            partitions = conn.execute(text("""
+                SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass('sales') AND c.relname ~ '^sales_p[0-9]{6}$'
+                ORDER BY c.relname
+            """)).scalars().all()
+        old = [name for name in partitions if datetime.strptime(name[7:], '%Y%m').date() < cutoff]
+        if not old:
+            print("Нет секций продаж для архивации")
+            return []
+
+        archived = []
+        for name in old:
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE sales DETACH PARTITION {name}"))
+            except Exception as e:
+                print(f"Ошибка при архивации секции {name}: {e}")
+                break
+            try:
+                if export_dir:
+                    self._export_table_csv(name, os.path.join(export_dir, f"{name}.csv"))
+                with self.engine.begin() as conn:
+                    if drop:
+                        conn.execute(text(f"DROP TABLE {name}"))
+                    else:
+                        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {SALES_ARCHIVE_SCHEMA}"))
+                        conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {SALES_ARCHIVE_SCHEMA}"))
+                archived.append(name)
+            except Exception as e:
+                print(f"Ошибка при архивации секции {name}: {e}")
+                # Возвращаем секцию в sales; не удалось - ее продаж в sales уже нет, итоги убираем как у архивной
+                if not self._reattach_sales_partition(name):
+                    archived.append(name)
+                break
+
+        if archived:
+            # Итоги витрины - только за месяцы архивированных секций
+            months = [datetime.strptime(name[7:], '%Y%m').date() for name in archived]
+            with self.engine.begin() as conn:
+                daily_tables = [SalesDaily]
+                if inspect(conn).has_table('sales_daily_pending'):
+                    daily_tables.append(SalesDailyPending)
+                for table in daily_tables:
+                    conn.execute(delete(table).where(or_(*(
+                        and_(table.day >= month, table.day < add_months(month, 1)) for month in months
+                    ))))
+            print(f"Архивированы секции продаж: {archived}")
+        return archived
+
+    def _reattach_sales_partition(self, name):
+        """Присоединяет отсоединенную секцию sales_pYYYYMM обратно к sales; False - не удалось"""
+        month = datetime.strptime(name[7:], '%Y%m').date()
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text(
+                    f"ALTER TABLE sales ATTACH PARTITION {name} "
+                    f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+                ))
+            return True
+        except Exception as e:
+            print(f"Секция {name} осталась отсоединенной: {e}")
+            return False
+
+    def _export_table_csv(self, table_name, path):
+        """Выгружает таблицу в CSV с заголовком через COPY TO STDOUT"""
+        conn = self.engine.raw_connection()
+        try:
+            with conn.cursor() as cursor, open(path, 'w', encoding='utf-8', newline='') as f:
+                cursor.copy_expert(f"COPY {table_name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def rebuild_sales_daily(self):
+        """
+        Полностью пересчитывает витрину sales_daily по таблице sales
+        На время пересчета запись продаж блокируется (LOCK sales IN SHARE MODE)
+        """
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("LOCK TABLE sales IN SHARE MODE"))
+                conn.execute(delete(SalesDaily))
+                if inspect(conn).has_table('sales_daily_pending'):
+                    conn.execute(delete(SalesDailyPending))  # Итоги режима журнала входят в пересчет
+                conn.execute(insert(SalesDaily).from_select(SALES_DAILY_KEY + SALES_DAILY_TOTALS, sales_daily_rows()))
+                conn.execute(text("ANALYZE sales_daily"))
+            print("Витрина продаж пересчитана")
+            return True
+        except Exception as e:
+            print(f"Ошибка при пересчете витрины продаж: {e}")
+            return False
+
+    def enable_stock_ledger(self):
+        """
+        Включает журнал движения стока: создает таблицы журнала (недостающие - и в уже включенном режиме)
+        Текущие Stock.count становятся начальными остатками, дальше они меняются только сжатием журнала;
+        итоги продаж копятся в sales_daily_pending и переносятся в sales_daily тем же сжатием
+        """
+        Base.metadata.create_all(self.engine, tables=[Base.metadata.tables[name] for name in STOCK_LEDGER_TABLES])
+        print("Журнал движения стока включен")
+
+    def is_stock_ledger(self):
+        """Проверяет, включен ли журнал движения стока"""
+        return inspect(self.engine).has_table('stock_snapshots')
+
+    def compact_stock_ledger(self, prune_days=None):
+        """
+        Сворачивает движения стока в снимки и переносит снимки в Stock.count,
+        накопленные итоги продаж переносит в витрину sales_daily
+        prune_days - удалить свернутые движения старше указанного числа дней (по умолчанию история хранится)
+        На время сжатия запись движений ждет (LOCK stock_movements IN SHARE MODE), поэтому
+        незафиксированное движение не может оказаться ниже нового снимка
+        Возвращает число стоков с новым снимком, None - ошибка
+        """
+        try:
+            with self.engine.begin() as conn:
+                compacted = self._compact_stock_ledger(conn)
+                if prune_days is not None:
+                    pruned = conn.execute(text("""
+                        DELETE FROM stock_movements m
+                        USING stock_snapshots s
+                        WHERE s.id_stock = m.id_stock AND m.id <= s.last_movement_id
+                          AND m.created_at < now() - make_interval(days => :days)
+                    """), {'days': prune_days}).rowcount
+                    print(f"Удалено движений стока: {pruned}")
+            print(f"Журнал стока сжат, снимков: {compacted}")
+            return compacted
+        except Exception as e:
+            print(f"Ошибка при сжатии журнала стока: {e}")
+            return None
+
+    @staticmethod
+    def _compact_stock_ledger(conn):
+        """Сжатие журнала в транзакции conn, возвращает число стоков с новым снимком"""
+        conn.execute(text("LOCK TABLE stock_movements IN SHARE MODE"))
+        compacted = conn.execute(text(STOCK_LEDGER_COMPACT_SQL)).rowcount
+        # Итоги продаж режима журнала - в витрину (блокировка не нужна, см. SALES_DAILY_PENDING_FOLD_SQL)
+        emptied = [(row.day, row.id_shop, row.id_book)
+                   for row in conn.execute(text(SALES_DAILY_PENDING_FOLD_SQL)) if row.sales_count <= 0]
+        if emptied:
+            conn.execute(
+                delete(SalesDaily).where(tuple_(SalesDaily.day, SalesDaily.id_shop, SalesDaily.id_book).in_(emptied))
+            )
+        # Счетчик совпадает с последним снимком - журнал можно выключить без потери остатков
+        conn.execute(text("""
+            UPDATE stocks st SET count = s.count
+            FROM stock_snapshots s
+            WHERE s.id_stock = st.id AND st.count IS DISTINCT FROM s.count
+        """))
+        return compacted
+
+    def disable_stock_ledger(self):
+        """Выключает журнал движения стока: сжимает журнал в Stock.count и удаляет таблицы журнала"""
+        if not self.is_stock_ledger():
+            return True
+        try:
+            with self.engine.begin() as conn:
+                self._compact_stock_ledger(conn)
+                Base.metadata.drop_all(conn, tables=[Base.metadata.tables[name] for name in STOCK_LEDGER_TABLES])
+            print("Журнал движения стока выключен")
+            return True
+        except Exception as e:
+            print(f"Ошибка при выключении журнала стока: {e}")
+            return False
+
+    def create_search_indexes(self):
+        """
+        Создает индексы для поиска по названию (SEARCH_INDEX_COLUMNS)
+        С расширением pg_trgm - GIN-индексы gin_trgm_ops для ILIKE '%...%',
+        без него - B-tree text_pattern_ops по lower(колонка) для поиска по префиксу
+        Возвращает True, если созданы триграммные индексы
+        """
+        with self.engine.connect() as conn:
+            try:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.commit()
+                trigram = True
+            except DBAPIError as e:
+                conn.rollback()
+                print(f"Расширение pg_trgm недоступно, индексы для поиска по префиксу: {e}")
+                trigram = False
+
+            for table, column in SEARCH_INDEX_COLUMNS:
+                if trigram:
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm "
+                        f"ON {table} USING gin ({column} gin_trgm_ops)"
+                    ))
+                else:
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_prefix "
+                        f"ON {table} (lower({column}) text_pattern_ops)"
+                    ))
+            conn.commit()
+        print("Индексы для поиска созданы")
+        return trigram
+
+    def create_missing_indexes(self):
+        """
+        Достраивает на существующей БД индексы, уникальные и CHECK-ограничения из моделей, которых еще нет
+        Индексы строятся CREATE INDEX CONCURRENTLY - без блокировки записи в таблицы;
+        уникальное ограничение - через уникальный индекс CONCURRENTLY и ADD CONSTRAINT ... USING INDEX;
+        CHECK - ADD CONSTRAINT ... NOT VALID и отдельная проверка существующих строк (VALIDATE CONSTRAINT)
+        Наличие ограничения проверяется по pg_constraint - повторный вызов ничего не меняет
+        Возвращает список имен созданных индексов и ограничений
+        """
+        inspector = inspect(self.engine)
+        created = []
+        # CONCURRENTLY нельзя выполнять внутри транзакции
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for table in Base.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+
+                for index in sorted(table.indexes, key=lambda ix: ix.name):
+                    if index.name in existing:
+                        continue
+                    ddl = str(CreateIndex(index).compile(dialect=self.engine.dialect))
+                    ddl = re.sub(r'^CREATE (UNIQUE )?INDEX', r'CREATE \1INDEX CONCURRENTLY IF NOT EXISTS', ddl)
+                    if self._create_index_concurrently(conn, index.name, ddl):
+                        created.append(index.name)
+
+                for constraint in sorted(table.constraints, key=lambda c: str(c.name)):
+                    if not isinstance(constraint, (UniqueConstraint, CheckConstraint)) or not constraint.name:
+                        continue
+                    if self._constraint_exists(conn, table.name, constraint.name):
+                        continue
+                    if isinstance(constraint, CheckConstraint):
+                        if self._add_check_constraint(conn, table.name, constraint):
+                            created.append(constraint.name)
+                        continue
+                    columns = ', '.join(column.name for column in constraint.columns)
+                    ddl = (f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {constraint.name} "
+                           f"ON {table.name} ({columns})")
+                    if self._create_index_concurrently(conn, constraint.name, ddl):
+                        conn.execute(text(
+                            f"ALTER TABLE {table.name} ADD CONSTRAINT {constraint.name} "
+                            f"UNIQUE USING INDEX {constraint.name}"
+                        ))
+                        created.append(constraint.name)
+
+        print(f"Созданы индексы и ограничения: {created}" if created else "Все индексы и ограничения уже существуют")
+        return created
+
+    @staticmethod
+    def _constraint_exists(conn, table_name, constraint_name):
+        """Есть ли у таблицы ограничение с таким именем"""
+        return bool(conn.execute(text(
+            "SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(:table) AND conname = :name"
+        ), {'table': table_name, 'name': constraint_name}).scalar())
+
+    def _add_check_constraint(self, conn, table_name, constraint):
+        """
+        Добавляет CHECK-ограничение: NOT VALID - без проверки существующих строк под блокировкой записи,
+        затем VALIDATE CONSTRAINT; если старые строки его нарушают, ограничение остается непроверенным
+        (новые и измененные строки оно все равно проверяет)
+        """
+        try:
+            print(f"Создание ограничения {constraint.name}...")
+            ddl = str(AddConstraint(constraint).compile(dialect=self.engine.dialect))
+            conn.execute(text(f"{ddl} NOT VALID"))
+        except DBAPIError as e:
+            print(f"Ошибка при создании ограничения {constraint.name}: {e}")
+            return False
+        try:
+            conn.execute(text(f"ALTER TABLE {table_name} VALIDATE CONSTRAINT {constraint.name}"))
+        except DBAPIError as e:
+            print(f"Ограничение {constraint.name} не выполняется для существующих строк: {e}")
+        return True
+
+    @staticmethod
+    def _create_index_concurrently(conn, index_name, ddl):
+        """Строит индекс CONCURRENTLY; при ошибке удаляет оставшийся невалидный индекс"""
+        try:
+            print(f"Создание индекса {index_name}...")
+            conn.execute(text(ddl))
+            return True
+        except DBAPIError as e:
+            print(f"Ошибка при создании индекса {index_name}: {e}")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+            return False
+
     def drop_tables(self):
         """
         Удаляет все таблицы из базы данных (все - данные будут потеряны)
@@ -201,9 +752,276 @@ class DBSession:
             raise
 
 
+def escape_like(value):
+    """Экранирует спецсимволы LIKE (%, _ и \\) в строке поиска"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
 class CRUDOperations:
+    # Пауза перед повтором транзакции (асинхронный слой подменяет ее на неблокирующую)
+    _sleep = staticmethod(sleep)
+
     def __init__(self, db_session):
-        self.session = db_session.session
+        self.db = db_session
+        self._session = None  # Сессия, заданная with_session (иначе - своя сессия на каждую операцию)
+        self._local = threading.local()  # Сессия текущей операции, у каждого потока своя
+        self._search_indexes = None  # Имена индексов поиска, найденные в БД (загружаются при первом поиске)
+        self._sales_daily = None  # Есть ли в БД витрина sales_daily (проверяется при первом обращении)
+        self._stock_ledger = None  # Включен ли журнал движения стока (проверяется при первом обращении)
+        self.ref_cache = TTLCache(REF_CACHE_SIZE, REF_CACHE_TTL)  # Общий и для копий with_session
+        self.sales_cache = None  # Колоночный кэш продаж (sales_column_cache), None - аналитика запросами к БД
+
+    def with_session(self, session):
+        """Копия CRUDOperations, работающая через переданную сессию вместо сессий на операцию"""
+        crud = copy.copy(self)
+        crud._session = session
+        return crud
+
+    @property
+    def session(self):
+        """Сессия текущей операции (открыта _session_scope)"""
+        if self._session is not None:
+            return self._session
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            raise RuntimeError("Сессия CRUDOperations доступна только внутри операции")
+        return session
+
+    @contextmanager
+    def _session_scope(self):
+        """
+        Короткая сессия на одну операцию: открывается при входе и закрывается при выходе,
+        незафиксированные изменения откатываются. Вложенные вызовы работают в сессии внешнего вызова
+        identity map живет только до конца операции - память не растет со временем работы программы
+        """
+        if self._session is not None or getattr(self._local, 'session', None) is not None:
+            yield self.session
+            return
+        session = self.db.Session()
+        self._local.session = session
+        try:
+            yield session
+        finally:
+            self._local.session = None
+            session.close()
+
+    # Поиск по названию
+    def refresh_search_indexes(self):
+        """Перечитывает из БД, какие индексы для поиска по названию существуют"""
+        names = [f"ix_{table}_{column}_{kind}"
+                 for table, column in SEARCH_INDEX_COLUMNS for kind in ('trgm', 'prefix')]
+        self._search_indexes = set(self.session.execute(
+            text("SELECT indexname FROM pg_indexes WHERE indexname = ANY(:names)"),
+            {'names': names}
+        ).scalars())
+        return self._search_indexes
+
+    def _text_match(self, column, value):
+        """
+        Условие поиска по части строки для колонки
+        Обычно ILIKE '%value%' (с pg_trgm использует GIN-индекс);
+        если для колонки есть только индекс text_pattern_ops - поиск по префиксу lower(col) LIKE 'value%'
+        """
+        if self._search_indexes is None:
+            self.refresh_search_indexes()
+
+        pattern = escape_like(str(value))
+        col = column.expression
+        prefix = f"ix_{col.table.name}_{col.name}"
+        if f"{prefix}_prefix" in self._search_indexes and f"{prefix}_trgm" not in self._search_indexes:
+            return func.lower(column).like(f"{pattern.lower()}%", escape='\\')
+        return column.ilike(f"%{pattern}%", escape='\\')
+
+    # Витрина продаж по дням
+    def refresh_sales_daily_state(self):
+        """Перечитывает из БД, существует ли витрина sales_daily"""
+        self._sales_daily = bool(self.session.execute(
+            text("SELECT to_regclass('sales_daily') IS NOT NULL")
+        ).scalar())
+        return self._sales_daily
+
+    def _sales_daily_available(self):
+        if self._sales_daily is None:
+            self.refresh_sales_daily_state()
+        return self._sales_daily
+
+    def _apply_sales_to_daily(self, sale_ids, sign=1):
+        """
+        Добавляет (sign=1) или вычитает (sign=-1) продажи sale_ids в витрине sales_daily
+        Выполняется в транзакции записи продажи; строки витрины без продаж удаляются
+        В режиме журнала стока итоги только добавляются строкой в sales_daily_pending
+        """
+        if not self._sales_daily_available():
+            return
+        if self._stock_ledger_enabled():
+            # Режим журнала: строка в sales_daily_pending без блокировки строки витрины (см. SalesDailyPending)
+            self.session.execute(insert(SalesDailyPending).from_select(
+                SALES_DAILY_KEY + SALES_DAILY_TOTALS,
+                sales_daily_rows(sign).where(Sale.id.in_(sale_ids))
+            ))
+            return
+        stmt = pg_insert(SalesDaily).from_select(
+            SALES_DAILY_KEY + SALES_DAILY_TOTALS,
+            sales_daily_rows(sign).where(Sale.id.in_(sale_ids))
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=SALES_DAILY_KEY,
+            set_={name: getattr(SalesDaily, name) + getattr(stmt.excluded, name) for name in SALES_DAILY_TOTALS}
+        ).returning(SalesDaily.day, SalesDaily.id_shop, SalesDaily.id_book, SalesDaily.sales_count)
+
+        emptied = [(row.day, row.id_shop, row.id_book)
+                   for row in self.session.execute(stmt) if row.sales_count <= 0]
+        if emptied:
+            self.session.execute(
+                delete(SalesDaily).where(tuple_(SalesDaily.day, SalesDaily.id_shop, SalesDaily.id_book).in_(emptied))
+            )
+
+    # Журнал движения стока
+    def refresh_stock_ledger_state(self):
+        """Перечитывает из БД, включен ли журнал движения стока"""
+        self._stock_ledger = bool(self.session.execute(
+            text("SELECT to_regclass('stock_snapshots') IS NOT NULL")
+        ).scalar())
+        return self._stock_ledger
+
+    def _stock_ledger_enabled(self):
+        if self._stock_ledger is None:
+            self.refresh_stock_ledger_state()
+        return self._stock_ledger
+
+    def _stock_count(self):
+        """Остаток стока для запроса: счетчик Stock.count или, в режиме журнала, снимок + движения"""
+        return stock_level() if self._stock_ledger_enabled() else Stock.count
+
+    def _with_stock_levels(self, stocks):
+        """В режиме журнала подставляет в загруженные Stock вычисленные остатки (записи не меняются)"""
+        if stocks and self._stock_ledger_enabled():
+            levels = self._stock_levels([stock.id for stock in stocks])
+            for stock in stocks:
+                set_committed_value(stock, 'count', levels.get(stock.id))
+        return stocks
+
+    def _lock_stocks(self, stock_ids):
+        """
+        Режим журнала: исключительные advisory-блокировки стоков до конца транзакции
+        Берутся в порядке id - встречные списания не блокируют друг друга навсегда
+        """
+        for stock_id in sorted(stock_ids):
+            self.session.execute(text("SELECT pg_advisory_xact_lock(hashtext('stocks'), :id)"), {'id': stock_id})
+
+    def _stock_levels(self, stock_ids):
+        """Режим журнала: {id стока: остаток} по снимкам и движениям"""
+        return dict(self.session.execute(
+            select(Stock.id, stock_level()).where(Stock.id.in_(stock_ids))
+        ).all())
+
+    def _append_stock_movements(self, deltas, reason):
+        """
+        Режим журнала: записывает движения {id стока: изменение} одним INSERT, строки stocks не меняются
+        Списываемые стоки блокируются (_lock_stocks), остатки читаются уже под блокировкой -
+        параллельные списания того же стока идут по очереди, остаток не может стать отрицательным
+        Возвращает {id стока: новый остаток}
+        """
+        stock_ids = sorted(deltas)
+
+        # Поступления остаток не уменьшают и блокировки не берут
+        written_off = [stock_id for stock_id in stock_ids if deltas[stock_id] < 0]
+        if written_off:
+            self._lock_stocks(written_off)
+        # После блокировки - движения списаний, зафиксированных до нее, уже видны
+        levels = self._stock_levels(stock_ids)
+
+        missing = set(stock_ids) - set(levels)
+        if missing:
+            raise ValueError(f"Сток с ID {', '.join(map(str, sorted(missing)))} не найден")
+
+        short = [stock_id for stock_id in stock_ids if levels[stock_id] + deltas[stock_id] < 0]
+        if short:
+            raise ValueError(f"Недостаточно книг в наличии (ID стока: {', '.join(map(str, short))})")
+
+        movements = [{'id_stock': stock_id, 'delta': deltas[stock_id], 'reason': reason}
+                     for stock_id in stock_ids if deltas[stock_id]]
+        if movements:
+            self.session.execute(insert(StockMovement).values(movements))
+        return {stock_id: levels[stock_id] + deltas[stock_id] for stock_id in stock_ids}
+
+    def _sales_facts(self, start_date=None, end_date=None):
+        """
+        Итоги продаж периода в разрезе (day, id_shop, id_book, quantity, revenue, sales_count) из витрины
+        Работает для периода по границам суток: дни [start_date, end_date) берутся из sales_daily,
+        продажи ровно в момент end_date (он входит в период) - из sales
+        Для остальных периодов (или без витрины) - None, отчет считается по таблице sales
+        """
+        if not (_day_aligned(start_date) and _day_aligned(end_date) and self._sales_daily_available()):
+            return None
+
+        # В режиме журнала к витрине добавляются еще не перенесенные в нее итоги sales_daily_pending
+        parts = []
+        for table in (SalesDaily, SalesDailyPending) if self._stock_ledger_enabled() else (SalesDaily,):
+            rollup = select(table.day, table.id_shop, table.id_book, table.quantity, table.revenue, table.sales_count)
+            if start_date is not None:
+                rollup = rollup.where(table.day >= (start_date.date() if isinstance(start_date, datetime) else start_date))
+            if end_date is not None:
+                rollup = rollup.where(table.day < (end_date.date() if isinstance(end_date, datetime) else end_date))
+            parts.append(rollup)
+
+        raw = (select(cast(Sale.sale_date, Date).label('day'),
+                      Stock.id_shop,
+                      Stock.id_book,
+                      Sale.quantity,
+                      (Sale.price * Sale.quantity).label('revenue'),
+                      literal(1).label('sales_count'))
+               .join(Stock, Stock.id == Sale.id_stock))
+        if end_date is not None:
+            parts.append(raw.where(Sale.sale_date == end_date))
+        elif start_date is None:
+            parts.append(raw.where(Sale.sale_date.is_(None)))  # Без периода в отчет входят и продажи без даты
+        if len(parts) == 1:
+            return parts[0].subquery('facts')
+        return union_all(*parts).subquery('facts')
+
+    # Справочники через кэш: легкие записи ShopRef/BookRef/PublisherRef для диалогов окон
+    def get_shop_ref(self, shop_id):
+        """Магазин по ID (ShopRef) из кэша"""
+        def load():
+            row = self.session.query(Shop.id, Shop.name).filter(Shop.id == shop_id).first()
+            return ShopRef(*row) if row else None
+        return self.ref_cache.get(('shop', shop_id), load)
+
+    def get_book_ref(self, book_id):
+        """Книга по ID (BookRef с именем издателя) из кэша"""
+        def load():
+            row = (self.session.query(Book.id, Book.title, Book.id_publisher, Publisher.name)
+                   .outerjoin(Publisher, Publisher.id == Book.id_publisher)
+                   .filter(Book.id == book_id)
+                   .first())
+            return BookRef(*row) if row else None
+        return self.ref_cache.get(('book', book_id), load)
+
+    def read_publisher_refs(self):
+        """Все издатели (кортеж PublisherRef) из кэша"""
+        return self.ref_cache.get(('publishers',), lambda: tuple(
+            PublisherRef(*row) for row in self.session.query(Publisher.id, Publisher.name).order_by(Publisher.id)
+        ))
+
+    def read_shop_refs(self):
+        """Все магазины (кортеж ShopRef) из кэша"""
+        return self.ref_cache.get(('shops',), lambda: tuple(
+            ShopRef(*row) for row in self.session.query(Shop.id, Shop.name).order_by(Shop.id)
+        ))
+
+    def _invalidate_refs(self, entity_class, entity_id=None):
+        """Сбрасывает записи кэша справочников после изменения сущности"""
+        if entity_class is Publisher:
+            self.ref_cache.invalidate_kind('publishers')
+            self.ref_cache.invalidate_kind('book')  # В BookRef хранится имя издателя
+        elif entity_class is Book:
+            self.ref_cache.invalidate(('book', entity_id))
+            if self.sales_cache is not None:
+                self.sales_cache.book_changed(entity_id)  # В кэше продаж хранится издатель книги
+        elif entity_class is Shop:
+            self.ref_cache.invalidate(('shop', entity_id))
+            self.ref_cache.invalidate_kind('shops')
 
     # Общие методы для всех сущностей
     def read_entities(self, entity_class, **filters):
@@ -211,7 +1029,7 @@ class CRUDOperations:
         for key, value in filters.items():
             if hasattr(entity_class, key):
                 if isinstance(value, str):
-                    query = query.filter(getattr(entity_class, key).ilike(f'%{value}%'))
+                    query = query.filter(self._text_match(getattr(entity_class, key), value))
                 else:
                     query = query.filter(getattr(entity_class, key) == value)
         return query.all()
@@ -220,6 +1038,7 @@ class CRUDOperations:
         entity = entity_class(**data)
         self.session.add(entity)
         self.session.commit()
+        self._invalidate_refs(entity_class, entity.id)
         return entity
 
     def update_entity(self, entity_class, entity_id, **data):
@@ -228,6 +1047,7 @@ class CRUDOperations:
             for key, value in data.items():
                 setattr(entity, key, value)
             self.session.commit()
+            self._invalidate_refs(entity_class, entity_id)
             return True
         return False
 
@@ -236,6 +1056,7 @@ class CRUDOperations:
         if entity:
             self.session.delete(entity)
             self.session.commit()
+            self._invalidate_refs(entity_class, entity_id)
             return True
         return False
 
@@ -245,6 +1066,7 @@ class CRUDOperations:
         publisher = Publisher(name=name)
         self.session.add(publisher)
         self.session.commit()
+        self._invalidate_refs(Publisher)
         return publisher
 
     def create_publisher2(self, name):
@@ -253,15 +1075,16 @@ class CRUDOperations:
     def read_publishers_all(self):
         return self.session.query(Publisher).all()
 
-    def read_publishers(self, **filters):
-        query = self.session.query(Publisher)
+    def read_publishers(self, flat=False, **filters):
+        """flat=True - строки PublisherRow вместо ORM-объектов"""
+        query = self.session.query(Publisher.id, Publisher.name) if flat else self.session.query(Publisher)
         for key, value in filters.items():
             if hasattr(Publisher, key):
                 if key == 'name':
-                    query = query.filter(getattr(Publisher, key).ilike(f'%{value}%'))
+                    query = query.filter(self._text_match(getattr(Publisher, key), value))
                 else:
                     query = query.filter(getattr(Publisher, key) == value)
-        return query.all()
+        return make_rows(PublisherRow, query) if flat else query.all()
 
     def read_publishers2(self, **filters):
         return self.read_entities(Publisher, **filters)
@@ -271,6 +1094,7 @@ class CRUDOperations:
         if publisher:
             publisher.name = new_name
             self.session.commit()
+            self._invalidate_refs(Publisher)
             return True
         return False
 
@@ -279,6 +1103,7 @@ class CRUDOperations:
         if publisher:
             self.session.delete(publisher)
             self.session.commit()
+            self._invalidate_refs(Publisher)
             return True
         return False
 
@@ -287,6 +1112,7 @@ class CRUDOperations:
         book = Book(title=title, id_publisher=publisher_id)
         self.session.add(book)
         self.session.commit()
+        self._invalidate_refs(Book, book.id)
         return book
 
     def get_book_by_id(self, book_id):
@@ -302,27 +1128,51 @@ class CRUDOperations:
             query = query.filter_by(id_publisher=publisher_id)
         return query.all()
 
-    def read_books(self, **filters):
+    def read_books(self, flat=False, **filters):
         """
         Возвращает список книг с возможностью фильтрации
         Поддерживаемые фильтры:
         - id: точный поиск по ID
         - title: поиск по части названия (регистронезависимый)
         - publisher_id: точный поиск по ID издателя
+        flat=True - строки BookRow (id, title, id_publisher, publisher) вместо ORM-объектов
         """
-        query = self.session.query(Book)
+        if flat:
+            query = (self.session.query(Book.id, Book.title, Book.id_publisher, Publisher.name)
+                     .outerjoin(Publisher, Publisher.id == Book.id_publisher))
+        else:
+            query = self.session.query(Book).options(joinedload(Book.publisher))
 
         if 'id' in filters:
             query = query.filter(Book.id == filters['id'])
 
         if 'title' in filters:
-            query = query.filter(Book.title.ilike(f'%{filters["title"]}%'))
+            query = query.filter(self._text_match(Book.title, filters["title"]))
 
         if 'publisher_id' in filters:
-            query = query.filter(Book.publisher_id == filters['publisher_id'])
+            query = query.filter(Book.id_publisher == filters['publisher_id'])
 
-        return query.all()
+        return make_rows(BookRow, query) if flat else query.all()
+
+
+    def read_books_page(self, after_id=None, limit=PAGE_SIZE, **filters):
+        """
+        Страница книг: строки (id, title, publisher), фильтры как у read_books
+        Keyset-пагинация по id, after_id - id последней строки предыдущей страницы
+        """
+        query = (self.session.query(Book.id, Book.title, Publisher.name.label('publisher'))
+                 .outerjoin(Publisher, Publisher.id == Book.id_publisher))
 
+        if 'id' in filters:
+            query = query.filter(Book.id == filters['id'])
+        if 'title' in filters:
+            query = query.filter(self._text_match(Book.title, filters["title"]))
+        if 'publisher_id' in filters:
+            query = query.filter(Book.id_publisher == filters['publisher_id'])
+        if after_id is not None:
+            query = query.filter(Book.id > after_id)
+
+        return query.order_by(Book.id).limit(limit).all()
 
     def update_book(self, book_id, new_title=None, new_publisher_id=None):
         book = self.session.query(Book).get(book_id)
@@ -332,6 +1182,7 @@ class CRUDOperations:
             if new_publisher_id is not None:
                 book.id_publisher = new_publisher_id
             self.session.commit()
+            self._invalidate_refs(Book, book_id)
             return True
         return False
 
@@ -340,6 +1191,7 @@ class CRUDOperations:
         if book:
             self.session.delete(book)
             self.session.commit()
+            self._invalidate_refs(Book, book_id)
             return True
         return False
 
@@ -351,6 +1203,7 @@ class CRUDOperations:
         shop = Shop(name=name)
         self.session.add(shop)
         self.session.commit()
+        self._invalidate_refs(Shop, shop.id)
         return shop
 
     def read_shops_all(self):
@@ -358,21 +1211,23 @@ class CRUDOperations:
         return self.session.query(Shop).all()
 
 
-    def read_shops(self, **filters):
-        query = self.session.query(Shop)
+    def read_shops(self, flat=False, **filters):
+        """flat=True - строки ShopRow вместо ORM-объектов"""
+        query = self.session.query(Shop.id, Shop.name) if flat else self.session.query(Shop)
         for key, value in filters.items():
             if hasattr(Shop, key):
                 if key == 'name':
-                    query = query.filter(getattr(Shop, key).ilike(f'%{value}%'))
+                    query = query.filter(self._text_match(getattr(Shop, key), value))
                 else:
                     query = query.filter(getattr(Shop, key) == value)
-        return query.all()
+        return make_rows(ShopRow, query) if flat else query.all()
 
     def update_shop(self, shop_id, new_name):
         shop = self.session.query(Shop).get(shop_id)
         if shop:
             shop.name = new_name
             self.session.commit()
+            self._invalidate_refs(Shop, shop_id)
             return True
         return False
 
@@ -381,6 +1236,7 @@ class CRUDOperations:
         if shop:
             self.session.delete(shop)
             self.session.commit()
+            self._invalidate_refs(Shop, shop_id)
             return True
         return False
 
@@ -407,19 +1263,86 @@ class CRUDOperations:
             return True
         return False
 
-    def read_stock_by_shop(self, shop_id):
-        """Возвращает сток книг для указанного магазина"""
-        return self.session.query(Stock).filter_by(id_shop=shop_id).join(Book).all()
+    def read_stock_by_shop(self, shop_id, flat=False):
+        """
+        Возвращает сток книг для указанного магазина (книги загружаются тем же запросом)
+        flat=True - строки StockRow (id, id_book, id_shop, title, count) вместо ORM-объектов
+        """
+        if flat:
+            return make_rows(StockRow, self.session.query(
+                        Stock.id, Stock.id_book, Stock.id_shop, Book.title, self._stock_count())
+                    .join(Book, Book.id == Stock.id_book)
+                    .filter(Stock.id_shop == shop_id)
+                    .order_by(Stock.id_book))
+        return self._with_stock_levels(self.session.query(Stock)
+                                       .filter_by(id_shop=shop_id)
+                                       .join(Book)
+                                       .options(contains_eager(Stock.book))
+                                       .all())
+
+    def read_stock_page(self, shop_id, after_id=None, limit=PAGE_SIZE):
+        """
+        Страница стока магазина: строки (id_book, title, count)
+        Keyset-пагинация по id книги, after_id - id книги последней строки предыдущей страницы
+        """
+        query = (self.session.query(Stock.id_book, Book.title, self._stock_count().label('count'))
+                 .join(Book, Book.id == Stock.id_book)
+                 .filter(Stock.id_shop == shop_id))
+        if after_id is not None:
+            query = query.filter(Stock.id_book > after_id)
+        return query.order_by(Stock.id_book).limit(limit).all()
+
+    def read_stock_matrix(self, publisher_id=None, title=None, after_id=None, limit=None):
+        """
+        Матрица остатков книга x магазин одним агрегирующим запросом
+        Возвращает StockMatrixRow по возрастанию id книги (только книги, которые есть хотя бы в одном стоке)
+        publisher_id, title - фильтры по издателю и части названия
+        after_id, limit - постраничное чтение (after_id - id книги последней строки предыдущей страницы)
+        """
+        count = self._stock_count()
+        query = (self.session.query(
+                    Book.id,
+                    Book.title,
+                    Publisher.name.label('publisher'),
+                    func.jsonb_object_agg(Stock.id_shop, count).label('counts'),
+                    func.sum(count).label('total'))
+                 .select_from(Book)
+                 .join(Stock, Stock.id_book == Book.id)
+                 .join(Publisher, Publisher.id == Book.id_publisher))
+        if publisher_id:
+            query = query.filter(Book.id_publisher == publisher_id)
+        if title:
+            query = query.filter(self._text_match(Book.title, title))
+        if after_id is not None:
+            query = query.filter(Book.id > after_id)
+        query = query.group_by(Book.id, Publisher.id).order_by(Book.id)
+        if limit:
+            query = query.limit(limit)
+
+        # Ключи jsonb - строки, приводим обратно к id магазинов
+        return [StockMatrixRow(row.id, row.title, row.publisher,
+                               {int(shop_id): count for shop_id, count in row.counts.items()},
+                               row.total or 0)
+                for row in query.all()]
 
     def update_book_count_in_shop(self, book_id, shop_id, new_count):
-        """Обновляет количество книг в стоке магазина"""
+        """Обновляет количество книг в стоке магазина (в режиме журнала - движением-корректировкой)"""
         stock = self.get_stock(book_id, shop_id)
         if stock:
+            if self._stock_ledger_enabled():
+                self._run_in_transaction(lambda: self._set_stock_level(stock.id, new_count))
+                return True
             stock.count = new_count
             self.session.commit()
             return True
         return False
 
+    def _set_stock_level(self, stock_id, new_count):
+        """Режим журнала: доводит остаток до new_count одним движением adjust"""
+        self._lock_stocks([stock_id])
+        level = self._stock_levels([stock_id])[stock_id]
+        return self._append_stock_movements({stock_id: new_count - level}, 'adjust')[stock_id]
+
     def update_book_count_in_shop2(self, book_id, shop_id, new_count):
         stock = self.session.query(Stock).filter_by(
             id_book=book_id,
@@ -432,6 +1355,98 @@ class CRUDOperations:
         return False
 
 
+    def transfer_stock(self, from_shop_id, to_shop_id, lines):
+        """
+        Перемещает книги между магазинами одной транзакцией (все или ничего)
+        lines - [(book_id, quantity), ...]
+        Источник списывается одним условным UPDATE (остаток не уходит в минус),
+        получатель пополняется одним INSERT ... ON CONFLICT DO UPDATE (сток создается при отсутствии);
+        в режиме журнала стока - движениями transfer_out / transfer_in
+        Возвращает {id книги: новый остаток в магазине-получателе}
+        """
+        if from_shop_id == to_shop_id:
+            raise ValueError("Магазины отправителя и получателя совпадают")
+        if not lines:
+            raise ValueError("Список перемещения пуст")
+
+        # Одна книга может встречаться в списке несколько раз - перемещаем сумму
+        demand = defaultdict(int)
+        for book_id, quantity in lines:
+            if quantity <= 0:
+                raise ValueError("Количество должно быть больше 0")
+            demand[book_id] += quantity
+        # Строки стоков блокируются в одном порядке - меньше взаимных блокировок встречных перемещений
+        demand = sorted(demand.items())
+
+        def work():
+            if self._stock_ledger_enabled():
+                return self._transfer_stock_ledger(from_shop_id, to_shop_id, demand)
+
+            demand_rows = values(
+                column('id_book', Integer), column('qty', Integer), name='demand'
+            ).data(demand)
+            taken = self.session.execute(
+                update(Stock)
+                .where(Stock.id_shop == from_shop_id,
+                       Stock.id_book == demand_rows.c.id_book,
+                       Stock.count >= demand_rows.c.qty)
+                .values(count=Stock.count - demand_rows.c.qty)
+                .returning(Stock.id_book)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+
+            missing = {book_id for book_id, _ in demand} - set(taken)
+            if missing:
+                raise ValueError(f"Недостаточно книг в магазине-отправителе "
+                                 f"(ID книг: {', '.join(map(str, sorted(missing)))})")
+
+            stmt = pg_insert(Stock).values([
+                {'id_shop': to_shop_id, 'id_book': book_id, 'count': quantity}
+                for book_id, quantity in demand
+            ])
+            received = self.session.execute(
+                stmt.on_conflict_do_update(
+                    constraint='uq_stocks_shop_book',
+                    set_={'count': Stock.count + stmt.excluded['count']}
+                )
+                .returning(Stock.id_book, Stock.count)
+                .execution_options(synchronize_session=False)
+            ).all()
+            return dict(received)
+
+        return self._run_in_transaction(work)
+
+    def _transfer_stock_ledger(self, from_shop_id, to_shop_id, demand):
+        """Перемещение в режиме журнала: движения transfer_out / transfer_in вместо изменения счетчиков"""
+        quantities = dict(demand)
+        book_ids = list(quantities)
+        sources = dict(self.session.execute(
+            select(Stock.id_book, Stock.id).where(Stock.id_shop == from_shop_id, Stock.id_book.in_(book_ids))
+        ).all())
+        missing = set(book_ids) - set(sources)
+        if missing:
+            raise ValueError(f"Недостаточно книг в магазине-отправителе "
+                             f"(ID книг: {', '.join(map(str, sorted(missing)))})")
+        try:
+            self._append_stock_movements(
+                {sources[book_id]: -quantity for book_id, quantity in demand}, 'transfer_out')
+        except ValueError as e:
+            raise ValueError(f"Магазин-отправитель: {e}") from None
+
+        # Недостающие стоки получателя создаются с нулевым остатком
+        self.session.execute(
+            pg_insert(Stock)
+            .values([{'id_shop': to_shop_id, 'id_book': book_id, 'count': 0} for book_id in book_ids])
+            .on_conflict_do_nothing(constraint='uq_stocks_shop_book')
+        )
+        targets = dict(self.session.execute(
+            select(Stock.id, Stock.id_book).where(Stock.id_shop == to_shop_id, Stock.id_book.in_(book_ids))
+        ).all())
+        received = self._append_stock_movements(
+            {stock_id: quantities[book_id] for stock_id, book_id in targets.items()}, 'transfer_in')
+        return {targets[stock_id]: count for stock_id, count in received.items()}
+
+
     # Специальные запросы
     def get_books_by_publisher(self, publisher_id_or_name):
         """Получает все книги указанного издателя (по ID или имени)"""
@@ -440,7 +1455,7 @@ class CRUDOperations:
         if isinstance(publisher_id_or_name, int):
             query = query.filter(Publisher.id == publisher_id_or_name)
         else:
-            query = query.filter(Publisher.name.ilike(f"%{publisher_id_or_name}%"))
+            query = query.filter(self._text_match(Publisher.name, publisher_id_or_name))
 
         return query.all()
 
@@ -451,7 +1466,7 @@ class CRUDOperations:
         if isinstance(publisher_id_or_name, int):
             query = query.filter(Publisher.id == publisher_id_or_name)
         else:
-            query = query.filter(Publisher.name.ilike(f"%{publisher_id_or_name}%"))
+            query = query.filter(self._text_match(Publisher.name, publisher_id_or_name))
 
         return query.distinct().all()
 
@@ -461,103 +1476,406 @@ class CRUDOperations:
         return self.session.query(Shop).get(shop_id)
 
     def get_stock(self, book_id, shop_id):
-        """Получает сток по ID книги и магазина"""
-        return (self.session.query(Stock)
-                .filter_by(id_book=book_id, id_shop=shop_id)
-                .first())
-
+        """Получает сток по ID книги и магазина (в режиме журнала count - вычисленный остаток)"""
+        stock = (self.session.query(Stock)
+                 .filter_by(id_book=book_id, id_shop=shop_id)
+                 .first())
+        return self._with_stock_levels([stock])[0] if stock else None
 
-    def create_sale(self, stock_id, price, quantity=1, sale_date=None):
-        """Регистрирует продажу книги"""
-        sale = Sale(
-            id_stock=stock_id,
-            price=price,
-            quantity=quantity,
-            #sale_date=sale_date or datetime.utcnow()
-            sale_date=sale_date or datetime.now(timezone.utc)
-        )
-        self.session.add(sale)
 
-        # Обновляем количество книг в наличии
-        stock = self.session.query(Stock).get(stock_id)
-        if stock:
-            stock.count -= quantity
-            if stock.count < 0:
-                raise ValueError("Недостаточно книг в наличии")
+    def _run_in_transaction(self, work, attempts=TX_RETRY_ATTEMPTS):
+        """
+        Выполняет work() и фиксирует транзакцию
+        При конфликте сериализации или дедлоке откатывает и повторяет с паузой
+        """
+        for attempt in range(attempts):
+            try:
+                result = work()
+                self.session.commit()
+                return result
+            except DBAPIError as e:
+                self.session.rollback()
+                pgcode = getattr(e.orig, 'pgcode', None)
+                if pgcode not in RETRYABLE_PGCODES or attempt == attempts - 1:
+                    raise
+                print(f"Конфликт транзакции ({pgcode}), повтор {attempt + 1}")
+                self._sleep(TX_RETRY_DELAY * 2 ** attempt)
+            except Exception:
+                self.session.rollback()
+                raise
+
+    def _change_stock_count(self, stock_id, delta, reason='sale'):
+        """
+        Атомарно меняет остаток одним условным UPDATE ... RETURNING
+        (в режиме журнала - движением с причиной reason)
+        Остаток не может стать отрицательным: ValueError, если книг не хватает
+        """
+        if self._stock_ledger_enabled():
+            return self._append_stock_movements({stock_id: delta}, reason)[stock_id]
+        remaining = self.session.execute(
+            update(Stock)
+            .where(Stock.id == stock_id, Stock.count + delta >= 0)
+            .values(count=Stock.count + delta)
+            .returning(Stock.count)
+        ).scalar()
+        if remaining is None:
+            if self.session.get(Stock, stock_id) is None:
+                raise ValueError(f"Сток с ID {stock_id} не найден")
+            raise ValueError("Недостаточно книг в наличии")
+        return remaining
 
-        self.session.commit()
-        return sale
+    def create_sale(self, stock_id, price, quantity=1, sale_date=None):
+        """Регистрирует продажу книги: списание стока и запись продажи в одной короткой транзакции"""
+        if quantity <= 0:
+            raise ValueError("Количество должно быть больше 0")
+
+        def work():
+            # Списываем сток до вставки продажи - при нехватке продажа не создается
+            self._change_stock_count(stock_id, -quantity)
+            sale = Sale(
+                id_stock=stock_id,
+                price=price,
+                quantity=quantity,
+                #sale_date=sale_date or datetime.utcnow()
+                sale_date=sale_date or datetime.now(timezone.utc)
+            )
+            self.session.add(sale)
+            self.session.flush()
+            self._apply_sales_to_daily([sale.id])
+            return sale
 
-    def read_sales(self, shop_id=None, book_id=None, publisher_id=None, start_date=None, end_date=None):
-        """Получает список продаж с возможностью фильтрации"""
-        query = self.session.query(Sale).join(Stock).join(Book)
+        return self._run_in_transaction(work)
 
+    def create_receipt(self, lines, sale_date=None):
+        """
+        Оформляет чек из нескольких позиций одной транзакцией (все или ничего)
+        lines - [(stock_id, price, quantity), ...]
+        Остатки списываются одним UPDATE, продажи вставляются одним INSERT
+        Возвращает список ID созданных продаж
+        """
+        if not lines:
+            raise ValueError("Чек пуст")
+
+        # Одна книга может встречаться в чеке несколько раз - списываем сумму
+        demand = defaultdict(int)
+        for stock_id, price, quantity in lines:
+            if quantity <= 0:
+                raise ValueError("Количество должно быть больше 0")
+            demand[stock_id] += quantity
+
+        sale_date = sale_date or datetime.now(timezone.utc)
+
+        def work():
+            if self._stock_ledger_enabled():
+                # Журнал: списание движениями, счетчики стоков не меняются
+                self._append_stock_movements({stock_id: -quantity for stock_id, quantity in demand.items()}, 'sale')
+            else:
+                demand_rows = values(
+                    column('id', Integer), column('qty', Integer), name='demand'
+                ).data(list(demand.items()))
+                updated = self.session.execute(
+                    update(Stock)
+                    .where(Stock.id == demand_rows.c.id, Stock.count >= demand_rows.c.qty)
+                    .values(count=Stock.count - demand_rows.c.qty)
+                    .returning(Stock.id)
+                    .execution_options(synchronize_session=False)
+                ).scalars().all()
+
+                missing = set(demand) - set(updated)
+                if missing:
+                    raise ValueError(f"Недостаточно книг в наличии (ID стока: {', '.join(map(str, sorted(missing)))})")
+
+            sale_ids = self.session.execute(
+                insert(Sale)
+                .values([
+                    {'id_stock': stock_id, 'price': price, 'quantity': quantity, 'sale_date': sale_date}
+                    for stock_id, price, quantity in lines
+                ])
+                .returning(Sale.id)
+            ).scalars().all()
+            self._apply_sales_to_daily(sale_ids)
+            return sale_ids
+
+        return self._run_in_transaction(work)
+
+    def _filter_sales(self, query, shop_id=None, book_id=None, publisher_id=None, start_date=None, end_date=None):
+        """Применяет фильтры продаж к запросу (Stock уже присоединен, Book - если задан publisher_id)"""
         if shop_id:
             query = query.filter(Stock.id_shop == shop_id)
         if book_id:
             query = query.filter(Stock.id_book == book_id)
         if publisher_id:
-            query = query.join(Publisher).filter(Publisher.id == publisher_id)
+            query = query.filter(Book.id_publisher == publisher_id)
         if start_date:
             query = query.filter(Sale.sale_date >= start_date)
         if end_date:
             query = query.filter(Sale.sale_date <= end_date)
+        return query
+
+    def read_sales(self, shop_id=None, book_id=None, publisher_id=None, start_date=None, end_date=None, flat=False):
+        """
+        Получает список продаж с возможностью фильтрации
+        flat=True - строки SaleRow (id, title, shop, price, quantity, sale_date, id_stock)
+        одним запросом с join, без загрузки связей Sale -> Stock -> Book/Shop
+        """
+        if flat:
+            query = self._sales_rows_query()
+        else:
+            # Связи загружаются сразу - объекты читаются и после закрытия сессии операции
+            query = (self.session.query(Sale)
+                     .join(Sale.stock)
+                     .join(Stock.book)
+                     .options(contains_eager(Sale.stock).contains_eager(Stock.book),
+                              contains_eager(Sale.stock).selectinload(Stock.shop)))
+        query = self._filter_sales(query, shop_id, book_id, publisher_id, start_date, end_date)
+        query = query.order_by(Sale.sale_date.desc())
+        return make_rows(SaleRow, query) if flat else query.all()
+
+    def _sales_rows_query(self):
+        """Запрос плоских строк продаж (id, title, shop, price, quantity, sale_date, id_stock)"""
+        return (self.session.query(
+                    Sale.id,
+                    Book.title,
+                    Shop.name.label('shop'),
+                    Sale.price,
+                    Sale.quantity,
+                    Sale.sale_date,
+                    Sale.id_stock)
+                .select_from(Sale)
+                .join(Stock, Stock.id == Sale.id_stock)
+                .join(Book, Book.id == Stock.id_book)
+                .join(Shop, Shop.id == Stock.id_shop))
+
+    def read_sales_page(self, after=None, limit=PAGE_SIZE, **filters):
+        """
+        Страница продаж (плоские строки как у read_sales(flat=True))
+        Keyset-пагинация по (sale_date, id) по убыванию, продажи без даты - в конце
+        after - курсор (sale_date, id) последней строки предыдущей страницы
+        """
+        query = self._filter_sales(self._sales_rows_query(), **filters)
+        after_date, after_id = after if after else (None, None)
+
+        rows = []
+        if after is None or after_date is not None:
+            # Продажи с датой: обратный проход по индексу ix_sales_date_id от курсора
+            dated = query.filter(Sale.sale_date.isnot(None))
+            if after:
+                # Дублирующее условие по sale_date - для отсечения секций (по сравнению строк оно не работает)
+                dated = dated.filter(Sale.sale_date <= after_date,
+                                     tuple_(Sale.sale_date, Sale.id) < tuple_(after_date, after_id))
+            rows = dated.order_by(Sale.sale_date.desc(), Sale.id.desc()).limit(limit).all()
+            if len(rows) == limit:
+                return rows
+            after_id = None
+
+        # Хвост списка: продажи без даты
+        undated = query.filter(Sale.sale_date.is_(None))
+        if after_id is not None:
+            undated = undated.filter(Sale.id < after_id)
+        return rows + undated.order_by(Sale.id.desc()).limit(limit - len(rows)).all()
+
+    def iter_sales(self, batch_size=sales_export.EXPORT_BATCH_SIZE, **filters):
+        """
+        Потоковое чтение продаж (плоские строки как у read_sales(flat=True)) по возрастанию id
+        Фильтры - как у read_sales. Строки читаются серверным курсором пачками по batch_size,
+        поэтому память не растет с числом продаж
+        """
+        query = self._filter_sales(self._sales_rows_query(), **filters).order_by(Sale.id)
+        yield from query.yield_per(batch_size)
 
-        return query.order_by(Sale.sale_date.desc()).all()
+    def export_sales(self, path, fmt=None, batch_size=sales_export.EXPORT_BATCH_SIZE, **filters):
+        """
+        Выгружает продажи в файл CSV/JSONL/Parquet (формат - по расширению, если не задан fmt)
+        Фильтры - как у read_sales. Возвращает число выгруженных строк
+        """
+        fmt = sales_export.export_format(path, fmt)
+        rows = self.iter_sales(batch_size, **filters)
+        try:
+            return sales_export.write_sales(path, rows, fmt, batch_size)
+        finally:
+            # Закрываем сессию чтения и серверный курсор, даже если запись прервана
+            rows.close()
 
     def update_sale(self, sale_id, new_price=None, new_quantity=None):
         """Обновляет данные о продаже"""
-        sale = self.session.query(Sale).get(sale_id)
-        if not sale:
-            return False
-
-        # Рассчитываем разницу в количестве для корректировки запасов
-        quantity_diff = 0
-        if new_quantity is not None and new_quantity != sale.quantity:
-            quantity_diff = sale.quantity - new_quantity
+        if new_quantity is not None and new_quantity <= 0:
+            raise ValueError("Количество должно быть больше 0")
+        if new_price is not None and new_price < 0:
+            raise ValueError("Цена не может быть отрицательной")
+
+        def work():
+            # Блокируем продажу, чтобы параллельная правка не посчитала разницу от старого количества
+            sale = self.session.query(Sale).filter(Sale.id == sale_id).with_for_update().first()
+            if not sale:
+                return False
 
-        if new_price is not None:
-            sale.price = new_price
-        if new_quantity is not None:
-            sale.quantity = new_quantity
+            # Рассчитываем разницу в количестве для корректировки запасов
+            quantity_diff = 0
+            if new_quantity is not None and new_quantity != sale.quantity:
+                quantity_diff = sale.quantity - new_quantity
+
+            # Корректируем количество в запасах
+            if quantity_diff != 0:
+                self._change_stock_count(sale.id_stock, quantity_diff, 'sale_update')
+
+            # Витрина: вычитаем продажу в старом виде, после изменения добавляем в новом
+            self._apply_sales_to_daily([sale.id], sign=-1)
+            if new_price is not None:
+                sale.price = new_price
+            if new_quantity is not None:
+                sale.quantity = new_quantity
+            self.session.flush()
+            self._apply_sales_to_daily([sale.id])
+            return True
 
-        # Корректируем количество в запасах
-        if quantity_diff != 0:
-            stock = sale.stock
-            stock.count += quantity_diff
-            if stock.count < 0:
-                raise ValueError("Недостаточно книг в наличии")
-
-        self.session.commit()
-        return True
+        return self._sale_changed(sale_id, self._run_in_transaction(work))
 
     def delete_sale(self, sale_id):
         """Отменяет продажу и возвращает книги в запас"""
-        sale = self.session.query(Sale).get(sale_id)
-        if not sale:
-            return False
+        def work():
+            sale = self.session.query(Sale).filter(Sale.id == sale_id).with_for_update().first()
+            if not sale:
+                return False
 
-        # Возвращаем книги в запас
-        stock = sale.stock
-        stock.count += sale.quantity
+            # Возвращаем книги в запас
+            self._change_stock_count(sale.id_stock, sale.quantity, 'sale_return')
 
-        self.session.delete(sale)
-        self.session.commit()
-        return True
+            self._apply_sales_to_daily([sale.id], sign=-1)
+            self.session.delete(sale)
+            return True
+
+        return self._sale_changed(sale_id, self._run_in_transaction(work))
+
+    def _sale_changed(self, sale_id, changed):
+        """Помечает измененную продажу для перечитывания колоночным кэшем"""
+        if changed and self.sales_cache is not None:
+            self.sales_cache.mark_changed(sale_id)
+        return changed
 
     # Дополнительные методы для аналитики
+    def get_sales_summary(self, group_by=None, shop_id=None, book_id=None, publisher_id=None,
+                          start_date=None, end_date=None):
+        """
+        Возвращает агрегаты продаж, посчитанные на стороне БД (SUM/COUNT)
+        Фильтры те же, что у read_sales
+        group_by:
+        - None: словарь {'total_revenue', 'total_sold', 'sales_count'}
+        - 'shop': строки (shop_id, shop, total_revenue, total_sold, sales_count)
+        - 'publisher': строки (publisher_id, publisher, total_revenue, total_sold, sales_count)
+        - 'day': строки (day, total_revenue, total_sold, sales_count)
+        Для периода по границам суток итоги берутся из витрины sales_daily,
+        при подключенном sales_cache - считаются в памяти
+        """
+        if group_by not in SALES_GROUP_BY:
+            raise ValueError(f"Неизвестная группировка: {group_by}")
+        if self.sales_cache is not None:
+            return self.sales_cache.summary(group_by, shop_id, book_id, publisher_id, start_date, end_date)
+
+        facts = self._sales_facts(start_date, end_date)
+        if facts is not None:
+            return self._sales_summary_from_facts(facts, group_by, shop_id, book_id, publisher_id)
+
+        aggregates = [
+            func.coalesce(func.sum(Sale.price * Sale.quantity), 0).label('total_revenue'),
+            func.coalesce(func.sum(Sale.quantity), 0).label('total_sold'),
+            func.count(Sale.id).label('sales_count'),
+        ]
+
+        if group_by == 'shop':
+            keys = [Stock.id_shop.label('shop_id'), Shop.name.label('shop')]
+        elif group_by == 'publisher':
+            keys = [Book.id_publisher.label('publisher_id'), Publisher.name.label('publisher')]
+        elif group_by == 'day':
+            keys = [cast(Sale.sale_date, Date).label('day')]
+        else:
+            keys = []
+
+        query = self.session.query(*keys, *aggregates).select_from(Sale).join(Stock, Stock.id == Sale.id_stock)
+        if publisher_id or group_by == 'publisher':
+            query = query.join(Book, Book.id == Stock.id_book)
+        if group_by == 'shop':
+            query = query.join(Shop, Shop.id == Stock.id_shop)
+        elif group_by == 'publisher':
+            query = query.join(Publisher, Publisher.id == Book.id_publisher)
+
+        query = self._filter_sales(query, shop_id, book_id, publisher_id, start_date, end_date)
+        return self._sales_summary_result(query, keys)
+
+    def _sales_summary_from_facts(self, facts, group_by, shop_id=None, book_id=None, publisher_id=None):
+        """get_sales_summary по итогам витрины (см. _sales_facts)"""
+        aggregates = [
+            func.coalesce(func.sum(facts.c.revenue), 0).label('total_revenue'),
+            func.coalesce(func.sum(facts.c.quantity), 0).label('total_sold'),
+            func.coalesce(func.sum(facts.c.sales_count), 0).label('sales_count'),
+        ]
+
+        if group_by == 'shop':
+            keys = [facts.c.id_shop.label('shop_id'), Shop.name.label('shop')]
+        elif group_by == 'publisher':
+            keys = [Book.id_publisher.label('publisher_id'), Publisher.name.label('publisher')]
+        elif group_by == 'day':
+            keys = [facts.c.day.label('day')]
+        else:
+            keys = []
+
+        query = self.session.query(*keys, *aggregates).select_from(facts)
+        if publisher_id or group_by == 'publisher':
+            query = query.join(Book, Book.id == facts.c.id_book)
+        if group_by == 'shop':
+            query = query.join(Shop, Shop.id == facts.c.id_shop)
+        elif group_by == 'publisher':
+            query = query.join(Publisher, Publisher.id == Book.id_publisher)
+
+        if shop_id:
+            query = query.filter(facts.c.id_shop == shop_id)
+        if book_id:
+            query = query.filter(facts.c.id_book == book_id)
+        if publisher_id:
+            query = query.filter(Book.id_publisher == publisher_id)
+        return self._sales_summary_result(query, keys)
+
+    @staticmethod
+    def _sales_summary_result(query, keys):
+        if not keys:
+            row = query.one()
+            return {
+                'total_revenue': row.total_revenue,
+                'total_sold': row.total_sold,
+                'sales_count': row.sales_count,
+            }
+        return query.group_by(*keys).order_by(keys[0]).all()
+
     def get_total_sales(self, **filters):
         """Возвращает общую сумму продаж по фильтрам"""
-        sales = self.read_sales(**filters)
-        return sum(sale.price * sale.quantity for sale in sales)
+        return self.get_sales_summary(**filters)['total_revenue']
 
     def get_books_sold_count(self, **filters):
         """Возвращает количество проданных книг по фильтрам"""
-        sales = self.read_sales(**filters)
-        return sum(sale.quantity for sale in sales)
+        return self.get_sales_summary(**filters)['total_sold']
 
     def get_top_selling_books(self, limit=5, **filters):
-        """Возвращает самые продаваемые книги"""
+        """Возвращает самые продаваемые книги (для периода по границам суток - по витрине sales_daily)"""
+        if self.sales_cache is not None:
+            return self.sales_cache.top_selling_books(limit, **filters)
+        facts = self._sales_facts(filters.get('start_date'), filters.get('end_date'))
+        if facts is not None:
+            query = self.session.query(
+                Book.title,
+                Publisher.name.label('publisher'),
+                func.sum(facts.c.quantity).label('total_sold'),
+                func.sum(facts.c.revenue).label('total_revenue')
+            ).select_from(facts) \
+                .join(Book, Book.id == facts.c.id_book) \
+                .join(Publisher, Publisher.id == Book.id_publisher)
+            if 'shop_id' in filters:
+                query = query.filter(facts.c.id_shop == filters['shop_id'])
+            if 'publisher_id' in filters:
+                query = query.filter(Book.id_publisher == filters['publisher_id'])
+            return query.group_by(Book.title, Publisher.name) \
+                .order_by(func.sum(facts.c.quantity).desc()) \
+                .limit(limit) \
+                .all()
+
         query = self.session.query(
             Book.title,
             Publisher.name.label('publisher'),
@@ -582,6 +1900,41 @@ class CRUDOperations:
             .all()
 
 
+# Замеры времени, числа запросов и строк для каждого CRUD-метода
+query_stats.instrument_class(CRUDOperations)
+
+
+def _in_session_scope(method):
+    """
+    Метод CRUDOperations выполняется в короткой сессии _session_scope
+    Генератор получает свою сессию на время чтения: она не видна другим операциям потока,
+    поэтому их commit/rollback между шагами чтения не закрывают курсор генератора
+    """
+    if isgeneratorfunction(unwrap(method)):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._session is not None:
+                yield from method(self, *args, **kwargs)
+                return
+            session = self.db.Session()
+            try:
+                yield from method(self.with_session(session), *args, **kwargs)
+            finally:
+                session.close()
+    else:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._session_scope():
+                return method(self, *args, **kwargs)
+    return wrapper
+
+
+# Каждый публичный метод CRUDOperations - отдельная операция со своей сессией
+for _name, _method in list(vars(CRUDOperations).items()):
+    if not _name.startswith('_') and _name != 'with_session' and isfunction(_method):
+        setattr(CRUDOperations, _name, _in_session_scope(_method))
+
+
 if __name__ == '__main__':
     # тест
     db = DBSession(dbname="postgre4s", host="127.0.0.1", user="postgres", password="****", port=5432)
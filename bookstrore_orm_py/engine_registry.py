@@ -0,0 +1,81 @@
+# Общий на процесс реестр движков SQLAlchemy (и их пулов соединений)
+# Движок создается один раз на URL подключения, все DBSession/CRUDOperations берут его отсюда,
+# поэтому новое окно или проверка БД не открывают новое TCP-соединение с авторизацией
+
+import threading
+from sqlalchemy import create_engine
+import query_stats
+
+
+# Параметры пула по умолчанию (переопределяются configure, например из config.ini)
+DEFAULT_POOL_OPTIONS = {
+    'pool_size': 5,         # Постоянные соединения в пуле
+    'max_overflow': 10,     # Дополнительные соединения сверх pool_size при пиковой нагрузке
+    'pool_timeout': 30,     # Ожидание свободного соединения, секунды
+    'pool_pre_ping': True,  # Проверка соединения перед выдачей из пула
+    'pool_recycle': 3600,   # Переподключение соединений старше часа
+}
+
+_engines = {}
+_async_engines = {}
+_pool_options = dict(DEFAULT_POOL_OPTIONS)
+_lock = threading.Lock()
+
+
+def configure(**options):
+    """Задает параметры пула для движков, которые будут созданы после вызова"""
+    with _lock:
+        _pool_options.update(options)
+
+
+def get_engine(url, **options):
+    """Возвращает общий движок для URL, создавая его при первом обращении"""
+    with _lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = create_engine(url, **{**_pool_options, **options})
+            query_stats.instrument_engine(engine)
+            _engines[url] = engine
+        return engine
+
+
+def get_async_engine(url, **options):
+    """
+    Общий асинхронный движок (create_async_engine) для URL с драйвером asyncio, например postgresql+asyncpg://
+    Параметры пула - те же, что у синхронных движков
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    with _lock:
+        engine = _async_engines.get(url)
+        if engine is None:
+            engine = create_async_engine(url, **{**_pool_options, **options})
+            query_stats.instrument_engine(engine.sync_engine, explain=False)
+            _async_engines[url] = engine
+        return engine
+
+
+async def dispose_async_all():
+    """Закрывает пулы асинхронных движков (при остановке asyncio-сервиса)"""
+    with _lock:
+        engines = list(_async_engines.values())
+        _async_engines.clear()
+    for engine in engines:
+        await engine.dispose()
+
+
+def dispose(url):
+    """Закрывает пул и убирает движок для URL из реестра (например, перед удалением БД)"""
+    with _lock:
+        engine = _engines.pop(url, None)
+    if engine is not None:
+        engine.dispose()
+
+
+def dispose_all():
+    """Закрывает все пулы (при выходе из приложения)"""
+    with _lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        engine.dispose()
@@ -7,7 +7,7 @@
 # Параметр overlaps явно указывает SQLAlchemy, какие отношения пересекаются
 # можно упростить модели, оставив только один способ (например, только через secondary таблицу или только через прямые отношения)
 
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Float, DateTime
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, ForeignKey, Float, Date, DateTime, Index, UniqueConstraint, CheckConstraint
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from datetime import datetime, timezone
 
@@ -34,6 +34,10 @@ class Book(Base):
     id_publisher = Column(Integer, ForeignKey('publishers.id'), nullable=False)
     #author = Column(String(100))  # Добавляем поле автор
 
+    __table_args__ = (
+        Index('ix_books_id_publisher', 'id_publisher'),
+    )
+
     publisher = relationship("Publisher", back_populates="books")  #+
     stocks = relationship("Stock", back_populates="book", overlaps="shops")
     # Отношение к магазинам через stocks
@@ -79,6 +83,15 @@ class Stock(Base):
     id_shop = Column(Integer, ForeignKey('shops.id'), nullable=False)
     count = Column(Integer, default=0) # Остаток
     #location = Column(String(20))  # Склад Витрина
+
+    __table_args__ = (
+        # Одна запись стока на пару магазин-книга, индекс покрывает и выборки по магазину
+        UniqueConstraint('id_shop', 'id_book', name='uq_stocks_shop_book'),
+        Index('ix_stocks_id_book', 'id_book'),
+        # Последняя защита от отрицательного остатка (списания и так условные)
+        CheckConstraint('count >= 0', name='ck_stocks_count_nonnegative'),
+    )
+
     book = relationship("Book", back_populates="stocks", overlaps="shops")
     shop = relationship("Shop", back_populates="stocks")
     sales = relationship("Sale", back_populates="stock")
@@ -99,3 +112,94 @@ class Sale(Base):
     #sale_date = Column(DateTime, default=datetime.utcnow)
     sale_date = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     stock = relationship("Stock", back_populates="sales")
+
+    __table_args__ = (
+        Index('ix_sales_stock_date', 'id_stock', 'sale_date'),
+        # Порядок и поиск от курсора для постраничного списка продаж (sale_date DESC, id DESC)
+        Index('ix_sales_date_id', 'sale_date', 'id'),
+        # BRIN - компактный индекс для диапазонов дат, продажи пишутся по возрастанию даты
+        Index('ix_sales_sale_date_brin', 'sale_date', postgresql_using='brin'),
+    )
+
+
+# Витрина продаж по дням: итоги за день по паре магазин-книга
+# Поддерживается CRUDOperations при каждой записи продажи, полностью пересчитывается DBSession.rebuild_sales_daily
+class SalesDaily(Base):
+    __tablename__ = 'sales_daily'
+
+    day = Column(Date, primary_key=True)
+    id_shop = Column(Integer, ForeignKey('shops.id'), primary_key=True)
+    id_book = Column(Integer, ForeignKey('books.id'), primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)     # Продано книг
+    revenue = Column(Float, nullable=False, default=0)        # Выручка
+    sales_count = Column(Integer, nullable=False, default=0)  # Число продаж
+
+    __table_args__ = (
+        Index('ix_sales_daily_shop_day', 'id_shop', 'day'),
+        Index('ix_sales_daily_book_day', 'id_book', 'day'),
+    )
+
+
+# Журнал движения стока (необязательный режим, DBSession.enable_stock_ledger)
+# Продажи, поступления и корректировки только добавляют строки, счетчик Stock.count не меняется
+# Остаток = последний снимок (или Stock.count, если снимка нет) + движения после снимка
+class StockMovement(Base):
+    __tablename__ = 'stock_movements'
+
+    id = Column(BigInteger, primary_key=True)
+    id_stock = Column(Integer, ForeignKey('stocks.id', ondelete='CASCADE'), nullable=False)
+    delta = Column(Integer, nullable=False)        # Изменение остатка (+ поступление, - списание)
+    reason = Column(String(20), nullable=False)    # sale, receipt, transfer_in, adjust, ...
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Движения стока после снимка - диапазон по индексу
+        Index('ix_stock_movements_stock_id', 'id_stock', 'id'),
+    )
+
+
+# Снимок остатка: сумма всех движений стока до last_movement_id включительно
+# Пересчитывается сжатием журнала (DBSession.compact_stock_ledger)
+class StockSnapshot(Base):
+    __tablename__ = 'stock_snapshots'
+
+    id_stock = Column(Integer, ForeignKey('stocks.id', ondelete='CASCADE'), primary_key=True)
+    count = Column(Integer, nullable=False)
+    last_movement_id = Column(BigInteger, nullable=False, default=0)
+    taken_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+# Итоги продаж по дням в режиме журнала стока: продажа добавляет строку вместо обновления строки sales_daily,
+# поэтому параллельные продажи одной книги не ждут друг друга; сжатие журнала переносит итоги в sales_daily
+class SalesDailyPending(Base):
+    __tablename__ = 'sales_daily_pending'
+
+    id = Column(BigInteger, primary_key=True)
+    day = Column(Date, nullable=False)
+    id_shop = Column(Integer, ForeignKey('shops.id'), nullable=False)
+    id_book = Column(Integer, ForeignKey('books.id'), nullable=False)
+    quantity = Column(Integer, nullable=False)     # Итоги с вычитанием для правок и отмен продаж
+    revenue = Column(Float, nullable=False)
+    sales_count = Column(Integer, nullable=False)
+
+
+# Рекомендации по закупке для пары магазин-книга (пересчитываются restock_analytics.RestockAnalytics)
+class StockRecommendation(Base):
+    __tablename__ = 'stock_recommendations'
+
+    id_stock = Column(Integer, ForeignKey('stocks.id', ondelete='CASCADE'), primary_key=True)
+    id_shop = Column(Integer, ForeignKey('shops.id'), nullable=False)
+    id_book = Column(Integer, ForeignKey('books.id'), nullable=False)
+    on_hand = Column(Integer, nullable=False)           # Остаток на момент расчета
+    sold = Column(Integer, nullable=False)              # Продано за окно расчета
+    avg_daily = Column(Float, nullable=False)           # Скользящее среднее продаж в день за окно
+    forecast_daily = Column(Float, nullable=False)      # Прогноз продаж в день (экспоненциальное сглаживание)
+    sell_through = Column(Float, nullable=False)        # Доля продано / (продано + остаток)
+    days_of_cover = Column(Float)                       # На сколько дней хватит остатка (NULL - продаж нет)
+    reorder_point = Column(Float, nullable=False)       # Остаток, при котором пора заказывать
+    reorder_qty = Column(Integer, nullable=False)       # Рекомендуемый заказ, 0 - заказывать не нужно
+    computed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_stock_recommendations_shop_qty', 'id_shop', 'reorder_qty'),
+    )
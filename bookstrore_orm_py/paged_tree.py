@@ -0,0 +1,75 @@
+from tkinter import messagebox
+
+
+class TreePager:
+    """
+    Постраничная подгрузка строк в ttk.Treeview при прокрутке к концу списка
+    Страницы читаются в фоне через BackgroundExecutor
+    fetch_page(crud, cursor) -> список строк (cursor=None для первой страницы)
+    row_values(row) -> значения для tree.insert
+    cursor_of(row) -> курсор последней строки для следующей страницы
+    """
+
+    def __init__(self, tree, scrollbar, executor, row_values, cursor_of, page_size, tags=(), threshold=0.9):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.executor = executor
+        self.row_values = row_values
+        self.cursor_of = cursor_of
+        self.page_size = page_size
+        self.tags = tags
+        self.threshold = threshold  # Доля прокрутки, после которой грузим следующую страницу
+
+        self._fetch_page = None
+        self._cursor = None
+        self._has_more = False
+        self._loading = False
+
+        # Перехватываем прокрутку таблицы, чтобы узнать о приближении к концу
+        self.tree.configure(yscrollcommand=self._on_scroll)
+
+    def reset(self, fetch_page):
+        """Очищает таблицу и загружает первую страницу из нового источника (незавершенная загрузка отменяется)"""
+        self.executor.cancel(self)
+        for item in self.tree.get_children():
+            self.tree.delete(item)
+        self._fetch_page = fetch_page
+        self._cursor = None
+        self._has_more = True
+        self._loading = False
+        self.load_more()
+
+    def load_more(self):
+        """Загружает следующую страницу, если она есть"""
+        if not self._has_more or self._loading or self._fetch_page is None:
+            return
+        self._loading = True
+        fetch_page, cursor = self._fetch_page, self._cursor
+        self.executor.submit(
+            self,
+            lambda crud: fetch_page(crud, cursor),
+            on_done=self._append,
+            on_error=self._on_error
+        )
+
+    def _append(self, rows):
+        """Добавляет строки страницы в таблицу и сдвигает курсор"""
+        self._loading = False
+        for row in rows:
+            self.tree.insert("", "end", values=self.row_values(row), tags=self.tags)
+        if rows:
+            self._cursor = self.cursor_of(rows[-1])
+        # Неполная страница - данных больше нет
+        self._has_more = len(rows) >= self.page_size
+
+    def _on_error(self, error):
+        self._loading = False
+        self._has_more = False
+        messagebox.showerror("Ошибка", f"Не удалось загрузить данные: {error}", parent=self.tree)
+
+    def _on_scroll(self, first, last):
+        """yscrollcommand таблицы: двигает скроллбар и подгружает страницу у конца списка"""
+        self.scrollbar.set(first, last)
+        if float(last) >= self.threshold:
+            # Откладываем загрузку, чтобы не вставлять строки внутри обработчика прокрутки
+            self.tree.after_idle(self.load_more)
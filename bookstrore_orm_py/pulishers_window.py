@@ -114,7 +114,7 @@ class PublishersWindow:
             filters["name"] = search_name
 
         # Получаем издателей через CRUD
-        publishers = self.crud.read_publishers(**filters)
+        publishers = self.crud.read_publishers(flat=True, **filters)
 
         # Заполняем таблицу
         for pub in publishers:
@@ -0,0 +1,306 @@
+# Замеры времени SQL-запросов и CRUD-методов
+# - instrument_engine(engine): события before/after_cursor_execute движка SQLAlchemy
+# - instrument_class(cls): время, число запросов (round trips) и строк каждого публичного метода
+# Медленные запросы (дольше slow_ms) пишутся в лог вместе с планом EXPLAIN,
+# вся статистика выгружается в JSON через STATS.dump_json()
+
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы задержек, мс (последняя корзина - все, что дольше)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Сколько последних медленных запросов хранить
+SLOW_QUERIES_KEPT = 100
+# Запросы, для которых можно получить план (EXPLAIN без ANALYZE запрос не выполняет)
+EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+# Счетчики текущего CRUD-метода в этом потоке: [запросы, строки]
+_current_method = contextvars.ContextVar('query_stats_method', default=None)
+
+
+def normalize_statement(statement):
+    """Ключ запроса: параметры заменены на ?, многострочные VALUES свернуты, пробелы сжаты"""
+    statement = re.sub(r'%\(\w+\)s|%s', '?', statement)
+    statement = re.sub(r'\((?:\?(?:::[\w ]+)?,\s*)*\?(?:::[\w ]+)?\)(?:,\s*\((?:\?(?:::[\w ]+)?,\s*)*\?(?:::[\w ]+)?\))+',
+                       '(...)', statement)
+    return ' '.join(statement.split())
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с суммарным временем, числом строк и запросов"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.round_trips = 0
+
+    def add(self, ms, rows=0, round_trips=1):
+        index = 0
+        while index < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.rows += rows
+        self.round_trips += round_trips
+
+    def percentile(self, p):
+        """Оценка перцентиля по корзинам (верхняя граница корзины)"""
+        threshold = self.count * p / 100
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= threshold:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return 0.0
+
+    def to_dict(self):
+        labels = [f"<={b}" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'rows': self.rows,
+            'round_trips': self.round_trips,
+            'buckets': {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+
+class QueryStats:
+    """Накопитель статистики запросов и методов (общий для потоков)"""
+
+    def __init__(self, enabled=True, slow_ms=200, explain=True):
+        self.enabled = enabled
+        self.slow_ms = slow_ms  # Порог медленного запроса, мс
+        self.explain = explain  # Получать план EXPLAIN для медленных запросов
+        self._lock = threading.Lock()
+        self.reset()
+
+    def configure(self, enabled=None, slow_ms=None, explain=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+        if explain is not None:
+            self.explain = explain
+
+    def reset(self):
+        with self._lock:
+            self.statements = {}
+            self.methods = {}
+            self.slow_queries = deque(maxlen=SLOW_QUERIES_KEPT)
+            self.started_at = datetime.now()
+
+    def record_statement(self, statement, ms, rows):
+        key = normalize_statement(statement)
+        with self._lock:
+            self.statements.setdefault(key, LatencyHistogram()).add(ms, rows)
+
+        counters = _current_method.get()
+        if counters is not None:
+            counters[0] += 1
+            counters[1] += rows
+
+    def record_method(self, name, ms, round_trips, rows):
+        with self._lock:
+            self.methods.setdefault(name, LatencyHistogram()).add(ms, rows, round_trips)
+
+    def record_slow(self, statement, ms, plan):
+        entry = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'ms': round(ms, 3),
+            'statement': ' '.join(statement.split()),
+            'plan': plan,
+        }
+        with self._lock:
+            self.slow_queries.append(entry)
+        logger.warning("Медленный запрос %.1f мс: %s\n%s", ms, entry['statement'], plan or '')
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'dumped_at': datetime.now().isoformat(timespec='seconds'),
+                'slow_ms': self.slow_ms,
+                'methods': {name: h.to_dict() for name, h in sorted(self.methods.items())},
+                'statements': {sql: h.to_dict() for sql, h in
+                               sorted(self.statements.items(), key=lambda item: -item[1].total_ms)},
+                'slow_queries': list(self.slow_queries),
+            }
+
+    def dump_json(self, path=None):
+        """Статистика в JSON; при заданном path - еще и запись в файл"""
+        data = json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(data)
+        return data
+
+
+# Статистика процесса
+STATS = QueryStats()
+
+
+def explain_plan(cursor, statement, parameters):
+    """
+    План EXPLAIN для только что выполненного запроса на том же соединении
+    Внутри транзакции выполняется под SAVEPOINT, чтобы ошибка EXPLAIN не прервала транзакцию
+    """
+    if not EXPLAINABLE.match(statement):
+        return None
+    explain_cursor = None
+    try:
+        dbapi_conn = cursor.connection
+        in_transaction = not dbapi_conn.autocommit
+        explain_cursor = dbapi_conn.cursor()
+        if in_transaction:
+            explain_cursor.execute("SAVEPOINT query_stats_explain")
+        try:
+            explain_cursor.execute("EXPLAIN " + statement, parameters)
+            plan = "\n".join(row[0] for row in explain_cursor.fetchall())
+        except Exception as e:
+            if in_transaction:
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT query_stats_explain")
+            plan = f"EXPLAIN не выполнен: {e}"
+        if in_transaction:
+            explain_cursor.execute("RELEASE SAVEPOINT query_stats_explain")
+        return plan
+    except Exception as e:
+        return f"EXPLAIN не выполнен: {e}"
+    finally:
+        if explain_cursor is not None:
+            explain_cursor.close()
+
+
+# Статистика, в которую пишет каждый подключенный движок
+_engine_stats = {}
+
+
+# Движки, для медленных запросов которых EXPLAIN не выполняется
+_no_explain_engines = set()
+
+
+def instrument_engine(engine, stats=STATS, explain=True):
+    """
+    Подключает замеры ко всем запросам движка SQLAlchemy (повторный вызов ничего не делает)
+    explain=False - без EXPLAIN медленных запросов (курсоры асинхронных драйверов не дают DB-API соединение)
+    """
+    if engine in _engine_stats:
+        return
+    _engine_stats[engine] = stats
+    if not explain:
+        _no_explain_engines.add(engine)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_stats_start', []).append(time.perf_counter())
+    if context is not None:
+        context.query_stats_started = True  # Для _handle_error: время начала уже в списке
+
+
+def _handle_error(exception_context):
+    """Запрос завершился ошибкой - after_cursor_execute не будет, убираем его время начала"""
+    context = exception_context.execution_context
+    if context is not None and getattr(context, 'query_stats_started', False):
+        context.query_stats_started = False
+        exception_context.connection.info['query_stats_start'].pop()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_stats_start'].pop()
+    if context is not None:
+        context.query_stats_started = False
+    stats = _engine_stats.get(conn.engine, STATS)
+    if not stats.enabled:
+        return
+    ms = (time.perf_counter() - started) * 1000
+    rows = max(cursor.rowcount, 0)
+    stats.record_statement(statement, ms, rows)
+    if ms >= stats.slow_ms:
+        explain = stats.explain and not executemany and conn.engine not in _no_explain_engines
+        plan = explain_plan(cursor, statement, parameters) if explain else None
+        stats.record_slow(statement, ms, plan)
+
+
+def timed(name, method, stats=STATS):
+    """Обертка метода: время, запросы и строки; вложенные вызовы учитываются во внешнем методе"""
+    if inspect.isgeneratorfunction(method):
+        return _timed_generator(name, method, stats)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if not stats.enabled or _current_method.get() is not None:
+            return method(*args, **kwargs)
+        counters = [0, 0]
+        token = _current_method.set(counters)
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stats.record_method(name, (time.perf_counter() - started) * 1000, counters[0], counters[1])
+            _current_method.reset(token)
+    return wrapper
+
+
+def _timed_generator(name, method, stats):
+    """
+    Обертка генератора: замер по всей итерации, а не только по созданию генератора
+    Считается время шагов самого генератора - обработка строк вызывающим между шагами не входит
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if not stats.enabled or _current_method.get() is not None:
+            yield from method(*args, **kwargs)
+            return
+        counters = [0, 0]
+        elapsed = 0.0
+        generator = method(*args, **kwargs)
+        try:
+            while True:
+                # Счетчики метода видны только на время шага - запросы вызывающего между шагами не попадают
+                token = _current_method.set(counters)
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                    _current_method.reset(token)
+                yield item
+        finally:
+            generator.close()
+            stats.record_method(name, elapsed * 1000, counters[0], counters[1])
+    return wrapper
+
+
+def instrument_class(cls, stats=STATS):
+    """Оборачивает публичные методы класса замерами (имя метода в статистике - Класс.метод)"""
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith('_') or not inspect.isfunction(value) or hasattr(value, '__wrapped__'):
+            continue
+        setattr(cls, attr, timed(f"{cls.__name__}.{attr}", value, stats))
+    return cls
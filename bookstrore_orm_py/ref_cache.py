@@ -0,0 +1,74 @@
+# Кэш справочных сущностей (магазины, книги, издатели) для диалогов окон
+# В кэше лежат легкие неизменяемые записи, а не ORM-объекты: они не привязаны к сессии
+# и не перечитываются из БД после commit
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+ShopRef = namedtuple('ShopRef', 'id name')
+PublisherRef = namedtuple('PublisherRef', 'id name')
+BookRef = namedtuple('BookRef', 'id title id_publisher publisher')
+
+
+class TTLCache:
+    """Ограниченный по размеру LRU-кэш с временем жизни записей и счетчиками попаданий/промахов"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl  # секунды
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()  # Кэш общий для окна и фоновых потоков
+        self._generation = 0  # Растет при каждой инвалидации
+
+    def get(self, key, loader):
+        """
+        Возвращает значение из кэша, при промахе - loader() (None не кэшируется)
+        Если во время загрузки кэш инвалидировали, значение возвращается, но не сохраняется - оно могло устареть
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+        if value is not None:
+            with self._lock:
+                if generation != self._generation:
+                    return value
+                self._data[key] = (now + self.ttl, value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        """Удаляет запись"""
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def invalidate_kind(self, kind):
+        """Удаляет все записи вида (kind, ...)"""
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._data if key[0] == kind]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        """Счетчики кэша"""
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
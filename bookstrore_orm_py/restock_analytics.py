@@ -0,0 +1,191 @@
+# Рекомендации по закупке: точка заказа, оборачиваемость (sell-through) и запас в днях по парам магазин-книга
+# Остатки и дневные продажи всех пар за окно читаются двумя запросами COPY (продажи - из витрины sales_daily,
+# без нее - из sales), показатели считаются NumPy сразу по матрице пары x дни без цикла по парам,
+# результат заменяет содержимое stock_recommendations (COPY FROM STDIN) в той же транзакции
+# Запуск без интерфейса: python -m cli restock [--window-days 28 --lead-time-days 7 ...]
+
+import csv
+import io
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+from db_handler import stock_level
+from models import Stock, StockRecommendation
+
+
+# Параметры расчета по умолчанию
+DEFAULT_PARAMS = {
+    'window_days': 28,     # Окно истории продаж, дней
+    'ewma_alpha': 0.3,     # Вес последнего дня в прогнозе (экспоненциальное сглаживание)
+    'lead_time_days': 7,   # Срок поставки, дней
+    'review_days': 7,      # Период между заказами, дней
+    'service_z': 1.65,     # Коэффициент страхового запаса (1.65 - уровень сервиса около 95%)
+}
+
+RECOMMENDATION_COLUMNS = ('id_stock', 'id_shop', 'id_book', 'on_hand', 'sold', 'avg_daily', 'forecast_daily',
+                          'sell_through', 'days_of_cover', 'reorder_point', 'reorder_qty', 'computed_at')
+
+# Дневные продажи пар за окно: (id стока, номер дня в окне, продано)
+ROLLUP_SALES_SQL = """
+    SELECT st.id, d.day - DATE '{start}', sum(d.quantity)
+    FROM {daily} d
+    JOIN stocks st ON st.id_shop = d.id_shop AND st.id_book = d.id_book
+    WHERE d.day >= DATE '{start}' AND d.day < DATE '{end}'
+    GROUP BY 1, 2
+"""
+# Витрина в режиме журнала стока: вместе с еще не перенесенными итогами sales_daily_pending
+LEDGER_DAILY_SQL = """(
+    SELECT day, id_shop, id_book, quantity FROM sales_daily
+    UNION ALL
+    SELECT day, id_shop, id_book, quantity FROM sales_daily_pending
+)"""
+RAW_SALES_SQL = """
+    SELECT s.id_stock, s.sale_date::date - DATE '{start}', sum(s.quantity)
+    FROM sales s
+    WHERE s.sale_date >= DATE '{start}' AND s.sale_date < DATE '{end}'
+    GROUP BY 1, 2
+"""
+
+
+def forecast_weights(window, alpha):
+    """Веса экспоненциального сглаживания для дней окна (последний день - самый тяжелый), сумма 1"""
+    weights = alpha * (1 - alpha) ** np.arange(window - 1, -1, -1, dtype=np.float64)
+    return weights / weights.sum()
+
+
+def compute_recommendations(stock_ids, on_hand, sales, window_days, ewma_alpha, lead_time_days,
+                            review_days, service_z):
+    """
+    Векторный расчет по всем парам сразу
+    stock_ids - отсортированные id стоков, on_hand - остатки в том же порядке,
+    sales - массив строк (id стока, номер дня в окне, продано)
+    Возвращает словарь массивов показателей в порядке stock_ids
+    """
+    n = len(stock_ids)
+    matrix = np.zeros((n, window_days), dtype=np.float32)
+    if len(sales):
+        rows = np.searchsorted(stock_ids, sales[:, 0])
+        matrix[rows, sales[:, 1]] = sales[:, 2]
+
+    on_hand = on_hand.astype(np.float64)
+    sold = matrix.sum(axis=1, dtype=np.float64)
+    avg_daily = sold / window_days
+    forecast = matrix @ forecast_weights(window_days, ewma_alpha).astype(np.float32)
+    std_daily = matrix.std(axis=1, dtype=np.float64)
+
+    sell_through = np.divide(sold, sold + on_hand, out=np.zeros(n), where=(sold + on_hand) > 0)
+    days_of_cover = np.divide(on_hand, forecast, out=np.full(n, np.nan), where=forecast > 0)
+    # Точка заказа: спрос за срок поставки + страховой запас на разброс спроса
+    reorder_point = forecast * lead_time_days + service_z * std_daily * np.sqrt(lead_time_days)
+    # Заказ - до уровня точки заказа плюс спрос до следующего пересмотра
+    target = reorder_point + forecast * review_days
+    reorder_qty = np.where(on_hand <= reorder_point, np.ceil(np.maximum(target - on_hand, 0)), 0)
+
+    return {
+        'sold': sold.astype(np.int64),
+        'avg_daily': avg_daily,
+        'forecast_daily': forecast.astype(np.float64),
+        'sell_through': sell_through,
+        'days_of_cover': days_of_cover,
+        'reorder_point': reorder_point,
+        'reorder_qty': reorder_qty.astype(np.int64),
+    }
+
+
+class RestockAnalytics:
+    """Пересчет таблицы stock_recommendations по остаткам и продажам за окно"""
+
+    def __init__(self, db_session, progress=print, **params):
+        unknown = set(params) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise ValueError(f"Неизвестные параметры расчета: {', '.join(sorted(unknown))}")
+        self.engine = db_session.engine
+        self.params = {**DEFAULT_PARAMS, **params}
+        self.progress = progress
+
+    def run(self, today=None):
+        """
+        Пересчитывает рекомендации одной транзакцией (REPEATABLE READ - остатки и продажи из одного снимка)
+        Окно - window_days полных дней до today. Возвращает число записанных рекомендаций
+        """
+        end = today or date.today()
+        start = end - timedelta(days=self.params['window_days'])
+        started = time.perf_counter()
+        # БД, созданные до появления рекомендаций
+        StockRecommendation.__table__.create(self.engine, checkfirst=True)
+
+        conn = self.engine.raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                stocks = self._copy_out(cursor, self._stocks_query(cursor), 4)
+                cursor.execute("SELECT to_regclass('sales_daily') IS NOT NULL, "
+                               "to_regclass('sales_daily_pending') IS NOT NULL")
+                has_daily, has_pending = cursor.fetchone()
+                sales_sql = ROLLUP_SALES_SQL if has_daily else RAW_SALES_SQL
+                sales = self._copy_out(cursor, sales_sql.format(
+                    start=start.isoformat(), end=end.isoformat(),
+                    daily=LEDGER_DAILY_SQL if has_pending else 'sales_daily'), 3)
+                self.progress(f"Загружено стоков: {len(stocks)}, дневных продаж: {len(sales)} "
+                              f"({time.perf_counter() - started:.1f} с)")
+
+                result = compute_recommendations(stocks[:, 0], stocks[:, 3], sales, **self.params)
+                self.progress(f"Рекомендации рассчитаны ({time.perf_counter() - started:.1f} с)")
+
+                cursor.execute("TRUNCATE stock_recommendations")
+                cursor.copy_expert(
+                    f"COPY stock_recommendations ({', '.join(RECOMMENDATION_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                    self._csv(stocks, result)
+                )
+            conn.commit()
+            self.progress(f"Записано рекомендаций: {len(stocks)} ({time.perf_counter() - started:.1f} с)")
+            return len(stocks)
+
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _stocks_query(self, cursor):
+        """
+        Остатки всех стоков по возрастанию id (в режиме журнала - снимок + движения)
+        Незаданный остаток (count - NULL) считается нулевым - иначе пустое поле COPY не разберет loadtxt
+        """
+        cursor.execute("SELECT to_regclass('stock_snapshots') IS NOT NULL")
+        on_hand = stock_level() if cursor.fetchone()[0] else Stock.count
+        query = select(Stock.id, Stock.id_shop, Stock.id_book, func.coalesce(on_hand, 0)).order_by(Stock.id)
+        return str(query.compile(dialect=self.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+    @staticmethod
+    def _copy_out(cursor, query, columns):
+        """Результат запроса через COPY TO STDOUT -> целочисленный массив (строка на запись)"""
+        buffer = io.StringIO()
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buffer)
+        if not buffer.tell():
+            return np.empty((0, columns), dtype=np.int64)
+        buffer.seek(0)
+        return np.loadtxt(buffer, delimiter=',', dtype=np.int64, ndmin=2)
+
+    @staticmethod
+    def _csv(stocks, result):
+        """Строки рекомендаций в CSV для COPY (NaN запаса в днях -> NULL)"""
+        days_of_cover = [None if np.isnan(value) else value for value in result['days_of_cover'].round(2).tolist()]
+        computed_at = datetime.now().isoformat(sep=' ', timespec='seconds')
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(zip(
+            stocks[:, 0].tolist(), stocks[:, 1].tolist(), stocks[:, 2].tolist(), stocks[:, 3].tolist(),
+            result['sold'].tolist(),
+            result['avg_daily'].round(4).tolist(),
+            result['forecast_daily'].round(4).tolist(),
+            result['sell_through'].round(4).tolist(),
+            days_of_cover,
+            result['reorder_point'].round(2).tolist(),
+            result['reorder_qty'].tolist(),
+            [computed_at] * len(stocks),
+        ))
+        buffer.seek(0)
+        return buffer
@@ -0,0 +1,325 @@
+# Колоночный кэш продаж в памяти для аналитики (итоги, группировки, топ книг) без запросов к БД
+# Продажи хранятся массивами NumPy по колонкам: id, сток, книга, магазин, издатель, дата, количество, выручка
+# Обновление инкрементальное - дочитываются продажи с id больше последнего загруженного (один запрос),
+# не чаще refresh_interval секунд. Подключается к CRUDOperations (секция [Analytics] config.ini):
+#   crud.sales_cache = SalesColumnCache(crud)
+# после этого get_sales_summary, get_total_sales, get_books_sold_count и get_top_selling_books считаются в памяти
+# Правки и отмены продаж и смена издателя или названия книги через этот CRUDOperations учитываются при следующем обновлении,
+# изменения в обход него (другие процессы, массовая загрузка, архивирование секций) - только после clear()/reload()
+# Память - около 44 байт на продажу
+
+import threading
+import time
+from collections import namedtuple
+from datetime import timezone
+
+import numpy as np
+from sqlalchemy import or_, select
+
+from models import Book, Sale, Stock
+
+
+# Строк за одну выборку при загрузке
+LOAD_BATCH_SIZE = 50_000
+
+# Незакрытые транзакции могут записать продажи с id ниже уже загруженных: пропуски id
+# среди последних MAX_RECHECK_IDS перечитываются еще GAP_RECHECK_SECONDS секунд
+MAX_RECHECK_IDS = 10_000
+GAP_RECHECK_SECONDS = 60
+
+# Колонки кэша и их типы
+SALES_COLUMNS = {
+    'id': np.int64,
+    'id_stock': np.int32,
+    'id_book': np.int32,
+    'id_shop': np.int32,
+    'id_publisher': np.int32,
+    'sale_date': 'datetime64[s]',
+    'quantity': np.int32,
+    'revenue': np.float64,
+}
+
+# Строки результатов - те же поля, что у запросов CRUDOperations
+ShopSummaryRow = namedtuple('ShopSummaryRow', 'shop_id shop total_revenue total_sold sales_count')
+PublisherSummaryRow = namedtuple('PublisherSummaryRow', 'publisher_id publisher total_revenue total_sold sales_count')
+DaySummaryRow = namedtuple('DaySummaryRow', 'day total_revenue total_sold sales_count')
+TopBookRow = namedtuple('TopBookRow', 'title publisher total_sold total_revenue')
+
+
+def _empty_columns():
+    return {name: np.empty(0, dtype=dtype) for name, dtype in SALES_COLUMNS.items()}
+
+
+def _datetime64(value):
+    """Граница периода как datetime64 (время с часовым поясом переводится в UTC, как хранятся продажи)"""
+    if getattr(value, 'tzinfo', None) is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value)
+
+
+class SalesColumnCache:
+    """Продажи в памяти по колонкам с инкрементальным обновлением по Sale.id"""
+
+    def __init__(self, crud, refresh_interval=5.0, batch_size=LOAD_BATCH_SIZE):
+        self.crud = crud  # Имена книг, магазинов и издателей - через его кэш справочников
+        self.engine = crud.db.engine
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self._columns = _empty_columns()  # Заменяется целиком, читатели берут ссылку без блокировки
+        self._watermark = 0  # Наибольший загруженный Sale.id
+        self._recheck = {}  # id продажи -> до какого времени перечитывать (monotonic)
+        self._changed_books = set()  # Книги, у которых сменился издатель
+        self._titles = {}  # id книги -> название (для топа книг)
+        self._marks = 0  # Число пометок mark_changed/book_changed
+        self._epoch = 0  # Растет при clear() - загрузка, начатая до сброса, отбрасывается
+        self._refreshed_at = None
+        self._lock = threading.Lock()  # Состояние кэша; на время чтения из БД не держится
+        self._refresh_lock = threading.Lock()  # Обновления идут по одному
+
+    def __len__(self):
+        return len(self._columns['id'])
+
+    def mark_changed(self, sale_id):
+        """Продажа изменена или удалена - перечитать ее при следующем обновлении"""
+        with self._lock:
+            # Отрицательная метка уже истекла и у каждой пометки своя - перечитывается один раз после пометки
+            self._marks += 1
+            self._recheck[sale_id] = -self._marks
+            self._refreshed_at = None
+
+    def book_changed(self, book_id):
+        """Книга изменена (возможно, сменился издатель) - обновить издателя ее продаж при следующем обновлении"""
+        with self._lock:
+            self._marks += 1
+            self._changed_books.add(book_id)
+            self._titles.pop(book_id, None)
+            self._refreshed_at = None
+
+    def clear(self):
+        """Сбрасывает кэш, продажи загрузятся заново при следующем обращении"""
+        with self._lock:
+            self._columns = _empty_columns()
+            self._watermark = 0
+            self._recheck = {}
+            self._changed_books = set()
+            self._titles = {}
+            self._epoch += 1
+            self._refreshed_at = None
+
+    def reload(self):
+        """Полная перезагрузка кэша"""
+        self.clear()
+        return self.refresh()
+
+    def refresh(self, force=False):
+        """
+        Дочитывает новые продажи (и помеченные к перечитыванию) одним запросом
+        Без force - не чаще refresh_interval секунд. Возвращает число прочитанных строк
+        Чтение из БД идет без _lock: пометки mark_changed/book_changed записи не ждут конца загрузки,
+        новые колонки подменяются под блокировкой
+        """
+        with self._refresh_lock:
+            with self._lock:
+                now = time.monotonic()
+                if not force and self._refreshed_at is not None and now - self._refreshed_at < self.refresh_interval:
+                    return 0
+                epoch, marks = self._epoch, self._marks
+                watermark, columns = self._watermark, self._columns
+                pending = dict(self._recheck)
+                changed_books = set(self._changed_books)
+
+            recheck = np.fromiter(pending, dtype=np.int64, count=len(pending))
+            fetched = self._fetch(watermark, recheck)
+            if len(recheck):
+                # Старые версии перечитанных продаж (удаленные так и не вернутся)
+                keep = ~np.isin(columns['id'], recheck)
+                columns = {name: values[keep] for name, values in columns.items()}
+            if changed_books:
+                columns = self._update_publishers(columns, self._fetch_publishers(changed_books))
+            if len(fetched['id']):
+                columns = {name: np.concatenate((columns[name], fetched[name])) for name in SALES_COLUMNS}
+
+            with self._lock:
+                if self._epoch != epoch:
+                    return 0  # Кэш сброшен во время загрузки
+                self._track_gaps(fetched['id'], recheck, pending, now)
+                self._changed_books -= changed_books
+                self._columns = columns
+                if self._marks == marks:
+                    # Иначе во время загрузки появились новые пометки - следующее обращение обновит снова
+                    self._refreshed_at = now
+                return len(fetched['id'])
+
+    def _fetch(self, watermark, recheck):
+        """Продажи с id больше watermark или из recheck - словарь массивов по колонкам"""
+        condition = Sale.id > watermark
+        if len(recheck):
+            condition = or_(condition, Sale.id.in_(recheck.tolist()))
+        query = (select(Sale.id, Sale.id_stock, Stock.id_book, Stock.id_shop, Book.id_publisher,
+                        Sale.sale_date, Sale.quantity, Sale.price * Sale.quantity)
+                 .join(Stock, Stock.id == Sale.id_stock)
+                 .join(Book, Book.id == Stock.id_book)
+                 .where(condition)
+                 .order_by(Sale.id))
+
+        parts = {name: [] for name in SALES_COLUMNS}
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=self.batch_size).execute(query)
+            for rows in result.partitions():
+                for (name, dtype), values in zip(SALES_COLUMNS.items(), zip(*rows)):
+                    parts[name].append(np.array(values, dtype=dtype))
+        if not parts['id']:
+            return _empty_columns()
+        return {name: np.concatenate(chunks) for name, chunks in parts.items()}
+
+    def _fetch_publishers(self, book_ids):
+        """Текущие издатели книг: {id книги: id издателя}"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(Book.id, Book.id_publisher).where(Book.id.in_(list(book_ids))))
+            return dict(rows.all())
+
+    @staticmethod
+    def _update_publishers(columns, publishers):
+        """Колонки с новым издателем у продаж перечисленных книг (массивы не меняются на месте)"""
+        id_publisher = columns['id_publisher'].copy()
+        for book_id, publisher_id in publishers.items():
+            id_publisher[columns['id_book'] == book_id] = publisher_id
+        return {**columns, 'id_publisher': id_publisher}
+
+    def _track_gaps(self, ids, recheck, pending, now):
+        """
+        Сдвигает watermark и запоминает пропуски id среди последних загруженных
+        pending - пометки на момент начала загрузки; появившиеся или измененные после него остаются
+        """
+        found = set(recheck[np.isin(recheck, ids)].tolist()) if len(recheck) else set()
+        self._recheck = {sale_id: until for sale_id, until in self._recheck.items()
+                         if pending.get(sale_id) != until or (until > now and sale_id not in found)}
+
+        new_ids = ids[ids > self._watermark]
+        if not len(new_ids):
+            return
+        last_id = int(new_ids[-1])
+        first_checked = max(self._watermark, last_id - MAX_RECHECK_IDS)
+        gaps = np.setdiff1d(np.arange(first_checked + 1, last_id + 1), new_ids, assume_unique=True)
+        until = now + GAP_RECHECK_SECONDS
+        for sale_id in gaps.tolist():
+            self._recheck.setdefault(sale_id, until)
+        if len(self._recheck) > MAX_RECHECK_IDS:
+            self._recheck = dict(sorted(self._recheck.items())[-MAX_RECHECK_IDS:])
+        self._watermark = last_id
+
+    def _filtered(self, shop_id=None, book_id=None, publisher_id=None, start_date=None, end_date=None):
+        """Колонки продаж по фильтрам (как у CRUDOperations.read_sales)"""
+        self.refresh()
+        columns = self._columns
+        mask = np.ones(len(columns['id']), dtype=bool)
+        if shop_id:
+            mask &= columns['id_shop'] == shop_id
+        if book_id:
+            mask &= columns['id_book'] == book_id
+        if publisher_id:
+            mask &= columns['id_publisher'] == publisher_id
+        # Продажи без даты (NaT) при заданном периоде не входят, как и в SQL
+        if start_date:
+            mask &= columns['sale_date'] >= _datetime64(start_date)
+        if end_date:
+            mask &= columns['sale_date'] <= _datetime64(end_date)
+        if mask.all():
+            return columns
+        return {name: values[mask] for name, values in columns.items()}
+
+    @staticmethod
+    def _group(keys, columns):
+        """Группировка по ключу: уникальные ключи, выручка, продано, число продаж"""
+        unique, inverse = np.unique(keys, return_inverse=True)
+        revenue = np.bincount(inverse, weights=columns['revenue'], minlength=len(unique))
+        sold = np.bincount(inverse, weights=columns['quantity'], minlength=len(unique)).astype(np.int64)
+        count = np.bincount(inverse, minlength=len(unique))
+        return unique, revenue, sold, count
+
+    def summary(self, group_by=None, shop_id=None, book_id=None, publisher_id=None, start_date=None, end_date=None):
+        """Аналог CRUDOperations.get_sales_summary (те же группировки и поля результата)"""
+        columns = self._filtered(shop_id, book_id, publisher_id, start_date, end_date)
+        if group_by is None:
+            return {
+                'total_revenue': float(columns['revenue'].sum()),
+                'total_sold': int(columns['quantity'].sum(dtype=np.int64)),
+                'sales_count': len(columns['id']),
+            }
+
+        if group_by == 'shop':
+            unique, revenue, sold, count = self._group(columns['id_shop'], columns)
+            return [ShopSummaryRow(shop_id, self._shop_name(shop_id), *totals)
+                    for shop_id, *totals in zip(unique.tolist(), revenue.tolist(), sold.tolist(), count.tolist())]
+
+        if group_by == 'publisher':
+            unique, revenue, sold, count = self._group(columns['id_publisher'], columns)
+            names = {ref.id: ref.name for ref in self.crud.read_publisher_refs()}
+            return [PublisherSummaryRow(publisher_id, names.get(publisher_id), *totals)
+                    for publisher_id, *totals in zip(unique.tolist(), revenue.tolist(), sold.tolist(), count.tolist())]
+
+        if group_by == 'day':
+            # Продажи без даты - последней группой с day=None (как NULL в ORDER BY)
+            days = columns['sale_date'].astype('datetime64[D]')
+            undated = np.isnat(days)
+            dated = {name: values[~undated] for name, values in columns.items()}
+            unique, revenue, sold, count = self._group(days[~undated], dated)
+            rows = [DaySummaryRow(*row)
+                    for row in zip(unique.tolist(), revenue.tolist(), sold.tolist(), count.tolist())]
+            if undated.any():
+                rows.append(DaySummaryRow(None, float(columns['revenue'][undated].sum()),
+                                          int(columns['quantity'][undated].sum(dtype=np.int64)), int(undated.sum())))
+            return rows
+
+        raise ValueError(f"Неизвестная группировка: {group_by}")
+
+    def top_selling_books(self, limit=5, **filters):
+        """
+        Аналог CRUDOperations.get_top_selling_books: самые продаваемые книги по фильтрам
+        Группы - как в SQL-отчете: (название, издатель), одноименные книги одного издателя суммируются,
+        книги без издателя не входят
+        """
+        columns = self._filtered(**filters)
+        book_ids, first = np.unique(columns['id_book'], return_index=True)
+        keys = self._title_keys(book_ids.tolist(), columns['id_publisher'][first].tolist())
+        # Номер группы (название, издатель) для каждой продажи, -1 - книга без издателя
+        groups = {}
+        book_groups = np.array([groups.setdefault(key, len(groups)) if key else -1 for key in keys], dtype=np.intp)
+        sale_groups = book_groups[np.searchsorted(book_ids, columns['id_book'])] if len(keys) else book_groups
+        grouped = sale_groups >= 0
+        sold = np.bincount(sale_groups[grouped], weights=columns['quantity'][grouped],
+                           minlength=len(groups)).astype(np.int64)
+        revenue = np.bincount(sale_groups[grouped], weights=columns['revenue'][grouped], minlength=len(groups))
+
+        if len(groups) > limit:
+            # Частичная сортировка: только limit лучших
+            top = np.argpartition(-sold, limit - 1)[:limit] if limit > 0 else np.empty(0, dtype=np.intp)
+        else:
+            top = np.arange(len(groups))
+        top = top[np.argsort(-sold[top], kind='stable')]
+
+        names = list(groups)
+        return [TopBookRow(*names[group], total_sold, total_revenue)
+                for group, total_sold, total_revenue in zip(top.tolist(), sold[top].tolist(), revenue[top].tolist())]
+
+    def _title_keys(self, book_ids, publisher_ids):
+        """Ключи (название, имя издателя) книг; None - у книги нет издателя"""
+        with self._lock:
+            titles = dict(self._titles)
+            marks = self._marks
+        missing = [book_id for book_id in book_ids if book_id not in titles]
+        if missing:
+            # Названия книг, еще не встречавшихся в топе, - одним запросом
+            with self.engine.connect() as conn:
+                loaded = dict(conn.execute(select(Book.id, Book.title).where(Book.id.in_(missing))).all())
+            titles.update(loaded)
+            with self._lock:
+                if self._marks == marks:  # Иначе книгу могли изменить во время чтения
+                    self._titles.update(loaded)
+        publishers = {ref.id: ref.name for ref in self.crud.read_publisher_refs()}
+        return [(titles.get(book_id), publishers[publisher_id]) if publisher_id in publishers else None
+                for book_id, publisher_id in zip(book_ids, publisher_ids)]
+
+    def _shop_name(self, shop_id):
+        shop = self.crud.get_shop_ref(shop_id)
+        return shop.name if shop else None
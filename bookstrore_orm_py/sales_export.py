@@ -0,0 +1,173 @@
+# Потоковая выгрузка продаж в CSV, JSONL или Parquet
+# Строки читаются серверным курсором пачками (CRUDOperations.iter_sales) и сразу пишутся в файл,
+# поэтому память не зависит от числа продаж
+# Запуск без интерфейса:
+#   python sales_export.py sales.csv --start-date 2025-01-01 --end-date 2025-02-01 --shop-id 3
+
+import argparse
+import csv
+import importlib.util
+import json
+import os
+from datetime import datetime, time
+
+
+# Колонки выгрузки - плоские строки продаж (как read_sales(flat=True))
+SALES_EXPORT_COLUMNS = ('id', 'title', 'shop', 'price', 'quantity', 'sale_date', 'id_stock')
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+# Строк в пачке серверного курсора и в группе строк Parquet
+EXPORT_BATCH_SIZE = 5000
+
+
+def parquet_available():
+    """Установлен ли pyarrow (сам пакет тяжелый и импортируется только при выгрузке в Parquet)"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def export_format(path, fmt=None):
+    """Формат выгрузки: заданный явно или по расширению файла"""
+    fmt = (fmt or os.path.splitext(path)[1].lstrip('.') or 'csv').lower()
+    if fmt == 'ndjson':
+        fmt = 'jsonl'
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    if fmt == 'parquet' and not parquet_available():
+        raise ValueError("Для выгрузки в Parquet нужен пакет pyarrow")
+    return fmt
+
+
+def _write_csv(f, rows):
+    writer = csv.writer(f)
+    writer.writerow(SALES_EXPORT_COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def _write_jsonl(f, rows):
+    count = 0
+    for row in rows:
+        record = dict(zip(SALES_EXPORT_COLUMNS, row))
+        if record['sale_date'] is not None:
+            record['sale_date'] = record['sale_date'].isoformat()
+        f.write(json.dumps(record, ensure_ascii=False))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def _parquet_schema(pa):
+    return pa.schema([
+        ('id', pa.int64()),
+        ('title', pa.string()),
+        ('shop', pa.string()),
+        ('price', pa.float64()),
+        ('quantity', pa.int64()),
+        ('sale_date', pa.timestamp('us')),
+        ('id_stock', pa.int64()),
+    ])
+
+
+def _record_batch(pa, rows, schema):
+    """Пачка строк -> RecordBatch (по колонкам)"""
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+        schema=schema
+    )
+
+
+def _write_parquet(path, rows, batch_size):
+    """Пишет строки группами по batch_size, в памяти - не больше одной группы"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _parquet_schema(pa)
+    count = 0
+    batch = []
+    with pq.ParquetWriter(path, schema) as writer:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                writer.write_batch(_record_batch(pa, batch, schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_batch(_record_batch(pa, batch, schema))
+            count += len(batch)
+    return count
+
+
+def write_sales(path, rows, fmt=None, batch_size=EXPORT_BATCH_SIZE):
+    """Записывает плоские строки продаж в файл, возвращает число строк"""
+    fmt = export_format(path, fmt)
+    if fmt == 'parquet':
+        return _write_parquet(path, rows, batch_size)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            return _write_csv(f, rows)
+        return _write_jsonl(f, rows)
+
+
+def day_end(value):
+    """Последний момент дня: граница "по дату включительно" для фильтра sale_date <= end_date"""
+    return datetime.combine(value.date() if isinstance(value, datetime) else value, time.max)
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d') if len(value) == 10 else datetime.fromisoformat(value)
+
+
+def _parse_end_date(value):
+    """Конец периода: дата без времени включает весь день"""
+    return day_end(_parse_date(value)) if len(value) == 10 else _parse_date(value)
+
+
+def add_export_arguments(parser):
+    """Аргументы выгрузки (общие для этого скрипта и cli.py)"""
+    parser.add_argument('output', help="Файл выгрузки (формат - по расширению, если не задан --format)")
+    parser.add_argument('--format', choices=EXPORT_FORMATS)
+    parser.add_argument('--shop-id', type=int)
+    parser.add_argument('--book-id', type=int)
+    parser.add_argument('--publisher-id', type=int)
+    parser.add_argument('--start-date', type=_parse_date, help="YYYY-MM-DD или YYYY-MM-DDTHH:MM")
+    parser.add_argument('--end-date', type=_parse_end_date,
+                        help="YYYY-MM-DD (весь день включительно) или YYYY-MM-DDTHH:MM (включительно)")
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+
+
+def export_from_args(crud, args):
+    """Выгрузка по разобранным аргументам add_export_arguments, возвращает число строк"""
+    count = crud.export_sales(
+        args.output,
+        fmt=args.format,
+        batch_size=args.batch_size,
+        shop_id=args.shop_id,
+        book_id=args.book_id,
+        publisher_id=args.publisher_id,
+        start_date=args.start_date,
+        end_date=args.end_date
+    )
+    print(f"Выгружено продаж: {count} -> {args.output}")
+    return count
+
+
+def main(argv=None):
+    # db_handler сам импортирует этот модуль - подключаем его здесь, чтобы при запуске скриптом не было цикла
+    from config_handler import ConfigHandler
+    from db_handler import DBSession, CRUDOperations
+
+    parser = argparse.ArgumentParser(description="Выгрузка продаж в CSV/JSONL/Parquet")
+    add_export_arguments(parser)
+    args = parser.parse_args(argv)
+
+    db = DBSession(**ConfigHandler().get_db_config())
+    if not db.is_connected():
+        print("Нет подключения к БД")
+        return 1
+    export_from_args(CRUDOperations(db), args)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
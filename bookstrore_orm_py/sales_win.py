@@ -1,7 +1,9 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime, timezone
-from db_handler import CRUDOperations
+from db_handler import CRUDOperations, PAGE_SIZE
+from paged_tree import TreePager
+from bg_executor import BackgroundExecutor
 
 
 class SalesManagementWindow:
@@ -10,11 +12,17 @@ class SalesManagementWindow:
         self.crud = crud
         self.selected_shop = None
         self.selected_book = None
+        self.basket = []  # Позиции чека: (stock_id, price, quantity)
 
         self.window = tk.Toplevel(parent)
         self.window.title("Управление продажами книг")
         self.window.geometry("1000x700")
 
+        # Запросы к БД выполняются в фоне, пока идут - показываем индикатор загрузки
+        self.loading_label = tk.Label(self.window, text="", fg="gray")
+        self.loading_label.pack(side="bottom", anchor="w", padx=10)
+        self.executor = BackgroundExecutor(self.window, crud, on_busy=self._show_loading)
+
         # выбор магазина и книги
         self._create_selection_frame()
 
@@ -28,6 +36,10 @@ class SalesManagementWindow:
         self._load_shops()
         self._load_sales()
 
+    def _show_loading(self, busy):
+        """Индикатор фоновой загрузки"""
+        self.loading_label.config(text="Загрузка..." if busy else "")
+
     def _create_selection_frame(self):
         """Создает область выбора магазина и книги"""
         frame = tk.LabelFrame(self.window, text="Выбор магазина и книги", padx=5, pady=5)
@@ -78,13 +90,13 @@ class SalesManagementWindow:
             book_id = int(self.book_id_var.get()) if self.book_id_var.get() else None
 
             if shop_id:
-                shop = self.crud.get_shop_by_id(shop_id)
+                shop = self.crud.get_shop_ref(shop_id)
                 if shop:
                     self.selected_shop = shop
                     self.shop_combobox.set(f"{shop.name} (ID: {shop.id})")
 
             if book_id:
-                book = self.crud.get_book_by_id(book_id)
+                book = self.crud.get_book_ref(book_id)
                 if book:
                     # Находим сток для выбранного магазина (если он задан)
                     stock = self.crud.get_stock(book_id, self.selected_shop.id) if self.selected_shop else None
@@ -135,6 +147,15 @@ class SalesManagementWindow:
         self.tree.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
 
+        # Продажи подгружаются страницами при прокрутке
+        self.pager = TreePager(
+            self.tree, scrollbar, self.executor,
+            row_values=self._sale_values,
+            cursor_of=lambda sale: (sale.sale_date, sale.id),
+            page_size=PAGE_SIZE,
+            tags=("sale",)
+        )
+
         # Привязываем событие выбора
         self.tree.bind("<<TreeviewSelect>>", self._on_sale_selected)
 
@@ -172,9 +193,56 @@ class SalesManagementWindow:
         )
         self.cancel_btn.grid(row=0, column=5, padx=5)
 
+        # Режим корзины: позиции копятся в чек и проводятся одной транзакцией
+        self.basket_mode_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            frame,
+            text="Чек из нескольких позиций",
+            variable=self.basket_mode_var,
+            command=self._toggle_basket_mode
+        ).grid(row=0, column=6, padx=5)
+
+        self._create_basket_frame()
+
+    def _create_basket_frame(self):
+        """Создает область корзины (показывается в режиме чека)"""
+        self.basket_frame = tk.LabelFrame(self.window, text="Корзина", padx=5, pady=5)
+
+        self.basket_tree = ttk.Treeview(
+            self.basket_frame,
+            columns=("book", "price", "quantity"),
+            show="headings",
+            height=5
+        )
+        self.basket_tree.heading("book", text="Книга")
+        self.basket_tree.heading("price", text="Цена")
+        self.basket_tree.heading("quantity", text="Кол-во")
+        self.basket_tree.column("book", width=400)
+        self.basket_tree.column("price", width=80, anchor="center")
+        self.basket_tree.column("quantity", width=60, anchor="center")
+        self.basket_tree.pack(side="left", fill="x", expand=True)
+
+        btn_frame = tk.Frame(self.basket_frame)
+        btn_frame.pack(side="left", padx=10)
+
+        tk.Button(btn_frame, text="Оформить чек", command=self._checkout_basket).pack(fill="x", pady=2)
+        tk.Button(btn_frame, text="Очистить", command=self._clear_basket).pack(fill="x", pady=2)
+
+        self.basket_total_label = tk.Label(btn_frame, text="Итого: 0")
+        self.basket_total_label.pack(pady=2)
+
+    def _toggle_basket_mode(self):
+        """Показывает/скрывает корзину"""
+        if self.basket_mode_var.get():
+            self.basket_frame.pack(fill="x", padx=10, pady=5)
+            self.add_btn.config(text="В корзину")
+        else:
+            self.basket_frame.pack_forget()
+            self.add_btn.config(text="Добавить продажу")
+
     def _load_shops(self):
         """Загружает список магазинов в комбобокс"""
-        shops = self.crud.read_shops()
+        shops = self.crud.read_shop_refs()
         self.shops = {f"{shop.name} (ID: {shop.id})": shop for shop in shops}
         self.shop_combobox["values"] = list(self.shops.keys())
 
@@ -185,41 +253,38 @@ class SalesManagementWindow:
             self.book_combobox["values"] = []
             return
 
-        stocks = self.crud.read_stock_by_shop(shop_id)
+        stocks = self.crud.read_stock_by_shop(shop_id, flat=True)
         self.books = {
-            f"{stock.book.title} (ID: {stock.book.id}, в наличии: {stock.count})": stock
+            f"{stock.title} (ID: {stock.id_book}, в наличии: {stock.count})": stock
             for stock in stocks
         }
         self.book_combobox["values"] = list(self.books.keys())
 
     def _load_sales(self):
-        """Загружает список продаж"""
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
+        """Загружает первую страницу списка продаж, остальные - при прокрутке"""
         shop_id = self.selected_shop.id if self.selected_shop else None
         book_id = self.selected_book.id_book if self.selected_book else None
 
-        sales = self.crud.read_sales(shop_id=shop_id, book_id=book_id)
-
-        for sale in sales:
-            # Преобразуем datetime в строку с учетом часового пояса
-            sale_date = sale.sale_date.replace(tzinfo=None) if sale.sale_date else ""
-            date_str = sale_date.strftime("%Y-%m-%d %H:%M") if sale_date else ""
-
-            self.tree.insert("", "end",
-                             values=(
-                                 sale.id,
-                                 sale.stock.book.title,
-                                 sale.stock.shop.name,
-                                 sale.price,
-                                 sale.quantity,
-                                 #sale.sale_date.strftime("%Y-%m-%d %H:%M"),
-                                 date_str,
-                                 sale.id_stock
-                             ),
-                             tags=("sale",)
-                             )
+        # Плоские строки одним запросом, без ленивой загрузки sale.stock.book / sale.stock.shop
+        self.pager.reset(
+            lambda crud, after: crud.read_sales_page(after=after, shop_id=shop_id, book_id=book_id)
+        )
+
+    @staticmethod
+    def _sale_values(sale):
+        """Значения строки таблицы для продажи"""
+        # Преобразуем datetime в строку с учетом часового пояса
+        sale_date = sale.sale_date.replace(tzinfo=None) if sale.sale_date else ""
+        date_str = sale_date.strftime("%Y-%m-%d %H:%M") if sale_date else ""
+        return (
+            sale.id,
+            sale.title,
+            sale.shop,
+            sale.price,
+            sale.quantity,
+            date_str,
+            sale.id_stock
+        )
 
     def _on_shop_selected(self, event):
         """Обработчик выбора магазина"""
@@ -272,6 +337,10 @@ class SalesManagementWindow:
                 messagebox.showwarning("Ошибка", "Количество должно быть больше 0")
                 return
 
+            if self.basket_mode_var.get():
+                self._add_to_basket(price, quantity)
+                return
+
             sale = self.crud.create_sale(
                 stock_id=self.selected_book.id,
                 price=price,
@@ -287,6 +356,43 @@ class SalesManagementWindow:
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось добавить продажу: {e}")
 
+    def _add_to_basket(self, price, quantity):
+        """Добавляет выбранную книгу в корзину"""
+        self.basket.append((self.selected_book.id, price, quantity))
+        self.basket_tree.insert("", "end", values=(self.book_combobox.get(), price, quantity))
+        self._update_basket_total()
+
+    def _update_basket_total(self):
+        """Пересчитывает итог корзины"""
+        total = sum(price * quantity for _, price, quantity in self.basket)
+        self.basket_total_label.config(text=f"Итого: {total:.2f}")
+
+    def _clear_basket(self):
+        """Очищает корзину"""
+        self.basket = []
+        for item in self.basket_tree.get_children():
+            self.basket_tree.delete(item)
+        self._update_basket_total()
+
+    def _checkout_basket(self):
+        """Проводит все позиции корзины одним чеком"""
+        if not self.basket:
+            messagebox.showwarning("Ошибка", "Корзина пуста")
+            return
+
+        try:
+            sale_ids = self.crud.create_receipt(self.basket)
+            messagebox.showinfo("Успех", f"Чек оформлен, позиций: {len(sale_ids)}")
+            self._clear_basket()
+            self._load_sales()
+            if self.selected_shop:
+                self._load_books(self.selected_shop.id)
+
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e))
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось оформить чек: {e}")
+
     def _cancel_sale(self):
         """Отменяет выбранную продажу"""
         selected = self.tree.selection()
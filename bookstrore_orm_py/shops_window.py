@@ -115,7 +115,7 @@ class ShopsWindow:
             filters["name"] = search_name
 
         # Получаем издателей через CRUD
-        publishers = self.crud.read_shops(**filters)
+        publishers = self.crud.read_shops(flat=True, **filters)
 
         # Заполняем таблицу
         for pub in publishers:
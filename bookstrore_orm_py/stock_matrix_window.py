@@ -0,0 +1,111 @@
+import tkinter as tk
+from tkinter import ttk
+from db_handler import CRUDOperations, PAGE_SIZE
+from paged_tree import TreePager
+from bg_executor import BackgroundExecutor
+
+
+class StockMatrixWindow:
+    """Остатки всех книг по всем магазинам на одном экране: строка - книга, столбец - магазин"""
+
+    def __init__(self, parent, crud: CRUDOperations):
+        self.parent = parent
+        self.crud = crud
+
+        self.window = tk.Toplevel(parent)
+        self.window.title("Остатки по магазинам")
+        self.window.geometry("1100x650")
+
+        # Запросы к БД выполняются в фоне, пока идут - показываем индикатор загрузки
+        self.loading_label = tk.Label(self.window, text="", fg="gray")
+        self.loading_label.pack(side="bottom", anchor="w", padx=10)
+        self.executor = BackgroundExecutor(self.window, crud, on_busy=self._show_loading)
+
+        # Столбцы матрицы - все магазины (справочник из кэша)
+        self.shops = self.crud.read_shop_refs()
+        self.publishers = {"Все издатели": None}
+        self.publishers.update({publisher.name: publisher.id for publisher in self.crud.read_publisher_refs()})
+
+        self._create_filter_frame()
+        self._create_matrix_table()
+        self._load_matrix()
+
+    def _show_loading(self, busy):
+        """Индикатор фоновой загрузки"""
+        self.loading_label.config(text="Загрузка..." if busy else "")
+
+    def _create_filter_frame(self):
+        """Фильтры по издателю и названию"""
+        frame = tk.LabelFrame(self.window, text="Фильтр", padx=5, pady=5)
+        frame.pack(fill="x", padx=10, pady=5)
+
+        tk.Label(frame, text="Издатель:").grid(row=0, column=0, padx=5, sticky="e")
+        self.publisher_combobox = ttk.Combobox(frame, state="readonly", width=30,
+                                               values=list(self.publishers.keys()))
+        self.publisher_combobox.current(0)
+        self.publisher_combobox.grid(row=0, column=1, padx=5, sticky="w")
+        self.publisher_combobox.bind("<<ComboboxSelected>>", lambda event: self._load_matrix())
+
+        tk.Label(frame, text="Название:").grid(row=0, column=2, padx=5, sticky="e")
+        self.title_var = tk.StringVar()
+        title_entry = tk.Entry(frame, textvariable=self.title_var, width=30)
+        title_entry.grid(row=0, column=3, padx=5, sticky="w")
+        title_entry.bind("<Return>", lambda event: self._load_matrix())
+
+        tk.Button(frame, text="Показать", command=self._load_matrix).grid(row=0, column=4, padx=10)
+
+    def _create_matrix_table(self):
+        """Таблица: книга, издатель, всего, затем по столбцу на магазин"""
+        frame = tk.Frame(self.window)
+        frame.pack(fill="both", expand=True, padx=10, pady=5)
+
+        shop_columns = [f"shop_{shop.id}" for shop in self.shops]
+        scrollbar = ttk.Scrollbar(frame, orient="vertical")
+        x_scrollbar = ttk.Scrollbar(frame, orient="horizontal")
+        self.matrix_tree = ttk.Treeview(
+            frame,
+            columns=("id", "title", "publisher", "total", *shop_columns),
+            show="headings",
+            xscrollcommand=x_scrollbar.set
+        )
+        scrollbar.config(command=self.matrix_tree.yview)
+        x_scrollbar.config(command=self.matrix_tree.xview)
+
+        for column, text, width in (
+            ("id", "ID", 50),
+            ("title", "Название книги", 250),
+            ("publisher", "Издатель", 150),
+            ("total", "Всего", 70),
+        ):
+            self.matrix_tree.heading(column, text=text)
+            self.matrix_tree.column(column, width=width, anchor="w" if column in ("title", "publisher") else "center",
+                                    stretch=False)
+        for column, shop in zip(shop_columns, self.shops):
+            self.matrix_tree.heading(column, text=shop.name)
+            self.matrix_tree.column(column, width=90, anchor="center", stretch=False)
+
+        x_scrollbar.pack(side="bottom", fill="x")
+        self.matrix_tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+
+        # Строки подгружаются страницами при прокрутке
+        self.pager = TreePager(
+            self.matrix_tree, scrollbar, self.executor,
+            row_values=self._row_values,
+            cursor_of=lambda row: row.id,
+            page_size=PAGE_SIZE
+        )
+
+    def _row_values(self, row):
+        """Значения строки: пустая ячейка - книги в магазине нет в стоке"""
+        return (row.id, row.title, row.publisher, row.total,
+                *(row.counts.get(shop.id, "") for shop in self.shops))
+
+    def _load_matrix(self):
+        """Загружает первую страницу матрицы по фильтрам, остальные - при прокрутке"""
+        publisher_id = self.publishers.get(self.publisher_combobox.get())
+        title = self.title_var.get().strip() or None
+        self.pager.reset(
+            lambda crud, after_id: crud.read_stock_matrix(
+                publisher_id=publisher_id, title=title, after_id=after_id, limit=PAGE_SIZE)
+        )
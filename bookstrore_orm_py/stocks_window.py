@@ -1,6 +1,9 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from db_handler import CRUDOperations
+from db_handler import CRUDOperations, PAGE_SIZE
+from paged_tree import TreePager
+from bg_executor import BackgroundExecutor
+from stock_matrix_window import StockMatrixWindow
 
 
 class StockManagementWindow:
@@ -14,6 +17,11 @@ class StockManagementWindow:
         self.window.title("Управление стоком книг")
         self.window.geometry("900x600")
 
+        # Запросы к БД выполняются в фоне, пока идут - показываем индикатор загрузки
+        self.loading_label = tk.Label(self.window, text="", fg="gray")
+        self.loading_label.pack(side="bottom", anchor="w", padx=10)
+        self.executor = BackgroundExecutor(self.window, crud, on_busy=self._show_loading)
+
         # Верхняя часть - выбор магазина
         #self._create_shop_selection()
         self._create_selection_frame()
@@ -27,6 +35,10 @@ class StockManagementWindow:
         # Загружаем список магазинов
         self._load_shops()
 
+    def _show_loading(self, busy):
+        """Индикатор фоновой загрузки"""
+        self.loading_label.config(text="Загрузка..." if busy else "")
+
     # прежний вариант, не используется
     def _create_shop_selection(self):
         """область выбора магазина"""
@@ -89,13 +101,13 @@ class StockManagementWindow:
             book_id = int(self.book_id_var.get()) if self.book_id_var.get() else None
 
             if shop_id:
-                shop = self.crud.get_shop_by_id(shop_id)
+                shop = self.crud.get_shop_ref(shop_id)
                 if shop:
                     self.selected_shop = shop
                     self.shop_combobox.set(f"{shop.name} (ID: {shop.id})")
 
             if book_id:
-                book = self.crud.get_book_by_id(book_id)
+                book = self.crud.get_book_ref(book_id)
                 if book:
                     # Для стока нужен и магазин и книга
                     if self.selected_shop:
@@ -143,6 +155,15 @@ class StockManagementWindow:
         self.stock_tree.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
 
+        # Сток подгружается страницами при прокрутке
+        self.pager = TreePager(
+            self.stock_tree, scrollbar, self.executor,
+            row_values=lambda stock: (stock.id_book, stock.title, stock.count),
+            cursor_of=lambda stock: stock.id_book,
+            page_size=PAGE_SIZE,
+            tags=("stock",)
+        )
+
         # Привязываем событие выбора
         self.stock_tree.bind("<<TreeviewSelect>>", self._on_book_selected)
 
@@ -183,12 +204,27 @@ class StockManagementWindow:
         )
         self.remove_btn.grid(row=0, column=4, padx=5)
 
+        self.transfer_btn = tk.Button(
+            control_frame,
+            text="Переместить...",
+            command=self._transfer_stock,
+            state="disabled"
+        )
+        self.transfer_btn.grid(row=1, column=2, padx=5, pady=5)
+
         # Кнопка обновления данных
         tk.Button(control_frame, text="Обновить", command=self._load_stock).grid(row=0, column=5, padx=5)
 
+        # Остатки сразу по всем магазинам
+        tk.Button(
+            control_frame,
+            text="По всем магазинам",
+            command=lambda: StockMatrixWindow(self.parent, self.crud)
+        ).grid(row=0, column=6, padx=5)
+
     def _load_shops(self):
         """Загружает список магазинов в комбобокс"""
-        shops = self.crud.read_shops()
+        shops = self.crud.read_shop_refs()
         self.shops = {shop.name: shop for shop in shops}
         self.shop_combobox["values"] = list(self.shops.keys())
 
@@ -205,33 +241,14 @@ class StockManagementWindow:
             self._update_buttons_state()
 
     def _load_stock(self):
-        """Загружает книги в стоке выбранного магазина"""
+        """Загружает первую страницу стока выбранного магазина, остальные - при прокрутке"""
         if not self.selected_shop:
             return
 
-        # Очищаем таблицу
-        for item in self.stock_tree.get_children():
-            self.stock_tree.delete(item)
-
-        # Получаем сток для выбранного магазина
-        stocks = self.crud.read_stock_by_shop(self.selected_shop.id)
-        # Получаем сток для выбранного магазина с явным join книг
-        # stocks = (self.session.query(Stock)
-        #           .filter_by(id_shop=self.selected_shop.id)
-        #           .join(Book)
-        #           .all())
-
-        # Заполняем таблицу
-        for stock in stocks:
-            self.stock_tree.insert("", "end",
-                                   values=(
-                                       stock.id_book,
-                                       stock.book.title,
-                                       #stock.book.author  if hasattr(stock.book, 'author') else "Не указан",
-                                       stock.count
-                                   ),
-                                   tags=("stock",)
-                                   )
+        shop_id = self.selected_shop.id
+        self.pager.reset(
+            lambda crud, after_id: crud.read_stock_page(shop_id, after_id=after_id)
+        )
 
     def _on_book_selected(self, event):
         """Обработчик выбора книги в таблице"""
@@ -246,6 +263,7 @@ class StockManagementWindow:
         self.add_btn.config(state="normal" if shop_selected else "disabled")
         self.update_btn.config(state="normal" if (has_selection and shop_selected) else "disabled")
         self.remove_btn.config(state="normal" if (has_selection and shop_selected) else "disabled")
+        self.transfer_btn.config(state="normal" if (has_selection and shop_selected) else "disabled")
 
     def _add_to_stock(self):
         """Добавляет книгу в сток магазина"""
@@ -279,8 +297,8 @@ class StockManagementWindow:
                 return
 
             # Проверяем существование магазина и книги
-            shop = self.crud.get_shop_by_id(shop_id)
-            book = self.crud.get_book_by_id(book_id)
+            shop = self.crud.get_shop_ref(shop_id)
+            book = self.crud.get_book_ref(book_id)
 
             if not shop:
                 messagebox.showwarning("Ошибка", f"Магазин с ID {shop_id} не найден")
@@ -389,3 +407,54 @@ class StockManagementWindow:
             messagebox.showerror("Ошибка", "ID магазина и книги должны быть числами")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка при удалении: {str(e)}")
+
+
+    def _transfer_stock(self):
+        """Перемещает выбранные книги (по указанному количеству каждой) в другой магазин"""
+        selected = self.stock_tree.selection()
+        if not selected or not self.selected_shop:
+            return
+
+        try:
+            quantity = self.count_var.get()
+        except tk.TclError:
+            messagebox.showwarning("Ошибка", "Количество должно быть числом")
+            return
+        if quantity <= 0:
+            messagebox.showwarning("Ошибка", "Количество должно быть больше 0")
+            return
+
+        book_ids = [self.stock_tree.item(item)["values"][0] for item in selected]
+        from_shop = self.selected_shop
+        targets = {name: shop for name, shop in self.shops.items() if shop.id != from_shop.id}
+        if not targets:
+            messagebox.showwarning("Ошибка", "Нет других магазинов")
+            return
+
+        dialog = tk.Toplevel(self.window)
+        dialog.title("Перемещение книг")
+        dialog.transient(self.window)
+        dialog.grab_set()
+
+        tk.Label(dialog, text=f"Книг: {len(book_ids)}, по {quantity} шт. из магазина {from_shop.name}").grid(
+            row=0, column=0, columnspan=2, padx=10, pady=5, sticky="w")
+        tk.Label(dialog, text="В магазин:").grid(row=1, column=0, padx=10, pady=5, sticky="e")
+        target_combobox = ttk.Combobox(dialog, state="readonly", width=40, values=list(targets.keys()))
+        target_combobox.current(0)
+        target_combobox.grid(row=1, column=1, padx=10, pady=5)
+
+        def confirm():
+            to_shop = targets[target_combobox.get()]
+            try:
+                self.crud.transfer_stock(from_shop.id, to_shop.id, [(book_id, quantity) for book_id in book_ids])
+            except ValueError as e:
+                messagebox.showwarning("Ошибка", str(e), parent=dialog)
+                return
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось переместить книги: {e}", parent=dialog)
+                return
+            dialog.destroy()
+            messagebox.showinfo("Успех", f"Перемещено в магазин {to_shop.name}")
+            self._load_stock()
+
+        tk.Button(dialog, text="Переместить", command=confirm).grid(row=2, column=0, columnspan=2, pady=10)
@@ -1,6 +1,7 @@
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from query_stats import TimedCursor, instrument_class
 
 class ClientsDb:
     def __init__(self, dbname="postgres", host="127.0.0.1", user="postgres", password="pass", port=5432):
@@ -21,7 +22,8 @@ class ClientsDb:
                 host=self._host,
                 user=self._user,
                 password=self._password,
-                port=self._port
+                port=self._port,
+                cursor_factory=TimedCursor  # Замеры запросов
             )
             self.conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
             self.cursor = self.conn.cursor()
@@ -302,3 +304,7 @@ class ClientsDb:
         except psycopg2.Error as e:
             print(f"Ошибка при поиске клиентов: {e}")
             return []
+
+
+# Замеры времени, числа запросов и строк для каждого метода
+instrument_class(ClientsDb)
@@ -47,6 +47,14 @@ class ConfigHandler:
         with open(self.config_file, 'w') as configfile:
             self.config.write(configfile)
 
+    def get_stats_config(self):
+        """Возвращает настройки статистики запросов (секция Stats, необязательная)"""
+        return {
+            'enabled': self.config.getboolean('Stats', 'enabled', fallback=True),
+            'slow_ms': self.config.getfloat('Stats', 'slow_query_ms', fallback=200),
+            'explain': self.config.getboolean('Stats', 'explain', fallback=True),
+        }
+
     def get_language(self):
         """Возвращает текущий язык из конфига"""
         return self.config.get('General', 'language', fallback='ru')
@@ -5,10 +5,11 @@
 #from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
 import tkinter as tk
-from tkinter import messagebox, simpledialog, ttk
+from tkinter import messagebox, simpledialog, ttk, filedialog
 from config_handler import ConfigHandler
 from language_handler import LanguageHandler
 from clients_db import ClientsDb
+import query_stats
 
 class MainApplication:
 
@@ -16,6 +17,8 @@ class MainApplication:
         # Инициализация конфига
         self.config = ConfigHandler()
         self.db_config = self.config.get_db_config()
+        # Замеры запросов: порог медленного запроса и вывод плана
+        query_stats.STATS.configure(**self.config.get_stats_config())
 
         # Инициализация подключения к БД
         self.db_connection = None
@@ -128,6 +131,8 @@ class MainApplication:
         # Меню Настройки с подменю Язык
         self.settings_menu = tk.Menu(self.menu_bar, tearoff=0)
         self.settings_menu.add_command(label=self.lang.get_text("menu_settings_param"), command=self.show_settings)
+        self.settings_menu.add_command(label=self.lang.get_text("menu_settings_query_stats"),
+                                       command=self.save_query_stats)
         # Подменю выбора языка
         self.lang_menu = tk.Menu(self.settings_menu, tearoff=0)
         for lang_code in self.lang.get_supported_languages():
@@ -348,6 +353,21 @@ class MainApplication:
     def _set_len(self, s, max_length, padding_char):
         return (str(s) + padding_char * max_length)[:max_length]
 
+    def save_query_stats(self):
+        """Сохраняет статистику запросов (время, число запросов, медленные запросы) в JSON"""
+        path = filedialog.asksaveasfilename(
+            parent=self.root,
+            title=self.lang.get_text("menu_settings_query_stats"),
+            defaultextension=".json",
+            filetypes=[("JSON", "*.json")]
+        )
+        if not path:
+            return
+        try:
+            query_stats.STATS.dump_json(path)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить статистику: {e}")
+
     def about_prog(self):
         about_window = tk.Toplevel(self.root)
         about_window.title("О программе")
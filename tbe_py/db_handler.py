@@ -26,6 +26,7 @@ from typing import Optional, Union, List, Dict, Any, Tuple
 from contextlib import contextmanager
 from time import sleep
 from models import Base, User, Lesson, Phrase, UserWord, UserProgress
+import query_stats
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -78,6 +79,7 @@ class DBSession:
                 pool_recycle=3600,  # Переподключение каждый час
                 echo=False  # Логирование SQL (откл)
             )
+            query_stats.instrument_engine(self.engine)  # Замеры запросов
 
             # Проверка подключения через тестовый запрос
             with self.engine.connect() as test_conn:
@@ -327,6 +329,7 @@ class CRUDOperations:
                 pool_recycle=3600,
                 echo=False
             )
+            query_stats.instrument_engine(self.engine)  # Замеры запросов
             Base.metadata.create_all(self.engine)
             self.Session = sessionmaker(
                 bind=self.engine,
@@ -950,6 +953,10 @@ class CRUDOperations:
             return {}, str(e)
 
 
+# Замеры времени, числа запросов и строк для каждого CRUD-метода
+query_stats.instrument_class(CRUDOperations)
+
+
 if __name__ == '__main__':
     # тесты
     db = DBSession(dbname="lfl", host="127.0.0.1", user="postgres", password="***", port=5432)
@@ -1,8 +1,9 @@
 import tkinter as tk
-from tkinter import messagebox, simpledialog, ttk
+from tkinter import messagebox, simpledialog, ttk, filedialog
 from config_handler import ConfigHandler
 from language_handler import LanguageHandler
 from db_handler import DBSession, CRUDOperations
+import query_stats
 
 from users_win import UsersManagementWindow
 from lessons_window import LessonsManagementWindow
@@ -16,6 +17,8 @@ class MainApp:
         self.config = ConfigHandler()
         self.db_config = self.config.get_db_config()
         self.bot_config = self.config.get_bot_set()
+        # Замеры запросов: порог медленного запроса и вывод плана
+        query_stats.STATS.configure(**self.config.get_stats_config())
 
         # Инициализация подключения к БД
         self.db = None
@@ -162,6 +165,8 @@ class MainApp:
         # Меню Настройки с подменю Язык
         self.settings_menu = tk.Menu(self.menu_bar, tearoff=0)
         self.settings_menu.add_command(label=self.lang.get_text("menu_settings_param"), command=self.show_settings)
+        self.settings_menu.add_command(label=self.lang.get_text("menu_settings_query_stats"),
+                                       command=self.save_query_stats)
         # Подменю выбора языка
         self.lang_menu = tk.Menu(self.settings_menu, tearoff=0)
         for lang_code in self.lang.get_supported_languages():
@@ -399,6 +404,21 @@ class MainApp:
         status = self.language_bot.get_bot_status()
         print(status)
 
+    def save_query_stats(self):
+        """Сохраняет статистику запросов (время, число запросов, медленные запросы) в JSON"""
+        path = filedialog.asksaveasfilename(
+            parent=self.root,
+            title=self.lang.get_text("menu_settings_query_stats"),
+            defaultextension=".json",
+            filetypes=[("JSON", "*.json")]
+        )
+        if not path:
+            return
+        try:
+            query_stats.STATS.dump_json(path)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить статистику: {e}")
+
     def about_prog(self):
         about_window = tk.Toplevel(self.root)
         about_window.title("О программе")